@@ -0,0 +1,137 @@
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Sequence, Union
+
+import numpy as np
+
+from retrieval import HashingEmbedder
+
+
+def normalize_question(question: str) -> str:
+    """Case-, punctuation- and whitespace-insensitive form of a question"""
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+
+class AnswerCache:
+    """SQLite-backed cache of answers to questions about a document.
+
+    Entries are scoped by (document hash, model name, prompt version). A
+    lookup first tries the normalized question text, then the most similar
+    cached question in the same scope by embedding cosine similarity, which
+    must reach ``similarity_threshold``. Entries expire after ``ttl_seconds``
+    and the least recently used are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, path: str = ":memory:", embedder=None, similarity_threshold: float = 0.9,
+                 ttl_seconds: float = 7 * 24 * 3600, max_entries: int = 10000):
+        self.embedder = embedder or HashingEmbedder()
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.metrics = {'exact_hits': 0, 'semantic_hits': 0, 'misses': 0}
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY,
+                doc_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                question TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                justification TEXT,
+                source_snippet TEXT,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                UNIQUE (doc_hash, model, prompt_version, question)
+            );
+            CREATE INDEX IF NOT EXISTS answers_scope ON answers (doc_hash, model, prompt_version);
+            CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used);
+        """)
+
+    def get(self, doc_hash: str, question: str, model: Union[str, Sequence[str]],
+            prompt_version: str) -> Optional[Dict]:
+        """Cached answer for the question or a near duplicate of it, if any.
+
+        ``model`` may be a list of models tried in order, such as the tiers a
+        ``ModelRouter`` would try; the first with a match answers.
+        """
+        normalized = normalize_question(question)
+        oldest = time.time() - self.ttl_seconds
+        row = None
+        with self._lock:
+            for name in [model] if isinstance(model, str) else model:
+                scope = (doc_hash, name, prompt_version)
+                row = self._conn.execute(
+                    "SELECT id, answer, justification, source_snippet FROM answers "
+                    "WHERE doc_hash = ? AND model = ? AND prompt_version = ? AND question = ? AND created_at >= ?",
+                    (*scope, normalized, oldest)
+                ).fetchone()
+                kind = 'exact_hits'
+
+                if row is None:
+                    row = self._nearest(scope, normalized, oldest)
+                    kind = 'semantic_hits'
+
+                if row is not None:
+                    break
+
+            if row is None:
+                self.metrics['misses'] += 1
+                return None
+
+            self.metrics[kind] += 1
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), row[0]))
+            self._conn.commit()
+        return {'answer': row[1], 'justification': row[2], 'source_snippet': row[3]}
+
+    def put(self, doc_hash: str, question: str, model: str, prompt_version: str, result: Dict) -> None:
+        """Store an answer, keeping its justification and source snippet"""
+        normalized = normalize_question(question)
+        embedding = self.embedder.embed([normalized])[0].astype(np.float32).tobytes()
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (doc_hash, model, prompt_version, question, embedding, "
+                "answer, justification, source_snippet, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (doc_hash, model, prompt_version, normalized, embedding, result['answer'],
+                 result.get('justification'), result.get('source_snippet'), now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        """Hit/miss counters plus the number of stored answers"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        lookups = sum(self.metrics.values())
+        hits = self.metrics['exact_hits'] + self.metrics['semantic_hits']
+        return {**self.metrics, 'entries': entries, 'hit_rate': hits / lookups if lookups else 0.0}
+
+    def _nearest(self, scope, normalized: str, oldest: float):
+        rows = self._conn.execute(
+            "SELECT id, answer, justification, source_snippet, embedding FROM answers "
+            "WHERE doc_hash = ? AND model = ? AND prompt_version = ? AND created_at >= ?",
+            (*scope, oldest)
+        ).fetchall()
+        if not rows:
+            return None
+
+        matrix = np.frombuffer(b"".join(r[4] for r in rows), dtype=np.float32).reshape(len(rows), -1)
+        similarity = matrix @ self.embedder.embed([normalized])[0]
+        best = int(np.argmax(similarity))
+        if similarity[best] < self.similarity_threshold:
+            return None
+        return rows[best][:4]
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._conn.execute(
+            "DELETE FROM answers WHERE id IN ("
+            "SELECT id FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
@@ -0,0 +1,173 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+from assistant import DocumentError
+from instrumentation import profile_request, tracer
+from job_queue import JobNotFound
+from service import AssistantService, DocumentNotFound
+
+
+class AskRequest(BaseModel):
+    question: str
+    session_id: Optional[str] = None
+    stream: bool = False
+
+
+class ChallengeRequest(BaseModel):
+    session_id: Optional[str] = None
+
+
+class Submission(BaseModel):
+    question: str
+    user_answer: str
+    type: str = 'comprehension'
+
+
+class EvaluateRequest(BaseModel):
+    submissions: List[Submission]
+    session_id: Optional[str] = None
+
+
+class LibraryRequest(BaseModel):
+    directory: str
+
+
+def create_app(service: AssistantService = None) -> FastAPI:
+    """HTTP API over ``AssistantService``.
+
+    Run with ``uvicorn api:create_app --factory``; the service is built from
+    the environment (GEMINI_API_KEY, STATE_STORE_URL, ...) unless given.
+    Model calls block, so every endpoint hands its work to the thread pool.
+    """
+    if service is None:
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            raise RuntimeError("GEMINI_API_KEY is not set")
+        service = AssistantService.from_env(api_key)
+
+    app = FastAPI(title="Document-Aware AI Assistant")
+    app.state.service = service
+
+    @app.exception_handler(DocumentNotFound)
+    async def document_not_found(request: Request, exc: DocumentNotFound):
+        return JSONResponse(status_code=404, content={'detail': f"Unknown document {exc.args[0]}"})
+
+    @app.exception_handler(JobNotFound)
+    async def job_not_found(request: Request, exc: JobNotFound):
+        return JSONResponse(status_code=404, content={'detail': f"Unknown job {exc.args[0]}"})
+
+    @app.exception_handler(DocumentError)
+    async def document_error(request: Request, exc: DocumentError):
+        return JSONResponse(status_code=422, content={'detail': str(exc)})
+
+    @app.middleware("http")
+    async def profile_header(request: Request, call_next):
+        # "X-Profile: cpu" or "X-Profile: memory" profiles the request's top-level span
+        mode = request.headers.get("x-profile")
+        token = profile_request.set(mode) if mode in ('cpu', 'memory') else None
+        try:
+            return await call_next(request)
+        finally:
+            if token is not None:
+                profile_request.reset(token)
+
+    @app.get("/health")
+    async def health() -> Dict:
+        return {'status': 'ok'}
+
+    @app.post("/documents")
+    async def ingest(request: Request, filename: str, session_id: Optional[str] = None) -> Dict:
+        data = await request.body()
+        if not data:
+            raise HTTPException(status_code=400, detail="Empty upload")
+        return await run_in_threadpool(service.ingest, data, filename, session_id)
+
+    @app.post("/jobs/ingest")
+    async def start_ingest(request: Request, filename: str, session_id: Optional[str] = None) -> Dict:
+        # Returns at once; poll GET /jobs/{id} for progress
+        data = await request.body()
+        if not data:
+            raise HTTPException(status_code=400, detail="Empty upload")
+        return await run_in_threadpool(service.start_ingest, data, filename, session_id)
+
+    @app.post("/jobs/library")
+    async def start_library_ingest(body: LibraryRequest) -> Dict:
+        return await run_in_threadpool(service.start_library_ingest, body.directory)
+
+    @app.get("/jobs")
+    async def list_jobs(limit: int = 50) -> Dict:
+        return {'jobs': await run_in_threadpool(service.list_jobs, limit)}
+
+    @app.get("/jobs/{job_id}")
+    async def job(job_id: str) -> Dict:
+        return await run_in_threadpool(service.job, job_id)
+
+    @app.delete("/jobs/{job_id}")
+    async def cancel_job(job_id: str) -> Dict:
+        return await run_in_threadpool(service.cancel_job, job_id)
+
+    @app.get("/documents/{doc_hash}")
+    async def document(doc_hash: str) -> Dict:
+        return await run_in_threadpool(service.document, doc_hash)
+
+    @app.get("/documents/{doc_hash}/summary")
+    async def summary(doc_hash: str) -> Dict:
+        return {'summary': await run_in_threadpool(service.summary, doc_hash)}
+
+    @app.post("/documents/{doc_hash}/ask")
+    async def ask(doc_hash: str, body: AskRequest):
+        if not body.stream:
+            return await run_in_threadpool(service.ask, doc_hash, body.question, body.session_id)
+
+        # Fail before the stream starts if the document is unknown
+        await run_in_threadpool(service.session, doc_hash, body.session_id)
+        # One JSON object per line: partial sections, then the final answer
+        lines = (json.dumps(result) + "\n" for result in service.ask_stream(doc_hash, body.question, body.session_id))
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+
+    @app.post("/documents/{doc_hash}/challenge")
+    async def challenge(doc_hash: str, body: ChallengeRequest) -> Dict:
+        return {'questions': await run_in_threadpool(service.challenge, doc_hash, body.session_id)}
+
+    @app.post("/documents/{doc_hash}/evaluate")
+    async def evaluate(doc_hash: str, body: EvaluateRequest) -> Dict:
+        submissions = [s.model_dump() for s in body.submissions]
+        evaluations = await run_in_threadpool(service.evaluate, doc_hash, submissions, body.session_id)
+        return {'evaluations': evaluations}
+
+    @app.get("/documents/{doc_hash}/sessions/{session_id}")
+    async def session(doc_hash: str, session_id: str) -> Dict:
+        return await run_in_threadpool(service.session, doc_hash, session_id)
+
+    @app.delete("/documents/{doc_hash}/context")
+    async def invalidate_context(doc_hash: str) -> Dict:
+        return {'invalidated': await run_in_threadpool(service.invalidate_context, doc_hash)}
+
+    @app.get("/library")
+    async def library() -> Dict:
+        return await run_in_threadpool(service.library)
+
+    @app.post("/library/ingest")
+    async def ingest_library(body: LibraryRequest) -> Dict:
+        return await run_in_threadpool(service.ingest_library, body.directory)
+
+    @app.get("/stats")
+    async def stats() -> Dict:
+        return await run_in_threadpool(service.stats)
+
+    @app.get("/metrics")
+    async def metrics():
+        return PlainTextResponse(tracer.metrics.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+    @app.get("/metrics/spans")
+    async def spans(limit: int = 100):
+        # Most recent finished spans as JSON lines, including any profiles
+        return PlainTextResponse(tracer.recent_jsonl(limit), media_type="application/x-ndjson")
+
+    return app
@@ -0,0 +1,121 @@
+import json
+import urllib.error
+import urllib.request
+from typing import Callable, Dict, Iterator, List, Optional
+from urllib.parse import quote
+
+from assistant import DocumentError
+from job_queue import JobNotFound
+from service import DocumentNotFound
+
+
+class HttpAssistantClient:
+    """Client for the HTTP API with the same methods as ``AssistantService``.
+
+    Errors come back as the exceptions the service raises in-process
+    (``DocumentNotFound``, ``DocumentError``), so callers can use either.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 300):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def ingest(self, data: bytes, filename: str, session_id: Optional[str] = None) -> Dict:
+        return self._request('POST', f"/documents?{self._upload_query(filename, session_id)}", data,
+                             content_type='application/octet-stream')
+
+    def start_ingest(self, data: bytes, filename: str, session_id: Optional[str] = None) -> Dict:
+        return self._request('POST', f"/jobs/ingest?{self._upload_query(filename, session_id)}", data,
+                             content_type='application/octet-stream')
+
+    def job(self, job_id: str) -> Dict:
+        try:
+            return self._request('GET', f"/jobs/{quote(job_id)}")
+        except DocumentNotFound as e:
+            raise JobNotFound(job_id) from e
+
+    def cancel_job(self, job_id: str) -> Dict:
+        try:
+            return self._request('DELETE', f"/jobs/{quote(job_id)}")
+        except DocumentNotFound as e:
+            raise JobNotFound(job_id) from e
+
+    def list_jobs(self, limit: int = 50) -> List[Dict]:
+        return self._request('GET', f"/jobs?limit={limit}")['jobs']
+
+    def document(self, doc_hash: str) -> Dict:
+        return self._request('GET', f"/documents/{doc_hash}")
+
+    def summary(self, doc_hash: str) -> str:
+        return self._request('GET', f"/documents/{doc_hash}/summary")['summary']
+
+    def ask(self, doc_hash: str, question: str, session_id: Optional[str] = None) -> Dict:
+        return self._request('POST', f"/documents/{doc_hash}/ask",
+                             {'question': question, 'session_id': session_id})
+
+    def ask_stream(self, doc_hash: str, question: str, session_id: Optional[str] = None) -> Iterator[Dict]:
+        response = self._open('POST', f"/documents/{doc_hash}/ask",
+                              {'question': question, 'session_id': session_id, 'stream': True})
+        with response:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+
+    def challenge(self, doc_hash: str, session_id: Optional[str] = None) -> List[Dict]:
+        return self._request('POST', f"/documents/{doc_hash}/challenge", {'session_id': session_id})['questions']
+
+    def evaluate(self, doc_hash: str, submissions: List[Dict], session_id: Optional[str] = None) -> List[Dict]:
+        return self._request('POST', f"/documents/{doc_hash}/evaluate",
+                             {'submissions': submissions, 'session_id': session_id})['evaluations']
+
+    def session(self, doc_hash: str, session_id: Optional[str] = None) -> Dict:
+        if not session_id:
+            return {'history': [], 'summary': "", 'turn_count': 0, 'challenge_questions': []}
+        return self._request('GET', f"/documents/{doc_hash}/sessions/{quote(session_id)}")
+
+    def invalidate_context(self, doc_hash: str) -> bool:
+        return self._request('DELETE', f"/documents/{doc_hash}/context")['invalidated']
+
+    def stats(self) -> Dict:
+        return self._request('GET', "/stats")
+
+    def ingest_library(self, directory: str, progress: Optional[Callable[[int, int], None]] = None) -> Dict:
+        # The server doesn't report progress, so it is only signalled on completion
+        stats = self._request('POST', "/library/ingest", {'directory': directory})
+        if progress:
+            progress(1, 1)
+        return stats
+
+    def start_library_ingest(self, directory: str) -> Dict:
+        return self._request('POST', "/jobs/library", {'directory': directory})
+
+    def library(self) -> Dict:
+        return self._request('GET', "/library")
+
+    @staticmethod
+    def _upload_query(filename: str, session_id: Optional[str]) -> str:
+        query = f"filename={quote(filename)}"
+        return f"{query}&session_id={quote(session_id)}" if session_id else query
+
+    def _request(self, method: str, path: str, body=None, content_type: str = 'application/json'):
+        with self._open(method, path, body, content_type) as response:
+            return json.loads(response.read())
+
+    def _open(self, method: str, path: str, body=None, content_type: str = 'application/json'):
+        if body is not None and not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        request = urllib.request.Request(self.base_url + path, data=body, method=method,
+                                         headers={'Content-Type': content_type})
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            detail = e.read().decode('utf-8', errors='replace')
+            try:
+                detail = json.loads(detail).get('detail', detail)
+            except ValueError:
+                pass
+            if e.code == 404:
+                raise DocumentNotFound(detail) from e
+            if e.code in (400, 422):
+                raise DocumentError(detail) from e
+            raise
@@ -1,342 +1,14 @@
 import streamlit as st
-import PyPDF2
-import io
-import re
-import json
-from typing import List, Dict, Tuple
-import google.generativeai as genai
-from datetime import datetime
 import os
+import uuid
+from typing import Dict, Optional, Tuple
+from assistant import DocumentError
+from document_store import content_hash
+from job_queue import JobNotFound
+from service import AssistantService, DocumentNotFound
+from api_client import HttpAssistantClient
 
-
-class DocumentProcessor:
-    def __init__(self):
-        pass
-    
-    def extract_text_from_pdf(self, pdf_file) -> str:
-        """Extract text content from PDF file"""
-        try:
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text
-        except Exception as e:
-            st.error(f"Error reading PDF: {str(e)}")
-            return ""
-    
-    def extract_text_from_txt(self, txt_file) -> str:
-        """Extract text content from TXT file"""
-        try:
-            text = txt_file.read().decode('utf-8')
-            return text
-        except Exception as e:
-            st.error(f"Error reading TXT file: {str(e)}")
-            return ""
-    
-    def preprocess_text(self, text: str) -> Dict:
-        """Preprocess text and extract basic information"""
-        # Clean text
-        text = re.sub(r'\s+', ' ', text)
-        text = text.strip()
-        
-        # Basic splitting
-        sentences = [s.strip() for s in re.split(r'[.!?]+', text) if s.strip()]
-        paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
-        
-        return {
-            'full_text': text,
-            'sentences': sentences,
-            'paragraphs': paragraphs,
-            'word_count': len(text.split()),
-            'char_count': len(text)
-        }
-
-class GeminiDocumentAssistant:
-    def __init__(self, processed_data: Dict, api_key: str):
-        self.processed_data = processed_data
-        self.conversation_history = []
-        
-        # Configure Gemini
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        # Create a comprehensive document context
-        self.document_context = self.processed_data['full_text']
-    
-    def generate_summary(self, max_words: int = 150) -> str:
-        """Generate a summary using Gemini"""
-        try:
-            prompt = f"""
-            Please provide a concise summary of the following document in no more than {max_words} words. 
-            Focus on the main topics, key points, and overall purpose of the document.
-            
-            Document:
-            {self.document_context[:4000]}  # Limit context to avoid token limits
-            
-            Summary (max {max_words} words):
-            """
-            
-            response = self.model.generate_content(prompt)
-            return response.text.strip()
-            
-        except Exception as e:
-            st.error(f"Error generating summary: {str(e)}")
-            return "Unable to generate summary. Please check your API key and try again."
-    
-    def answer_question(self, question: str) -> Dict:
-        """Answer a question using Gemini with document context"""
-        try:
-            prompt = f"""
-            You are a GenAI assistant that analyzes user-uploaded documents. Your tasks are:
-
-Answer Questions: Respond to user queries with accurate, concise answers that may require inference.
-
-Ask Logic-Based Questions: Pose reasoning questions about the document and assess user responses.
-
-Justify Every Answer: Support all answers and feedback with direct references from the document (quotes, sections, or page numbers).
-
-Be clear, professional, and avoid assumptions not grounded in the text.
-            
-            DOCUMENT CONTENT:
-            {self.document_context}
-            
-            QUESTION: {question}
-            
-            Please provide your response in the following format:
-            ANSWER: [Your answer based on the document]
-            JUSTIFICATION: [Explain where in the document you found this information]
-            SOURCE_SNIPPET: [Quote the relevant portion from the document]
-            """
-            
-            response = self.model.generate_content(prompt)
-            response_text = response.text.strip()
-            
-            # Parse the response
-            answer = ""
-            justification = ""
-            source_snippet = ""
-            
-            lines = response_text.split('\n')
-            current_section = ""
-            
-            for line in lines:
-                line = line.strip()
-                if line.startswith('ANSWER:'):
-                    current_section = "answer"
-                    answer = line.replace('ANSWER:', '').strip()
-                elif line.startswith('JUSTIFICATION:'):
-                    current_section = "justification"
-                    justification = line.replace('JUSTIFICATION:', '').strip()
-                elif line.startswith('SOURCE_SNIPPET:'):
-                    current_section = "source"
-                    source_snippet = line.replace('SOURCE_SNIPPET:', '').strip()
-                elif line and current_section:
-                    if current_section == "answer":
-                        answer += " " + line
-                    elif current_section == "justification":
-                        justification += " " + line
-                    elif current_section == "source":
-                        source_snippet += " " + line
-            
-            # If parsing failed, use the full response as answer
-            if not answer:
-                answer = response_text
-                justification = "Generated by AI based on document content"
-                source_snippet = "Full document context considered"
-            
-            # Store in conversation history
-            self.conversation_history.append({
-                'question': question,
-                'answer': answer,
-                'justification': justification,
-                'source_snippet': source_snippet,
-                'timestamp': datetime.now().strftime("%H:%M:%S")
-            })
-            
-            return {
-                'answer': answer,
-                'justification': justification,
-                'source_snippet': source_snippet
-            }
-            
-        except Exception as e:
-            error_msg = f"Error processing question: {str(e)}"
-            return {
-                'answer': error_msg,
-                'justification': "Error occurred during processing",
-                'source_snippet': None
-            }
-    
-    def generate_challenge_questions(self) -> List[Dict]:
-        """Generate challenge questions using Gemini"""
-        try:
-            prompt = f"""
-            Based on the document provided below, generate exactly 3 challenging questions that test deep comprehension and logical reasoning. 
-            
-            Requirements for questions:
-            1. Each question should require understanding of the document content
-            2. Questions should test different aspects: comprehension, analysis, inference
-            3. Avoid simple factual recall - focus on understanding and reasoning
-            4. Each question should have a clear connection to specific parts of the document
-            
-            DOCUMENT CONTENT:
-            {self.document_context}
-            
-            Please provide your response in the following format for each question:
-            
-            QUESTION_1: [First challenging question]
-            TYPE_1: [comprehension/analysis/inference]
-            GUIDANCE_1: [Hint for answering this question]
-            
-            QUESTION_2: [Second challenging question]
-            TYPE_2: [comprehension/analysis/inference]
-            GUIDANCE_2: [Hint for answering this question]
-            
-            QUESTION_3: [Third challenging question]
-            TYPE_3: [comprehension/analysis/inference]
-            GUIDANCE_3: [Hint for answering this question]
-            """
-            
-            response = self.model.generate_content(prompt)
-            response_text = response.text.strip()
-            
-            # Parse the questions
-            questions = []
-            lines = response_text.split('\n')
-            
-            current_question = {}
-            for line in lines:
-                line = line.strip()
-                if line.startswith('QUESTION_'):
-                    if current_question:
-                        questions.append(current_question)
-                    current_question = {'question': line.split(':', 1)[1].strip() if ':' in line else line}
-                elif line.startswith('TYPE_'):
-                    current_question['type'] = line.split(':', 1)[1].strip() if ':' in line else 'comprehension'
-                elif line.startswith('GUIDANCE_'):
-                    current_question['answer_guidance'] = line.split(':', 1)[1].strip() if ':' in line else 'Think carefully about the document content'
-            
-            if current_question:
-                questions.append(current_question)
-            
-            # Ensure we have exactly 3 questions, create defaults if needed
-            while len(questions) < 3:
-                questions.append({
-                    'question': f"What are the main points discussed in this document? (Question {len(questions) + 1})",
-                    'type': 'comprehension',
-                    'answer_guidance': 'Consider the overall structure and key themes'
-                })
-            
-            return questions[:3]  # Return exactly 3 questions
-            
-        except Exception as e:
-            st.error(f"Error generating questions: {str(e)}")
-            return [
-                {
-                    'question': "What is the main topic or purpose of this document?",
-                    'type': 'comprehension',
-                    'answer_guidance': 'Look for the central theme and objective'
-                },
-                {
-                    'question': "What evidence or examples support the main arguments in the document?",
-                    'type': 'analysis',
-                    'answer_guidance': 'Identify specific supporting details and examples'
-                },
-                {
-                    'question': "What conclusions or implications can be drawn from the information presented?",
-                    'type': 'inference',
-                    'answer_guidance': 'Think about what the information suggests beyond what is explicitly stated'
-                }
-            ]
-    
-    def evaluate_answer(self, question: str, user_answer: str, question_type: str) -> Dict:
-        """Evaluate user's answer using Gemini"""
-        try:
-            prompt = f"""
-            You are evaluating a student's answer to a comprehension question based on a document.
-            
-            DOCUMENT CONTENT:
-            {self.document_context}
-            
-            QUESTION: {question}
-            QUESTION TYPE: {question_type}
-            
-            STUDENT'S ANSWER: {user_answer}
-            
-            Please evaluate the student's answer and provide:
-            1. A score from 0-100 based on accuracy and completeness
-            2. Constructive feedback explaining the score
-            3. Reference to specific parts of the document that support or contradict the answer
-            4. Suggestions for improvement if needed
-            
-            Provide your response in this format:
-            SCORE: [0-100]
-            FEEDBACK: [Detailed feedback on the answer quality]
-            JUSTIFICATION: [How the answer relates to the document content]
-            REFERENCE: [Specific part of document that's relevant]
-            """
-            
-            response = self.model.generate_content(prompt)
-            response_text = response.text.strip()
-            
-            # Parse the evaluation
-            score = "N/A"
-            feedback = ""
-            justification = ""
-            reference_content = ""
-            
-            lines = response_text.split('\n')
-            current_section = ""
-            
-            for line in lines:
-                line = line.strip()
-                if line.startswith('SCORE:'):
-                    current_section = "score"
-                    score_text = line.replace('SCORE:', '').strip()
-                    # Extract numeric score
-                    score_match = re.search(r'\b(\d+)\b', score_text)
-                    if score_match:
-                        score = f"{score_match.group(1)}%"
-                    else:
-                        score = score_text
-                elif line.startswith('FEEDBACK:'):
-                    current_section = "feedback"
-                    feedback = line.replace('FEEDBACK:', '').strip()
-                elif line.startswith('JUSTIFICATION:'):
-                    current_section = "justification"
-                    justification = line.replace('JUSTIFICATION:', '').strip()
-                elif line.startswith('REFERENCE:'):
-                    current_section = "reference"
-                    reference_content = line.replace('REFERENCE:', '').strip()
-                elif line and current_section:
-                    if current_section == "feedback":
-                        feedback += " " + line
-                    elif current_section == "justification":
-                        justification += " " + line
-                    elif current_section == "reference":
-                        reference_content += " " + line
-            
-            # Provide defaults if parsing failed
-            if not feedback:
-                feedback = response_text
-            if not justification:
-                justification = "Evaluated based on document content alignment"
-            
-            return {
-                'feedback': feedback,
-                'score': score,
-                'justification': justification,
-                'reference_content': reference_content
-            }
-            
-        except Exception as e:
-            return {
-                'feedback': f"Error evaluating answer: {str(e)}",
-                'score': "N/A",
-                'justification': "Evaluation failed due to technical error",
-                'reference_content': "Unable to provide reference"
-            }
+JOB_STAGE_LABELS = {'extract': "Reading pages", 'index': "Indexing", 'summarize': "Summarizing"}
 
 def get_api_key():
     """Get Gemini API key from Streamlit secrets"""
@@ -361,6 +33,126 @@ def get_api_key():
         """)
         return None
 
+def render_verification(verification: Optional[Dict], supporting_text: Optional[str] = None):
+    """Show whether a quote was found in the document, and where"""
+    if verification is None:
+        return
+    if verification['hallucinated']:
+        st.warning("⚠️ This quote could not be found in the document.")
+        if supporting_text:
+            st.caption("Closest passage in the document:")
+            st.write(supporting_text)
+        return
+    pages = verification['page']
+    if pages and verification['end_page'] != pages:
+        pages = f"{pages}–{verification['end_page']}"
+    location = f"page {pages}" if pages else f"characters {verification['start']}–{verification['end']}"
+    if verification['exact']:
+        st.caption(f"✅ Verbatim quote, {location}")
+    else:
+        st.caption(f"✅ Found at {location} ({verification['confidence']:.0%} match). The document reads:")
+        st.write(verification['text'])
+
+def render_evaluation(evaluation: Dict):
+    """Show a challenge answer evaluation, colored by score"""
+    st.write(f"**📊 Score:** {evaluation['score']}")
+    
+    if evaluation['score'] != 'N/A' and '%' in evaluation['score']:
+        try:
+            score_val = float(evaluation['score'].replace('%', ''))
+            if score_val >= 80:
+                st.success(f"🎉 {evaluation['feedback']}")
+            elif score_val >= 60:
+                st.warning(f"👍 {evaluation['feedback']}")
+            else:
+                st.error(f"📝 {evaluation['feedback']}")
+        except:
+            st.info(evaluation['feedback'])
+    else:
+        st.info(evaluation['feedback'])
+    
+    st.write(f"**🔍 AI Analysis:** {evaluation['justification']}")
+    
+    if evaluation.get('reference_content'):
+        with st.expander("📖 Relevant Document Content"):
+            st.write(evaluation['reference_content'])
+            render_verification(evaluation.get('reference_verification'), evaluation.get('supporting_text'))
+
+def job_progress(job: Dict) -> Tuple[float, str]:
+    """Progress bar fraction and label for a background job"""
+    label = JOB_STAGE_LABELS.get(job['stage'], "Waiting to start")
+    if not job['total']:
+        return 0.0, label
+    return job['done'] / job['total'], f"{label}: {job['done']} of {job['total']}"
+
+def adopt_document(info: Dict):
+    """Make a processed (or partly processed) document the current one"""
+    st.session_state.document_hash = info['document_hash']
+    st.session_state.processed_data = info
+    st.session_state.document_processed = True
+    st.session_state.document_summary = info['summary']
+    st.session_state.document_warnings = info['warnings']
+
+@st.fragment(run_every=1.0)
+def ingest_progress(client):
+    """Poll the background ingest job; the rest of the page stays usable meanwhile"""
+    try:
+        job = client.job(st.session_state.ingest_job)
+    except JobNotFound:
+        st.session_state.ingest_job = None
+        return
+    
+    result = job['result']
+    if job['status'] in ('queued', 'running'):
+        fraction, text = job_progress(job)
+        st.progress(fraction, text=text)
+        if st.button("✖️ Cancel processing"):
+            client.cancel_job(job['id'])
+        # Newly indexed pages (or the finished index) can be asked about right away
+        if result and result != st.session_state.processed_data:
+            adopt_document(result)
+            st.rerun()
+        return
+    
+    st.session_state.ingest_job = None
+    if job['status'] == 'done':
+        adopt_document(result)
+    elif job['status'] == 'failed':
+        st.session_state.ingest_error = job['error']
+    if job['status'] != 'done' and st.session_state.document_hash == job['key']:
+        st.session_state.document_processed = False
+        st.session_state.document_hash = None
+        st.session_state.current_mode = None
+    st.rerun()
+
+@st.fragment(run_every=1.0)
+def library_progress(client):
+    """Poll the background library indexing job"""
+    try:
+        job = client.job(st.session_state.library_job)
+    except JobNotFound:
+        st.session_state.library_job = None
+        return
+    
+    if job['status'] in ('queued', 'running'):
+        fraction, text = job_progress(job)
+        st.progress(fraction, text=text.replace("Indexing", "Indexing files"))
+        if st.button("✖️ Cancel indexing"):
+            client.cancel_job(job['id'])
+        return
+    
+    st.session_state.library_job = None
+    st.session_state.library_result = job
+    st.rerun()
+
+@st.cache_resource
+def get_assistant_client(api_key: str = None):
+    """Process-wide assistant: the HTTP API at ASSISTANT_API_URL, or an in-process service"""
+    api_url = os.environ.get("ASSISTANT_API_URL")
+    if api_url:
+        return HttpAssistantClient(api_url)
+    return AssistantService.from_env(api_key)
+
 def main():
     st.set_page_config(
         page_title="Document-Aware AI Assistant with Gemini",
@@ -372,25 +164,112 @@ def main():
    
     st.markdown("Upload a document and interact with it through intelligent Q&A or challenge mode!")
     
-    # Get API Key from secrets
-    api_key = get_api_key()
+    # The API server holds the Gemini key when the UI runs as its client
+    if os.environ.get("ASSISTANT_API_URL"):
+        api_key = None
+    else:
+        # Get API Key from secrets
+        api_key = get_api_key()
+        
+        if not api_key:
+            return
     
-    if not api_key:
-        return
+    client = get_assistant_client(api_key)
     
     # Initialize session state
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
     if 'document_processed' not in st.session_state:
         st.session_state.document_processed = False
-    if 'assistant' not in st.session_state:
-        st.session_state.assistant = None
     if 'processed_data' not in st.session_state:
         st.session_state.processed_data = None
     if 'challenge_questions' not in st.session_state:
         st.session_state.challenge_questions = []
+    if 'challenge_evaluations' not in st.session_state:
+        st.session_state.challenge_evaluations = {}
     if 'current_mode' not in st.session_state:
         st.session_state.current_mode = None
     if 'document_summary' not in st.session_state:
         st.session_state.document_summary = ""
+    if 'document_hash' not in st.session_state:
+        st.session_state.document_hash = None
+    if 'corpus_mode' not in st.session_state:
+        st.session_state.corpus_mode = False
+    if 'document_warnings' not in st.session_state:
+        st.session_state.document_warnings = []
+    if 'ingest_job' not in st.session_state:
+        st.session_state.ingest_job = None
+    if 'ingest_key' not in st.session_state:
+        st.session_state.ingest_key = None
+    if 'ingest_error' not in st.session_state:
+        st.session_state.ingest_error = None
+    if 'library_job' not in st.session_state:
+        st.session_state.library_job = None
+    if 'library_result' not in st.session_state:
+        st.session_state.library_result = None
+    
+    # The document may have been evicted from the cache (or the library re-indexed) since the last run
+    if st.session_state.document_processed:
+        try:
+            client.document(st.session_state.document_hash)
+        except DocumentNotFound:
+            st.session_state.document_processed = False
+            st.session_state.document_hash = None
+            st.session_state.corpus_mode = False
+            st.session_state.current_mode = None
+    
+    # Document Library (corpus mode)
+    with st.sidebar:
+        st.header("📚 Document Library")
+        corpus_dir = st.text_input(
+            "Library folder",
+            value=os.environ.get("CORPUS_DIR", ""),
+            help="A folder of PDF and TXT files to ask questions across, inside CORPUS_DIR"
+        )
+        
+        if st.button("📥 Index Library", disabled=not corpus_dir or st.session_state.library_job is not None):
+            try:
+                st.session_state.library_job = client.start_library_ingest(corpus_dir)['id']
+                st.session_state.library_result = None
+            except DocumentError as e:
+                st.error(str(e))
+        
+        if st.session_state.library_job:
+            library_progress(client)
+        
+        job = st.session_state.library_result
+        if job and job['status'] == 'done':
+            stats = job['result']
+            st.success(f"✅ {stats['added']} added, {stats['updated']} updated, {stats['removed']} removed, "
+                       f"{stats['unchanged']} unchanged")
+            if stats['failed']:
+                st.warning(f"{stats['failed']} files could not be read")
+        elif job and job['status'] == 'failed':
+            st.error(job['error'])
+        elif job:
+            st.info("Indexing stopped; files indexed so far are kept.")
+        
+        library = client.library()
+        if library['document_count']:
+            st.caption(f"{library['document_count']} documents, {library['page_count']} pages, "
+                       f"{library['chunk_count']} passages indexed")
+            
+            if not st.session_state.corpus_mode and st.button("💬 Ask the Library", use_container_width=True):
+                st.session_state.processed_data = library
+                st.session_state.document_processed = True
+                st.session_state.document_hash = library['corpus_hash']
+                st.session_state.document_summary = ""
+                st.session_state.challenge_questions = []
+                st.session_state.challenge_evaluations = {}
+                st.session_state.current_mode = "ask_anything"
+                st.session_state.corpus_mode = True
+        
+        if st.session_state.corpus_mode and st.button("📄 Back to Single Document", use_container_width=True):
+            st.session_state.corpus_mode = False
+            st.session_state.document_processed = False
+            st.session_state.document_hash = None
+            st.session_state.current_mode = None
+            st.rerun()
     
     # Document Upload Section
     st.header("📄 Document Upload")
@@ -400,48 +279,59 @@ def main():
         help="Upload a structured English document (research paper, report, etc.)"
     )
     
-    if uploaded_file is not None:
-        processor = DocumentProcessor()
+    if st.session_state.corpus_mode:
+        library = st.session_state.processed_data
+        st.info(f"📚 Answering across {library['document_count']} library documents "
+                f"({library['page_count']} pages). Citations name the file and page.")
+    
+    elif uploaded_file is not None:
+        # Key the document by its bytes so reruns and re-uploads hit the cache
+        file_bytes = uploaded_file.getvalue()
+        doc_hash = content_hash(file_bytes)
+        
+        if doc_hash not in (st.session_state.document_hash, st.session_state.ingest_key):
+            # Processing runs as a background job that the page polls
+            try:
+                job = client.start_ingest(file_bytes, uploaded_file.name, st.session_state.session_id)
+                st.session_state.ingest_job = job['id']
+                st.session_state.ingest_key = doc_hash
+                st.session_state.ingest_error = None
+                st.session_state.document_processed = False
+                st.session_state.document_hash = None
+                st.session_state.challenge_questions = []
+                st.session_state.challenge_evaluations = {}
+            except DocumentError as e:
+                st.error(str(e))
         
-        with st.spinner("Processing document with Gemini AI..."):
-            # Extract text based on file type
-            if uploaded_file.type == "application/pdf":
-                text = processor.extract_text_from_pdf(uploaded_file)
+        if st.session_state.ingest_job:
+            ingest_progress(client)
+        if st.session_state.ingest_error and st.session_state.ingest_key == doc_hash:
+            st.error(st.session_state.ingest_error)
+        
+        if st.session_state.document_hash == doc_hash:
+            processed_data = st.session_state.processed_data
+            for warning in st.session_state.document_warnings:
+                st.warning(warning)
+            
+            # Display document info and summary
+            if processed_data['stage'] == 'extracting':
+                st.info(f"⏳ {processed_data['page_count']} pages indexed so far - you can already ask about them.")
             else:
-                text = processor.extract_text_from_txt(uploaded_file)
-            
-            if text:
-                # Process the document
-                processed_data = processor.preprocess_text(text)
-                
-                # Initialize Gemini assistant
-                assistant = GeminiDocumentAssistant(processed_data, api_key)
-                
-                # Generate summary
-                summary = assistant.generate_summary()
-                
-                # Store in session state
-                st.session_state.processed_data = processed_data
-                st.session_state.assistant = assistant
-                st.session_state.document_processed = True
-                st.session_state.document_summary = summary
-                
-                # Display document info and summary
                 st.success("✅ Document processed successfully with Gemini AI!")
-                
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Word Count", processed_data['word_count'])
-                with col2:
-                    st.metric("Characters", processed_data['char_count'])
-                with col3:
-                    st.metric("Paragraphs", len(processed_data['paragraphs']))
-                
-                st.subheader("📝 AI-Generated Summary (≤150 words)")
-                st.info(summary)
+            
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Word Count", processed_data['word_count'])
+            with col2:
+                st.metric("Characters", processed_data['char_count'])
+            with col3:
+                st.metric("Paragraphs", processed_data['paragraph_count'])
+            
+            st.subheader("📝 AI-Generated Summary (≤150 words)")
+            st.info(st.session_state.document_summary)
     
     # Interaction Modes (only show if document is processed)
-    if st.session_state.document_processed and st.session_state.assistant:
+    if st.session_state.document_processed:
         st.header("🤖 Interaction Modes")
         
         col1, col2 = st.columns(2)
@@ -454,10 +344,12 @@ def main():
             if st.button("🎯 Challenge Me", use_container_width=True):
                 st.session_state.current_mode = "challenge_me"
                 with st.spinner("Generating intelligent questions..."):
-                    st.session_state.challenge_questions = st.session_state.assistant.generate_challenge_questions()
+                    st.session_state.challenge_questions = client.challenge(st.session_state.document_hash,
+                                                                            st.session_state.session_id)
+                    st.session_state.challenge_evaluations = {}
     
     # Ask Anything Mode
-    if st.session_state.current_mode == "ask_anything" and st.session_state.assistant:
+    if st.session_state.current_mode == "ask_anything" and st.session_state.document_processed:
         st.subheader("💬 Ask Anything Mode")
         st.write("Ask any question about the uploaded document - Gemini will provide intelligent answers:")
         
@@ -465,37 +357,57 @@ def main():
         
         if st.button("🔍 Get AI Answer", key="ask_submit"):
             if question:
-                with st.spinner("Gemini is analyzing the document and generating answer..."):
-                    result = st.session_state.assistant.answer_question(question)
-                    
-                    st.write("**🤖 Gemini's Answer:**")
-                    st.success(result['answer'])
-                    
-                    st.write("**📍 Justification:**")
-                    st.info(result['justification'])
-                    
-                    if result['source_snippet']:
-                        with st.expander("📖 Source Content from Document"):
-                            st.write(result['source_snippet'])
+                st.write("**🤖 Gemini's Answer:**")
+                answer_slot = st.empty()
+                st.write("**📍 Justification:**")
+                justification_slot = st.empty()
+                answer_slot.info("Gemini is analyzing the document and generating answer...")
+                
+                # Render each section as soon as its text starts arriving
+                result = None
+                for result in client.ask_stream(st.session_state.document_hash, question, st.session_state.session_id):
+                    if result['answer']:
+                        answer_slot.success(result['answer'])
+                    if result['justification']:
+                        justification_slot.info(result['justification'])
+                
+                if result and result['source_snippet']:
+                    with st.expander("📖 Source Content from Document"):
+                        st.write(result['source_snippet'])
+                        render_verification(result.get('snippet_verification'), result.get('supporting_text'))
+                
+                if result and result.get('cached'):
+                    st.caption("⚡ Answered from the cache of earlier questions about this document")
             else:
                 st.warning("Please enter a question!")
         
+        cache_stats = client.stats()['answer_cache']
+        st.caption(f"Answer cache: {cache_stats['exact_hits'] + cache_stats['semantic_hits']} hits, "
+                   f"{cache_stats['misses']} misses, {cache_stats['entries']} stored answers")
+        
         # Show conversation history
-        if st.session_state.assistant.conversation_history:
+        session = client.session(st.session_state.document_hash, st.session_state.session_id)
+        history = session['history']
+        if history:
             with st.expander("💭 Conversation History"):
-                for i, entry in enumerate(reversed(st.session_state.assistant.conversation_history)):
-                    st.write(f"**Q{len(st.session_state.assistant.conversation_history)-i} ({entry['timestamp']}):** {entry['question']}")
+                for i, entry in enumerate(reversed(history)):
+                    st.write(f"**Q{session['turn_count']-i} ({entry['timestamp']}):** {entry['question']}")
                     st.write(f"**A:** {entry['answer']}")
                     if entry['source_snippet']:
                         st.caption(f"*Source: {entry['source_snippet'][:100]}...*")
                     st.divider()
+                if session['summary']:
+                    st.caption("Earlier questions (summarized):")
+                    st.text(session['summary'])
     
     # Challenge Me Mode
-    elif st.session_state.current_mode == "challenge_me" and st.session_state.assistant:
+    elif st.session_state.current_mode == "challenge_me" and st.session_state.document_processed:
         st.subheader("🎯 Challenge Me Mode")
         st.write("Answer these AI-generated questions that test your understanding of the document:")
         
         if st.session_state.challenge_questions:
+            evaluations = st.session_state.challenge_evaluations
+            
             for i, q_data in enumerate(st.session_state.challenge_questions):
                 st.write(f"**Question {i+1} ({q_data.get('type', 'comprehension').title()}):**")
                 st.write(q_data['question'])
@@ -511,41 +423,47 @@ def main():
                 if st.button(f"📊 Get AI Evaluation", key=f"submit_{i}"):
                     if user_answer:
                         with st.spinner("Gemini is evaluating your answer..."):
-                            evaluation = st.session_state.assistant.evaluate_answer(
-                                q_data['question'], 
-                                user_answer, 
-                                q_data.get('type', 'comprehension')
-                            )
-                            
-                            st.write(f"**📊 Score:** {evaluation['score']}")
-                            
-                            if evaluation['score'] != 'N/A' and '%' in evaluation['score']:
-                                try:
-                                    score_val = float(evaluation['score'].replace('%', ''))
-                                    if score_val >= 80:
-                                        st.success(f"🎉 {evaluation['feedback']}")
-                                    elif score_val >= 60:
-                                        st.warning(f"👍 {evaluation['feedback']}")
-                                    else:
-                                        st.error(f"📝 {evaluation['feedback']}")
-                                except:
-                                    st.info(evaluation['feedback'])
-                            else:
-                                st.info(evaluation['feedback'])
-                            
-                            st.write(f"**🔍 AI Analysis:** {evaluation['justification']}")
-                            
-                            if evaluation.get('reference_content'):
-                                with st.expander("📖 Relevant Document Content"):
-                                    st.write(evaluation['reference_content'])
+                            evaluations[i] = client.evaluate(st.session_state.document_hash, [{
+                                'question': q_data['question'],
+                                'user_answer': user_answer,
+                                'type': q_data.get('type', 'comprehension')
+                            }], st.session_state.session_id)[0]
                     else:
                         st.warning(f"Please enter an answer for question {i+1}!")
                 
+                if i in evaluations:
+                    render_evaluation(evaluations[i])
+                
                 st.divider()
+            
+            if st.button("📊 Evaluate All Answers"):
+                answered = [
+                    i for i in range(len(st.session_state.challenge_questions))
+                    if st.session_state.get(f"challenge_answer_{i}")
+                ]
+                if answered:
+                    submissions = [
+                        {
+                            'question': st.session_state.challenge_questions[i]['question'],
+                            'user_answer': st.session_state[f"challenge_answer_{i}"],
+                            'type': st.session_state.challenge_questions[i].get('type', 'comprehension')
+                        }
+                        for i in answered
+                    ]
+                    with st.spinner("Gemini is evaluating all your answers..."):
+                        results = client.evaluate(st.session_state.document_hash, submissions,
+                                                  st.session_state.session_id)
+                    for i, evaluation in zip(answered, results):
+                        evaluations[i] = evaluation
+                    st.rerun()
+                else:
+                    st.warning("Please answer at least one question first!")
         
         if st.button("🔄 Generate New AI Questions"):
             with st.spinner("Gemini is creating new challenge questions..."):
-                st.session_state.challenge_questions = st.session_state.assistant.generate_challenge_questions()
+                st.session_state.challenge_questions = client.challenge(st.session_state.document_hash,
+                                                                        st.session_state.session_id)
+                st.session_state.challenge_evaluations = {}
                 st.rerun()
     
     # Instructions
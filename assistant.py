@@ -0,0 +1,709 @@
+import contextvars
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from answer_cache import AnswerCache
+from context_cache import ContextCache
+from conversation_memory import SENTENCE_END, ConversationMemory
+from document_store import DocumentStore, content_hash
+from instrumentation import current_span, traced, tracer
+from model_client import GeminiBackend, ModelClient, served_model
+from model_router import BudgetExceeded
+from pdf_extraction import DEFAULT_BACKEND, OCR_ENABLED, PdfPageStream, join_pages
+from question_bank import QUESTION_TYPES, QuestionBank
+from response_parsing import ResponseParser, ResponseSchema
+from retrieval import DocumentRetriever, tokenize
+from summarization import HierarchicalSummarizer
+from text_segmentation import segment_text
+from text_spill import SAMPLE_SIZE, detect_encoding, iter_text_blocks
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentError(Exception):
+    """A document could not be read or contained no text"""
+
+
+class DocumentProcessor:
+    # Safety limits for very large PDFs
+    MAX_PDF_PAGES = 2000
+    PDF_TIME_BUDGET = 120  # seconds
+    
+    def __init__(self, max_pages: int = MAX_PDF_PAGES, time_budget: float = PDF_TIME_BUDGET,
+                 backend: str = DEFAULT_BACKEND, ocr: Optional[bool] = None):
+        self.max_pages = max_pages
+        self.time_budget = time_budget
+        # Extraction engine (see pdf_extraction.EXTRACTION_BACKENDS) and whether scanned pages get OCR
+        self.backend = backend
+        self.ocr = ocr
+        # Notices for the user about the last extraction (e.g. truncation)
+        self.warnings: List[str] = []
+    
+    def iter_pdf_pages(self, pdf_file, on_page: Callable[[int, int, str], None] = None) -> Iterator[Tuple[int, str]]:
+        """Stream (page_number, text) records from a PDF file.
+        
+        ``on_page(page_number, page_count, text)`` is called as each page is read.
+        """
+        stream = PdfPageStream(pdf_file.read(), self.max_pages, self.time_budget, backend=self.backend, ocr=self.ocr)
+        for page_number, text in stream:
+            if on_page:
+                on_page(page_number, stream.pages_to_read, text)
+            yield page_number, text
+        current_span().set(backend=stream.backend, ocr_pages=len(stream.ocr_pages),
+                           low_quality_pages=len(stream.low_quality_pages))
+        if stream.truncated:
+            message = (f"Read {stream.pages_read} of {stream.page_count} pages; "
+                       f"the rest of the document was skipped to stay within processing limits.")
+            logger.warning(message)
+            self.warnings.append(message)
+        if stream.ocr_pages:
+            self.warnings.append(f"Text on {len(stream.ocr_pages)} scanned or garbled pages was recognized with OCR "
+                                 f"and may contain errors.")
+        unreadable = stream.low_quality_pages
+        if unreadable:
+            message = (f"{len(unreadable)} of {stream.pages_read} pages had little or no extractable text "
+                       f"(e.g. page {unreadable[0]})")
+            if not stream.ocr and OCR_ENABLED:
+                message += "; install Tesseract and pytesseract to read scanned pages"
+            message += "."
+            logger.warning(message)
+            self.warnings.append(message)
+    
+    def extract_pdf(self, pdf_file, on_page: Callable[[int, int, str], None] = None) -> Tuple[str, List[int]]:
+        """Extract PDF text along with the character offset where each page starts"""
+        with tracer.span('extract.pdf') as span:
+            try:
+                text, page_offsets = join_pages(self.iter_pdf_pages(pdf_file, on_page))
+            except Exception as e:
+                raise DocumentError(f"Error reading PDF: {str(e)}") from e
+            span.set(pages=len(page_offsets), chars=len(text))
+            return text, page_offsets
+    
+    def extract_text_from_pdf(self, pdf_file) -> str:
+        """Extract text content from PDF file"""
+        text, _ = self.extract_pdf(pdf_file)
+        return text
+    
+    def extract_text_from_txt(self, txt_file) -> str:
+        """Extract text content from TXT file, decoded block by block in its detected encoding"""
+        with tracer.span('extract.txt') as span:
+            try:
+                sample = txt_file.read(SAMPLE_SIZE)
+                encoding = detect_encoding(sample)
+                txt_file.seek(0)
+                text = "".join(iter_text_blocks(txt_file, encoding=encoding))
+            except Exception as e:
+                raise DocumentError(f"Error reading TXT file: {str(e)}") from e
+            replaced = text.count('\ufffd')
+            span.set(chars=len(text), encoding=encoding, replaced=replaced)
+            if encoding not in ('utf-8', 'utf-8-sig'):
+                self.warnings.append(f"The file is not UTF-8; it was read as {encoding}.")
+            if replaced:
+                self.warnings.append(f"{replaced} undecodable characters were replaced.")
+            return text
+    
+    def preprocess_text(self, text: str, page_offsets: List[int] = None) -> Dict:
+        """Preprocess text and extract basic information"""
+        # One pass cleans whitespace, keeps paragraph breaks and maps the page table
+        with tracer.span('preprocess', chars=len(text)):
+            return segment_text(text, page_offsets)
+
+
+class GeminiDocumentAssistant:
+    SUMMARY_UNAVAILABLE = "Unable to generate summary. Please check your API key and try again."
+    
+    # Prompt budget for document passages; documents below it are sent whole
+    CONTEXT_TOKEN_BUDGET = 6000
+    RETRIEVAL_TOP_K = 8
+    
+    # Part of the answer cache key; bump whenever the answer prompt changes
+    ANSWER_PROMPT_VERSION = "3"
+    
+    ASSISTANT_INSTRUCTIONS = """You are a GenAI assistant that analyzes user-uploaded documents. Your tasks are:
+
+Answer Questions: Respond to user queries with accurate, concise answers that may require inference.
+
+Ask Logic-Based Questions: Pose reasoning questions about the document and assess user responses.
+
+Justify Every Answer: Support all answers and feedback with direct references from the document (quotes, sections, or page numbers).
+
+Be clear, professional, and avoid assumptions not grounded in the text."""
+    
+    # Stands in for the document in prompts that run against the cached prefix
+    CACHED_DOCUMENT = "[The full document, with page labels, is provided above.]"
+    
+    def __init__(self, processed_data: Dict, api_key: str = None, retriever: DocumentRetriever = None,
+                 summary_cache: DocumentStore = None, client: ModelClient = None,
+                 answer_cache: AnswerCache = None, document_hash: str = None,
+                 context_cache: ContextCache = None, memory: ConversationMemory = None,
+                 question_bank: QuestionBank = None, session_id: str = None):
+        self.processed_data = processed_data
+        # Sent with every model call so a ``ModelRouter`` can charge this session's token budget
+        self.session_id = session_id
+        # Model that produced the latest response; a router may have fallen back from ``client.model_name``
+        self.answered_by: Optional[str] = None
+        # Recent turns verbatim plus a summary of older ones, fed back into answer prompts
+        self.memory = memory if memory is not None else ConversationMemory()
+        # A corpus has no single text to hash, so it supplies a fingerprint of its files instead
+        self.document_hash = (document_hash or processed_data.get('corpus_hash')
+                              or content_hash(processed_data['full_text'].encode('utf-8')))
+        self.answer_cache = answer_cache
+        
+        # Rate-limited, retrying model client; pass a shared one so sessions coalesce duplicate prompts
+        self.client = client or ModelClient(GeminiBackend(api_key))
+        
+        # Passage index used to pick the parts of the document each prompt needs
+        self.retriever = retriever or DocumentRetriever(processed_data)
+        
+        # Provider-side cache of the whole document, shared by every prompt about it
+        self.context_cache = context_cache
+        
+        # Challenge questions about the document, and the ones this conversation has seen
+        self.question_bank = question_bank if question_bank is not None else QuestionBank()
+        self.asked_questions: List[int] = []
+        
+        # Map-reduce summarizer; partial summaries are shared across documents by chunk hash
+        self.summarizer = HierarchicalSummarizer(
+            lambda prompt: self.client.generate(prompt, task='summary', session_id=self.session_id).strip(),
+            cache=summary_cache
+        )
+    
+    @property
+    def conversation_history(self) -> List[Dict]:
+        return self.memory.history()
+    
+    def document_context(self, query: str = None) -> str:
+        """Relevant passages for a query, or an even sample of the document without one"""
+        with tracer.span('retrieval', query_chars=len(query or '')) as span:
+            context = self.retriever.build_context(query, self.RETRIEVAL_TOP_K, self.CONTEXT_TOKEN_BUDGET)
+            span.set(context_chars=len(context))
+            return context
+    
+    def _document_prompt(self, query: str = None) -> Tuple[str, Optional[str]]:
+        """Document block for a prompt and the cached-content handle it relies on.
+        
+        With a context cache the whole document is pinned once as the prompt
+        prefix and the block is just a pointer to it; otherwise (or for
+        documents too small to cache) it holds the retrieved passages.
+        """
+        handle = self._context_handle()
+        if handle:
+            return self.CACHED_DOCUMENT, handle
+        return self.document_context(query), None
+    
+    def _context_handle(self) -> Optional[str]:
+        paged_text = getattr(self.retriever, 'paged_text', None)
+        if self.context_cache is None or paged_text is None:
+            return None
+        return self.context_cache.handle(self.document_hash, self.ASSISTANT_INSTRUCTIONS, paged_text)
+    
+    def _recreate_context(self) -> Optional[str]:
+        # The provider may drop a cache before its TTL; pin the document again
+        self.context_cache.invalidate(self.document_hash)
+        return self._context_handle()
+    
+    def _generate(self, prompt: str, cached_content: Optional[str] = None, json_output: bool = False,
+                  task: str = None) -> str:
+        try:
+            result = self.client.generate(prompt, cached_content=cached_content, json_output=json_output,
+                                          task=task, session_id=self.session_id).strip()
+            self.answered_by = served_model.get()
+            return result
+        except BudgetExceeded:
+            raise
+        except Exception:
+            if not cached_content:
+                raise
+            handle = self._recreate_context()
+            if not handle:
+                raise
+            result = self.client.generate(prompt, cached_content=handle, json_output=json_output,
+                                          task=task, session_id=self.session_id).strip()
+            self.answered_by = served_model.get()
+            return result
+    
+    def _stream(self, prompt: str, cached_content: Optional[str] = None, json_output: bool = False,
+                task: str = None) -> Iterator[str]:
+        started = False
+        try:
+            for chunk in self.client.stream(prompt, cached_content=cached_content, json_output=json_output,
+                                            task=task, session_id=self.session_id):
+                started = True
+                yield chunk
+            self.answered_by = served_model.get()
+        except BudgetExceeded:
+            raise
+        except Exception:
+            # Only retry if nothing was streamed yet, so no text is repeated
+            if not cached_content or started:
+                raise
+            handle = self._recreate_context()
+            if not handle:
+                raise
+            yield from self.client.stream(prompt, cached_content=handle, json_output=json_output,
+                                          task=task, session_id=self.session_id)
+            self.answered_by = served_model.get()
+    
+    def _structured(self, prompt: str, schema: ResponseSchema, cached_content: Optional[str] = None,
+                    count: Optional[int] = None, task: str = None) -> Tuple[object, str]:
+        """Run a prompt that asks for ``schema`` and return the parsed fields and the raw response"""
+        parser = schema.parser(count)
+        parser.feed(self._generate(prompt, cached_content, json_output=True, task=task))
+        return self._repair(parser), parser.text
+    
+    def _repair(self, parser: ResponseParser):
+        """Final fields of a response, asking the model to reformat it if required fields are missing.
+        
+        Local repairs (fences, markdown markers, truncated JSON) happen while
+        parsing. The re-ask only sends the response itself, not the document,
+        and is skipped when the response was valid JSON, since reformatting
+        can't add what the model left out.
+        """
+        schema = parser.schema
+        parsed = parser.close()
+        if not schema.missing(parsed) or parser.valid_json or not parser.text.strip():
+            return parsed
+        with tracer.span('assistant.reformat') as span:
+            try:
+                reformatted = self.client.generate(schema.repair_prompt(parser.text, parser.count), json_output=True,
+                                                   task='reformat', session_id=self.session_id)
+            except Exception:
+                logger.exception("Could not reformat a malformed response")
+                return parsed
+            repaired = schema.merge(parsed, schema.parse(reformatted, parser.count))
+            span.set(repaired=len(schema.missing(repaired)) < len(schema.missing(parsed)))
+            return repaired
+    
+    def generate_summary(self, max_words: int = 150, progress: Callable[[int, int], None] = None) -> str:
+        """Generate a summary using Gemini"""
+        try:
+            with tracer.span('assistant.summary'):
+                # A spilled (memory-mapped) text is read into memory only for as long as summarizing takes
+                return self.summarizer.summarize(str(self.processed_data['full_text']), max_words, progress)
+            
+        except Exception:
+            logger.exception("Error generating summary")
+            return self.SUMMARY_UNAVAILABLE
+    
+    ANSWER_SCHEMA = ResponseSchema({
+        'answer': "Your answer based on the document",
+        'justification': "Explain where in the document you found this information",
+        'source_snippet': "Quote the relevant portion from the document, word for word"
+    }, required=('answer',))
+    
+    def _answer_prompt(self, question: str, document: str = None) -> str:
+        # Cached prompts carry the instructions in the cached prefix instead
+        instructions = self.ASSISTANT_INSTRUCTIONS if document != self.CACHED_DOCUMENT else ""
+        if document is None:
+            document = self.document_context(self.memory.retrieval_query(question))
+        conversation = self.memory.prompt_block()
+        if conversation:
+            conversation = f"CONVERSATION SO FAR (use it to resolve follow-up questions):\n{conversation}"
+        return f"""
+            {instructions}
+            
+            DOCUMENT CONTENT:
+            {document}
+            
+            {conversation}
+            
+            QUESTION: {question}
+            
+            {self.ANSWER_SCHEMA.instructions()}
+            """
+    
+    def _uses_answer_cache(self) -> bool:
+        # Once there is conversation, answers may depend on it and aren't reusable elsewhere
+        return self.answer_cache is not None and not len(self.memory)
+    
+    def _cached_answer(self, question: str) -> Dict:
+        """Answer from the cache for this question or a near duplicate, if any"""
+        if not self._uses_answer_cache():
+            return None
+        # Answers are stored under the model that wrote them, so every model the call could go to is tried
+        result = self.answer_cache.get(self.document_hash, question,
+                                       self.client.serving_models('answer', self.session_id),
+                                       self.ANSWER_PROMPT_VERSION)
+        if result is not None:
+            result['cached'] = True
+            self._verify_answer(question, result)
+            self._remember_answer(question, result)
+        return result
+    
+    def _finish_answer(self, question: str, response_text: str, sections: Dict) -> Dict:
+        """Apply parsing fallbacks, cache the answer and record it in the conversation history"""
+        result = dict(sections)
+        
+        if result['answer'] and self._uses_answer_cache():
+            # Keyed by the model that wrote the answer, so a fallback's answers aren't served as the primary's
+            self.answer_cache.put(self.document_hash, question, self.answered_by or self.client.model_name,
+                                  self.ANSWER_PROMPT_VERSION, result)
+        
+        # Not even a reformatted response had an answer: show the response as it is
+        if not result['answer']:
+            result['answer'] = response_text
+        
+        self._verify_answer(question, result)
+        self._remember_answer(question, result)
+        return result
+    
+    def _verify_answer(self, question: str, result: Dict) -> None:
+        """Check the answer's quote against the document, quoting the document itself if need be.
+        
+        A missing snippet is replaced by the best matching sentence from the
+        document; one that can't be found there is kept but flagged, with
+        that sentence added as ``supporting_text``.
+        """
+        verification = self.verify_snippet(result.get('source_snippet'))
+        result['snippet_verification'] = verification
+        if verification is not None and not verification['hallucinated']:
+            return
+        extracted = self._extract_snippet(f"{question} {result['answer']}")
+        if verification is None:
+            result['source_snippet'] = extracted or "Full document context considered"
+            result['snippet_verification'] = self.verify_snippet(extracted)
+        elif extracted:
+            result['supporting_text'] = extracted
+    
+    def verify_snippet(self, snippet: Optional[str]) -> Optional[Dict]:
+        """Locate a quoted snippet in the document (see ``SnippetIndex.verify``).
+        
+        Returns None if there is nothing to check, or the retriever (e.g. a
+        library of several documents) has no single text to check it against.
+        """
+        snippet_index = getattr(self.retriever, 'snippet_index', None)
+        if not snippet or snippet_index is None:
+            return None
+        with tracer.span('assistant.verify_snippet') as span:
+            verification = snippet_index().verify(snippet)
+            if verification is not None:
+                span.set(confidence=verification['confidence'], hallucinated=verification['hallucinated'])
+            return verification
+    
+    def _extract_snippet(self, query: str) -> Optional[str]:
+        """The document sentence sharing the most terms with the query, from the best passage"""
+        passages = self.retriever.retrieve(query, top_k=1, token_budget=self.CONTEXT_TOKEN_BUDGET)
+        if not passages:
+            return None
+        terms = set(tokenize(query))
+        sentences = SENTENCE_END.split(passages[0]['text'])
+        return max(sentences, key=lambda sentence: len(terms.intersection(tokenize(sentence)))).strip() or None
+    
+    def _remember_answer(self, question: str, result: Dict) -> None:
+        self.memory.add(question, result)
+    
+    @staticmethod
+    def _answer_error(e: Exception) -> Dict:
+        return {
+            'answer': f"Error processing question: {str(e)}",
+            'justification': "Error occurred during processing",
+            'source_snippet': None
+        }
+    
+    def answer_question(self, question: str) -> Dict:
+        """Answer a question using Gemini with document context"""
+        with tracer.span('assistant.answer') as span:
+            try:
+                if self._uses_answer_cache():
+                    cached = self._cached_answer(question)
+                    span.set(cache='hit' if cached is not None else 'miss')
+                else:
+                    cached = None
+                if cached is not None:
+                    return cached
+                
+                document, handle = self._document_prompt(self.memory.retrieval_query(question))
+                sections, response_text = self._structured(self._answer_prompt(question, document),
+                                                           self.ANSWER_SCHEMA, handle, task='answer')
+                return self._finish_answer(question, response_text, sections)
+                
+            except Exception as e:
+                span.set(failed=str(e))
+                return self._answer_error(e)
+    
+    def answer_question_stream(self, question: str) -> Iterator[Dict]:
+        """Answer a question, yielding the parsed sections as the response streams in"""
+        with tracer.span('assistant.answer_stream', attach=False) as span:
+            try:
+                if self._uses_answer_cache():
+                    cached = self._cached_answer(question)
+                    span.set(cache='hit' if cached is not None else 'miss')
+                else:
+                    cached = None
+                if cached is not None:
+                    yield cached
+                    return
+                
+                parser = self.ANSWER_SCHEMA.parser()
+                document, handle = self._document_prompt(self.memory.retrieval_query(question))
+                for chunk in self._stream(self._answer_prompt(question, document), handle, json_output=True,
+                                          task='answer'):
+                    yield parser.feed(chunk)
+                sections = self._repair(parser)
+                yield self._finish_answer(question, parser.text.strip(), sections)
+                
+            except Exception as e:
+                span.set(failed=str(e))
+                yield self._answer_error(e)
+    
+    # Questions generated per batched call, and document sections they are spread across
+    QUESTION_POOL_SIZE = 12
+    QUESTION_SECTIONS = 4
+    
+    FALLBACK_QUESTIONS = [
+        {
+            'question': "What is the main topic or purpose of this document?",
+            'type': 'comprehension',
+            'answer_guidance': 'Look for the central theme and objective'
+        },
+        {
+            'question': "What evidence or examples support the main arguments in the document?",
+            'type': 'analysis',
+            'answer_guidance': 'Identify specific supporting details and examples'
+        },
+        {
+            'question': "What conclusions or implications can be drawn from the information presented?",
+            'type': 'inference',
+            'answer_guidance': 'Think about what the information suggests beyond what is explicitly stated'
+        }
+    ]
+    
+    @traced('assistant.challenge')
+    def generate_challenge_questions(self, count: int = 3) -> List[Dict]:
+        """Draw a new set of challenge questions from the document's question bank.
+        
+        The bank is generated in one batched call on first use and topped up
+        only once this conversation has seen (nearly) all of it, so most sets
+        are drawn locally without a model call. Questions already asked in
+        ``asked_questions`` are not repeated until the bank runs out.
+        """
+        if self.question_bank.remaining(self.asked_questions) < count:
+            avoid = [q['question'] for q in self.question_bank.questions]
+            self.question_bank.extend(self.generate_question_pool(avoid=avoid))
+        
+        picks = self.question_bank.draw(self.asked_questions, count)
+        if len(picks) < count and len(self.question_bank) >= count:
+            # Nothing new could be generated: start over with the whole bank
+            self.asked_questions.clear()
+            picks = self.question_bank.draw(self.asked_questions, count)
+        self.asked_questions.extend(picks)
+        
+        questions = [dict(self.question_bank.questions[i]) for i in picks]
+        # Ensure we have exactly ``count`` questions, using defaults if needed
+        for fallback in self.FALLBACK_QUESTIONS:
+            if len(questions) >= count:
+                break
+            questions.append(dict(fallback))
+        return questions[:count]
+    
+    QUESTION_SCHEMA = ResponseSchema({
+        'question': "A challenging question about the document",
+        'type': "comprehension, analysis or inference",
+        'section': "Number of the section the question is about",
+        'answer_guidance': "Hint for answering the question"
+    }, required=('question',), list_key='questions', markers={'answer_guidance': 'GUIDANCE'})
+    
+    def generate_question_pool(self, size: int = None, avoid: List[str] = ()) -> List[Dict]:
+        """Generate a batch of challenge questions spread across question types and document sections"""
+        size = size or self.QUESTION_POOL_SIZE
+        try:
+            sections = self._question_sections()
+            sections_block = "\n\n".join(f"[SECTION {n}]\n{text}" for n, text in enumerate(sections, start=1))
+            avoid_block = ""
+            if avoid:
+                avoid_block = "Do not repeat or rephrase these existing questions:\n" + "\n".join(f"- {q}" for q in avoid)
+            prompt = f"""
+            Based on the document sections provided below, generate exactly {size} challenging questions that test deep comprehension and logical reasoning.
+            
+            Requirements for questions:
+            1. Each question should require understanding of the document content
+            2. Use the types comprehension, analysis and inference equally often
+            3. Spread the questions across all {len(sections)} sections of the document
+            4. Avoid simple factual recall - focus on understanding and reasoning
+            5. Each question should have a clear connection to specific parts of the document
+            {avoid_block}
+            
+            DOCUMENT SECTIONS:
+            {sections_block}
+            
+            {self.QUESTION_SCHEMA.instructions(size)}
+            """
+            
+            parsed, _ = self._structured(prompt, self.QUESTION_SCHEMA, count=size, task='questions')
+        except Exception:
+            logger.exception("Error generating questions")
+            return []
+        
+        questions = []
+        for item in parsed:
+            if not item['question']:
+                continue
+            question_type = item['type'].strip().lower()
+            section = re.search(r'\d+', item['section'])
+            questions.append({
+                'question': item['question'],
+                'type': question_type if question_type in QUESTION_TYPES else 'comprehension',
+                'answer_guidance': item['answer_guidance'] or 'Think carefully about the document content',
+                'section': int(section.group()) if section else None
+            })
+        return questions
+    
+    def _question_sections(self) -> List[str]:
+        """The document as a few consecutive sections of evenly sampled passages"""
+        overview = getattr(self.retriever, 'overview', None)
+        passages = overview(self.CONTEXT_TOKEN_BUDGET) if overview else []
+        if not passages:
+            return [self.document_context()]
+        per_section = -(-len(passages) // self.QUESTION_SECTIONS)
+        sections = []
+        for first in range(0, len(passages), per_section):
+            blocks = []
+            for p in passages[first:first + per_section]:
+                label = f"{p['source']}, page {p['page']}" if p.get('source') else (
+                    f"Page {p['page']}" if p.get('page') else f"Passage {p['id'] + 1}")
+                blocks.append(f"[{label}]\n{p['text']}")
+            sections.append("\n\n".join(blocks))
+        return sections
+    
+    EVALUATION_FIELDS = {
+        'score': "Score from 0 to 100",
+        'feedback': "Detailed feedback on the answer quality",
+        'justification': "How the answer relates to the document content",
+        'reference_content': "Quote of the specific part of the document that's relevant"
+    }
+    EVALUATION_SCHEMA = ResponseSchema(EVALUATION_FIELDS, required=('score', 'feedback'),
+                                       markers={'reference_content': 'REFERENCE'})
+    EVALUATION_BATCH_SCHEMA = ResponseSchema(EVALUATION_FIELDS, required=('score', 'feedback'), list_key='evaluations',
+                                             markers={'reference_content': 'REFERENCE'})
+    
+    def _evaluation_from_sections(self, sections: Dict, response_text: str, query: str) -> Dict:
+        """Normalize the score, fill in defaults and check the reference for a parsed evaluation"""
+        score = "N/A"
+        if sections['score']:
+            # Extract numeric score
+            score_match = re.search(r'\b(\d+)\b', sections['score'])
+            score = f"{score_match.group(1)}%" if score_match else sections['score']
+        
+        # Provide defaults if parsing failed
+        evaluation = {
+            'feedback': sections['feedback'] or response_text,
+            'score': score,
+            'justification': sections['justification'] or "Evaluated based on document content alignment",
+            'reference_content': sections['reference_content'],
+            'reference_verification': self.verify_snippet(sections['reference_content'])
+        }
+        verification = evaluation['reference_verification']
+        if verification is None or verification['hallucinated']:
+            # Point the student at what the document actually says
+            evaluation['supporting_text'] = self._extract_snippet(query)
+        return evaluation
+    
+    @staticmethod
+    def _evaluation_error(e: Exception) -> Dict:
+        return {
+            'feedback': f"Error evaluating answer: {str(e)}",
+            'score': "N/A",
+            'justification': "Evaluation failed due to technical error",
+            'reference_content': "Unable to provide reference"
+        }
+    
+    @traced('assistant.evaluate')
+    def evaluate_answer(self, question: str, user_answer: str, question_type: str) -> Dict:
+        """Evaluate user's answer using Gemini"""
+        try:
+            document, handle = self._document_prompt(f"{question} {user_answer}")
+            prompt = f"""
+            You are evaluating a student's answer to a comprehension question based on a document.
+            
+            DOCUMENT CONTENT:
+            {document}
+            
+            QUESTION: {question}
+            QUESTION TYPE: {question_type}
+            
+            STUDENT'S ANSWER: {user_answer}
+            
+            Please evaluate the student's answer and provide:
+            1. A score from 0-100 based on accuracy and completeness
+            2. Constructive feedback explaining the score
+            3. Reference to specific parts of the document that support or contradict the answer
+            4. Suggestions for improvement if needed
+            
+            {self.EVALUATION_SCHEMA.instructions()}
+            """
+            
+            sections, response_text = self._structured(prompt, self.EVALUATION_SCHEMA, handle, task='evaluation')
+            return self._evaluation_from_sections(sections, response_text, f"{question} {user_answer}")
+            
+        except Exception as e:
+            return self._evaluation_error(e)
+    
+    @traced('assistant.evaluate_batch')
+    def evaluate_answers(self, submissions: List[Dict]) -> List[Dict]:
+        """Evaluate several answers in one Gemini request.
+        
+        Each submission has 'question', 'user_answer' and 'type'. All answers
+        share one retrieved document context; any answer the batched response
+        doesn't cover, even once reformatted, is re-evaluated on its own,
+        concurrently.
+        """
+        if not submissions:
+            return []
+        if len(submissions) == 1:
+            s = submissions[0]
+            return [self.evaluate_answer(s['question'], s['user_answer'], s.get('type', 'comprehension'))]
+        
+        try:
+            query = " ".join(f"{s['question']} {s['user_answer']}" for s in submissions)
+            answers_block = "\n\n".join(
+                f"""QUESTION {n}: {s['question']}
+            QUESTION TYPE {n}: {s.get('type', 'comprehension')}
+            STUDENT'S ANSWER {n}: {s['user_answer']}"""
+                for n, s in enumerate(submissions, start=1)
+            )
+            document, handle = self._document_prompt(query)
+            prompt = f"""
+            You are evaluating a student's answers to {len(submissions)} comprehension questions based on a document.
+            Evaluate each answer independently.
+            
+            DOCUMENT CONTENT:
+            {document}
+            
+            {answers_block}
+            
+            For each answer, provide:
+            1. A score from 0-100 based on accuracy and completeness
+            2. Constructive feedback explaining the score
+            3. Reference to specific parts of the document that support or contradict the answer
+            4. Suggestions for improvement if needed
+            
+            {self.EVALUATION_BATCH_SCHEMA.instructions(len(submissions))}
+            """
+            
+            parsed, response_text = self._structured(prompt, self.EVALUATION_BATCH_SCHEMA, handle,
+                                                     count=len(submissions), task='evaluation')
+        except Exception as e:
+            return [self._evaluation_error(e) for _ in submissions]
+        
+        results = []
+        missing = []
+        for n, (s, sections) in enumerate(zip(submissions, parsed), start=1):
+            if sections['score'] and sections['feedback']:
+                results.append(self._evaluation_from_sections(sections, response_text,
+                                                              f"{s['question']} {s['user_answer']}"))
+            else:
+                results.append(None)
+                missing.append(n - 1)
+        
+        if missing:
+            with ThreadPoolExecutor(max_workers=len(missing)) as pool:
+                retries = [
+                    pool.submit(contextvars.copy_context().run, self.evaluate_answer, submissions[i]['question'],
+                                submissions[i]['user_answer'], submissions[i].get('type', 'comprehension'))
+                    for i in missing
+                ]
+                for i, evaluation in zip(missing, retries):
+                    results[i] = evaluation.result()
+        return results
@@ -0,0 +1,284 @@
+"""Offline benchmarks for the document pipeline.
+
+Generates synthetic PDF and TXT documents, then times extraction,
+preprocessing, indexing, prompt construction and response parsing. Model
+calls go to ``StubBackend``, a deterministic stand-in for Gemini with
+configurable latency and token throughput, so runs need no API key and are
+repeatable.
+
+    python benchmark.py --pages 1 10 100 1000 --output baseline.json
+    python benchmark.py --compare baseline.json
+
+A comparison exits with status 1 when any stage's p50 latency regressed by
+more than ``--threshold`` against the baseline.
+"""
+import argparse
+import io
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from assistant import DocumentProcessor, GeminiDocumentAssistant
+from model_client import ModelClient, StubBackend
+from retrieval import DocumentRetriever, estimate_tokens
+
+WORDS = (
+    "analysis approach method result data model system process value study figure table evidence "
+    "measure sample effect research design theory review policy market energy network signal"
+).split()
+
+QUESTIONS = [
+    "What are the main conclusions of this document?",
+    "Which method was used to measure the effect?",
+    "How does the proposed model compare with earlier approaches?",
+    "What evidence supports the policy recommendation?",
+]
+
+# Roughly one printed page of prose
+WORDS_PER_PAGE = 450
+CHARS_PER_LINE = 90
+
+
+def synthetic_pages(page_count: int, seed: int = 0) -> List[str]:
+    """Deterministic pages of sentence- and paragraph-structured filler text"""
+    rng = random.Random(seed)
+    pages = []
+    for _ in range(page_count):
+        paragraphs = []
+        words = 0
+        while words < WORDS_PER_PAGE:
+            sentences = []
+            for _ in range(rng.randint(3, 7)):
+                length = rng.randint(8, 24)
+                sentences.append(" ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + ".")
+                words += length
+            paragraphs.append(" ".join(sentences))
+        pages.append("\n\n".join(paragraphs))
+    return pages
+
+
+def make_txt(pages: List[str]) -> bytes:
+    return "\n\n".join(pages).encode('utf-8')
+
+
+def make_pdf(pages: List[str]) -> bytes:
+    """Minimal uncompressed PDF with one Helvetica text stream per page"""
+    objects: List[Optional[bytes]] = []
+
+    def add(body: Optional[bytes]) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = add(None)
+    kids = []
+    for text in pages:
+        ops = ["BT /F1 9 Tf 11 TL 40 760 Td"]
+        for paragraph in text.split("\n\n"):
+            for start in range(0, len(paragraph), CHARS_PER_LINE):
+                line = paragraph[start:start + CHARS_PER_LINE]
+                line = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+                ops.append(f"({line}) Tj T*")
+            ops.append("T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode('latin-1', 'replace')
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids.append(add(
+            f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font} 0 R >> >> /Contents {content} 0 R >>".encode()
+        ))
+    objects[pages_id - 1] = (
+        f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>".encode()
+    )
+    catalog = add(f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode())
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
+
+
+def stub_responder(response_tokens: int) -> Callable[[str], str]:
+    """Deterministic answers in the JSON answer schema, of about ``response_tokens`` tokens"""
+    def respond(prompt: str) -> str:
+        rng = random.Random(len(prompt))
+        body = " ".join(rng.choice(WORDS) for _ in range(max(1, response_tokens * 3 // 4)))
+        third = len(body) // 3
+        return json.dumps({'answer': body[:third], 'justification': body[third:2 * third],
+                           'source_snippet': body[2 * third:]})
+    return respond
+
+
+def peak_memory_mb(run: Callable[[], object]) -> float:
+    """Peak memory allocated in this process during one call of ``run``, above what was already in use.
+
+    Traced on a separate call so tracemalloc's overhead stays out of the
+    timings; allocations in worker processes (parallel PDF extraction) are
+    not counted.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if started:
+            tracemalloc.stop()
+    return round((peak - baseline) / (1024 * 1024), 1)
+
+
+def measure(run: Callable[[], object], repeats: int, units: float, unit: str) -> Dict:
+    """Time ``run`` ``repeats`` times, then trace the memory of one more call; ``units`` of work are done per call"""
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    p50 = statistics.median(timings)
+    p95 = timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))]
+    return {
+        'calls': repeats,
+        'p50_ms': round(p50 * 1000, 3),
+        'p95_ms': round(p95 * 1000, 3),
+        'throughput': round(units / p50, 2) if p50 else None,
+        'throughput_unit': unit,
+        'peak_memory_mb': peak_memory_mb(run)
+    }
+
+
+def benchmark_document(page_count: int, repeats: int, backend: StubBackend) -> Dict[str, Dict]:
+    pages = synthetic_pages(page_count)
+    pdf_bytes = make_pdf(pages)
+    txt_bytes = make_txt(pages)
+    processor = DocumentProcessor()
+    results = {}
+
+    results['extract_pdf'] = measure(
+        lambda: processor.extract_text_from_pdf(io.BytesIO(pdf_bytes)), repeats, page_count, 'pages/s'
+    )
+    results['extract_txt'] = measure(
+        lambda: processor.extract_text_from_txt(io.BytesIO(txt_bytes)), repeats, len(txt_bytes) / 1e6, 'MB/s'
+    )
+
+    text, page_offsets = processor.extract_pdf(io.BytesIO(pdf_bytes))
+    results['preprocess'] = measure(
+        lambda: processor.preprocess_text(text, page_offsets), repeats, len(text) / 1e6, 'MB/s'
+    )
+    processed_data = processor.preprocess_text(text, page_offsets)
+
+    results['index'] = measure(lambda: DocumentRetriever(processed_data), repeats, page_count, 'pages/s')
+
+    # Generous limits so the client's rate limiter never waits during a benchmark
+    client = ModelClient(backend, requests_per_minute=1e9, tokens_per_minute=1e12, max_retries=0)
+    assistant = GeminiDocumentAssistant(processed_data, client=client)
+    questions = [QUESTIONS[i % len(QUESTIONS)] for i in range(repeats)]
+    prompts = [assistant._answer_prompt(q) for q in questions]
+    question_iter = iter(questions * 2)
+    results['build_prompt'] = measure(lambda: assistant._answer_prompt(next(question_iter)), repeats, 1, 'prompts/s')
+    results['build_prompt']['prompt_tokens'] = round(statistics.mean(estimate_tokens(p) for p in prompts), 1)
+
+    responses = [backend.responder(p) for p in prompts]
+    response_iter = iter(responses * 2)
+    results['parse_response'] = measure(
+        lambda: GeminiDocumentAssistant.ANSWER_SCHEMA.parse(next(response_iter)), repeats, 1, 'responses/s'
+    )
+
+    question_iter = iter(questions * 2)
+    results['answer_question'] = measure(
+        lambda: assistant.answer_question(next(question_iter)), repeats, 1, 'answers/s'
+    )
+    results['answer_question']['prompt_tokens'] = results['build_prompt']['prompt_tokens']
+    results['answer_question']['response_tokens'] = round(statistics.mean(estimate_tokens(r) for r in responses), 1)
+    return results
+
+
+def run(page_counts: List[int], repeats: int, latency: float, tokens_per_second: Optional[float],
+        response_tokens: int) -> Dict:
+    backend = StubBackend(stub_responder(response_tokens), latency=latency, tokens_per_second=tokens_per_second)
+    results = {}
+    for page_count in page_counts:
+        for stage, metrics in benchmark_document(page_count, repeats, backend).items():
+            results[f"{page_count}_pages/{stage}"] = metrics
+            print(f"{page_count:>5} pages  {stage:<16} p50 {metrics['p50_ms']:>10.2f} ms  "
+                  f"p95 {metrics['p95_ms']:>10.2f} ms  {metrics['throughput']} {metrics['throughput_unit']}")
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeats': repeats,
+            'stub_latency': latency,
+            'stub_tokens_per_second': tokens_per_second,
+            'stub_response_tokens': response_tokens
+        },
+        'results': results
+    }
+
+
+def compare(report: Dict, baseline: Dict, threshold: float, min_delta_ms: float = 1.0) -> List[str]:
+    """Stages whose p50 latency grew by more than ``threshold`` (a fraction).
+
+    Changes smaller than ``min_delta_ms`` are ignored, since sub-millisecond
+    stages are dominated by timer noise.
+    """
+    regressions = []
+    for key, metrics in report['results'].items():
+        previous = baseline['results'].get(key)
+        if not previous or not previous['p50_ms']:
+            continue
+        change = metrics['p50_ms'] / previous['p50_ms'] - 1
+        regressed = change > threshold and metrics['p50_ms'] - previous['p50_ms'] > min_delta_ms
+        marker = "REGRESSION" if regressed else ""
+        print(f"{key:<32} {previous['p50_ms']:>10.2f} -> {metrics['p50_ms']:>10.2f} ms  {change:+7.1%}  {marker}")
+        if regressed:
+            regressions.append(key)
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the document pipeline")
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100, 1000],
+                        help="Synthetic document sizes in pages")
+    parser.add_argument('--repeats', type=int, default=5, help="Timed calls per stage")
+    parser.add_argument('--latency', type=float, default=0.0, help="Stub model latency per call (seconds)")
+    parser.add_argument('--tokens-per-second', type=float, default=None, help="Stub model generation speed")
+    parser.add_argument('--response-tokens', type=int, default=200, help="Stub response length")
+    parser.add_argument('--output', help="Write the report as JSON (e.g. a new baseline)")
+    parser.add_argument('--compare', help="Baseline JSON to compare p50 latencies against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Allowed p50 slowdown before failing")
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help="Ignore p50 changes smaller than this many milliseconds")
+    args = parser.parse_args(argv)
+
+    report = run(args.pages, args.repeats, args.latency, args.tokens_per_second, args.response_tokens)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"{len(regressions)} stages regressed by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from instrumentation import current_span
+from model_client import ModelClient
+from retrieval import estimate_tokens
+from state_store import MemoryStateStore
+
+logger = logging.getLogger(__name__)
+
+
+class ContextCache:
+    """Pins each document's prompt prefix with the model provider, once per document hash.
+
+    The first prompt about a document uploads its full text (and the system
+    instruction) as provider-side cached content; later prompts name the
+    cache and send only the question, so the document is neither re-sent nor
+    billed again as fresh input. Handles live in the state store under
+    ``context:{model}:{key}`` so every worker reuses the same cache, and are
+    recreated shortly before their TTL runs out. Documents below
+    ``min_tokens`` (the provider's minimum) or above ``max_tokens`` are not
+    cached; callers fall back to retrieved passages for them.
+    """
+
+    def __init__(self, client: ModelClient, state=None, ttl_seconds: float = 3600,
+                 min_tokens: int = 32768, max_tokens: int = 900_000, refresh_margin: float = 60):
+        self.client = client
+        self.state = state or MemoryStateStore()
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.refresh_margin = refresh_margin
+        self.metrics = {'hits': 0, 'creates': 0, 'invalidations': 0, 'errors': 0}
+
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        # Keys whose content was too small or too large; checked once per process
+        self._ineligible = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.client.supports_cached_content
+
+    def handle(self, key: str, system_instruction: str, content_fn: Callable[[], str]) -> Optional[str]:
+        """Cached-content name for ``key``, creating it from ``content_fn()`` if needed.
+
+        Returns None when caching is unavailable or the content isn't eligible.
+        """
+        if not self.enabled or key in self._ineligible:
+            return None
+
+        state_key = self._state_key(key)
+        entry = self._live(self.state.get(state_key))
+        if entry is not None:
+            self._hit(entry)
+            return entry['name']
+
+        # One creation per key; concurrent callers wait and reuse the result
+        with self._key_lock(key):
+            entry = self._live(self.state.get(state_key))
+            if entry is not None:
+                self._hit(entry)
+                return entry['name']
+
+            content = content_fn()
+            tokens = estimate_tokens(content)
+            if not self.min_tokens <= tokens <= self.max_tokens:
+                self._ineligible.add(key)
+                return None
+
+            try:
+                name = self.client.create_cached_content(system_instruction, content, self.ttl_seconds)
+            except Exception:
+                logger.exception("Could not create cached content for %s", key)
+                with self._lock:
+                    self.metrics['errors'] += 1
+                return None
+
+            entry = {'name': name, 'tokens': tokens, 'expires_at': time.time() + self.ttl_seconds}
+            self.state.put(state_key, entry, ttl=self.ttl_seconds)
+            with self._lock:
+                self.metrics['creates'] += 1
+            current_span().set(cached_tokens=tokens)
+            return name
+
+    def invalidate(self, key: str) -> bool:
+        """Drop the cached content for ``key``, e.g. after the provider rejected it"""
+        state_key = self._state_key(key)
+        entry = self.state.get(state_key)
+        self.state.delete(state_key)
+        self._ineligible.discard(key)
+        if entry is None:
+            return False
+        with self._lock:
+            self.metrics['invalidations'] += 1
+        try:
+            self.client.delete_cached_content(entry['name'])
+        except Exception:
+            # Already expired or deleted on the provider's side
+            logger.debug("Cached content %s was already gone", entry['name'])
+        return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self.metrics, ttl_seconds=self.ttl_seconds, enabled=self.enabled)
+
+    def _state_key(self, key: str) -> str:
+        return f"context:{self.client.model_name}:{key}"
+
+    def _live(self, entry: Optional[Dict]) -> Optional[Dict]:
+        # Treat handles about to expire as gone, so no prompt races the provider's TTL
+        if entry is None or entry['expires_at'] - self.refresh_margin <= time.time():
+            return None
+        return entry
+
+    def _hit(self, entry: Dict) -> None:
+        with self._lock:
+            self.metrics['hits'] += 1
+        current_span().set(cached_tokens=entry['tokens'])
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
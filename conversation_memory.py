@@ -0,0 +1,174 @@
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from retrieval import estimate_tokens
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+
+
+def clip_words(text: str, max_words: int) -> str:
+    words = text.split()
+    if len(words) <= max_words:
+        return " ".join(words)
+    return " ".join(words[:max_words]) + " ..."
+
+
+def first_sentence(text: str) -> str:
+    return SENTENCE_END.split(text.strip(), 1)[0]
+
+
+class Turn:
+    """One question and the answer given to it"""
+
+    __slots__ = ('question', 'answer', 'justification', 'source_snippet', 'timestamp')
+
+    def __init__(self, question: str, answer: str, justification: Optional[str] = None,
+                 source_snippet: Optional[str] = None, timestamp: Optional[str] = None):
+        self.question = question
+        self.answer = answer
+        self.justification = justification
+        self.source_snippet = source_snippet
+        self.timestamp = timestamp or datetime.now().strftime("%H:%M:%S")
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Turn':
+        return cls(data['question'], data['answer'], data.get('justification'),
+                   data.get('source_snippet'), data.get('timestamp'))
+
+
+class ConversationMemory:
+    """Bounded memory of a conversation about one document.
+
+    The last ``max_turns`` turns are kept verbatim. Older turns are folded
+    into a rolling summary, one compressed line each (the question and the
+    first sentence of its answer); once the summary outgrows half of
+    ``token_budget`` its oldest lines are dropped and only counted. The
+    prompt block never exceeds ``token_budget`` tokens however long the
+    session runs.
+    """
+
+    __slots__ = ('max_turns', 'token_budget', 'turns', 'summary', 'omitted', 'turn_count')
+
+    # Words kept per recent answer and per summarized question/answer
+    RECENT_ANSWER_WORDS = 120
+    SUMMARY_WORDS = 25
+    # Reserved for the section headings of the prompt block
+    HEADING_TOKENS = 16
+
+    def __init__(self, max_turns: int = 4, token_budget: int = 1200):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.turns: List[Turn] = []
+        self.summary: List[str] = []
+        self.omitted = 0
+        self.turn_count = 0
+
+    def __len__(self) -> int:
+        return self.turn_count
+
+    def to_dict(self) -> Dict:
+        """Plain data for a state store; ``from_dict`` restores it"""
+        return {
+            'turns': [turn.to_dict() for turn in self.turns],
+            'summary': list(self.summary),
+            'omitted': self.omitted,
+            'turn_count': self.turn_count
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, **kwargs) -> 'ConversationMemory':
+        """Memory saved by ``to_dict``; ``kwargs`` are the current limits"""
+        memory = cls(**kwargs)
+        for turn in data['turns']:
+            memory.add_turn(Turn.from_dict(turn))
+        # add_turn folded any turns beyond a lowered max_turns into the summary already
+        memory.summary = list(data['summary']) + memory.summary
+        memory.omitted = data['omitted']
+        memory.turn_count = data['turn_count']
+        return memory
+
+    @classmethod
+    def from_history(cls, history: List[Dict], **kwargs) -> 'ConversationMemory':
+        """Memory rebuilt from a list of turn dicts (e.g. an older session)"""
+        memory = cls(**kwargs)
+        for entry in history:
+            memory.add_turn(Turn.from_dict(entry))
+        return memory
+
+    def add(self, question: str, result: Dict) -> Turn:
+        turn = Turn(question, result['answer'], result.get('justification'), result.get('source_snippet'))
+        self.add_turn(turn)
+        return turn
+
+    def add_turn(self, turn: Turn) -> None:
+        self.turns.append(turn)
+        self.turn_count += 1
+        while len(self.turns) > self.max_turns:
+            self._fold(self.turns.pop(0))
+
+    def history(self) -> List[Dict]:
+        """The verbatim turns, oldest first"""
+        return [turn.to_dict() for turn in self.turns]
+
+    def retrieval_query(self, question: str) -> str:
+        """Question extended with the previous one, so follow-ups retrieve the right passages"""
+        if not self.turns:
+            return question
+        return f"{self.turns[-1].question} {question}"
+
+    def prompt_block(self) -> str:
+        """The conversation so far, within ``token_budget`` tokens.
+
+        Recent turns take priority, newest first (the newest is cut to fit if
+        need be). Recent turns that don't fit are summarized too, and summary
+        lines fill what is left, newest first.
+        """
+        if not self.turn_count:
+            return ""
+        budget = self.token_budget - self.HEADING_TOKENS
+
+        recent = []
+        for turn in reversed(self.turns):
+            block = f"Q: {turn.question}\nA: {clip_words(turn.answer, self.RECENT_ANSWER_WORDS)}"
+            if estimate_tokens(block) > budget:
+                if recent:
+                    break
+                block = block[:budget * 4]
+            recent.append(block)
+            budget -= estimate_tokens(block)
+        squeezed = [self._compress(turn) for turn in self.turns[:len(self.turns) - len(recent)]]
+
+        summary = []
+        for line in reversed(self.summary_text().splitlines() + squeezed):
+            if estimate_tokens(line) + 1 > budget:
+                break
+            summary.append(line)
+            budget -= estimate_tokens(line) + 1
+
+        parts = []
+        if summary:
+            parts.append("Earlier in the conversation:\n" + "\n".join(reversed(summary)))
+        if recent:
+            parts.append("Most recent questions:\n" + "\n\n".join(reversed(recent)))
+        return "\n\n".join(parts)
+
+    def summary_text(self) -> str:
+        """Compressed lines for the turns no longer kept verbatim"""
+        lines = list(self.summary)
+        if self.omitted:
+            lines.insert(0, f"- ({self.omitted} earlier questions omitted)")
+        return "\n".join(lines)
+
+    def _compress(self, turn: Turn) -> str:
+        return (f"- {clip_words(turn.question, self.SUMMARY_WORDS)} -> "
+                f"{clip_words(first_sentence(turn.answer), self.SUMMARY_WORDS)}")
+
+    def _fold(self, turn: Turn) -> None:
+        self.summary.append(self._compress(turn))
+        while len(self.summary) > 1 and estimate_tokens(self.summary_text()) > self.token_budget // 2:
+            self.summary.pop(0)
+            self.omitted += 1
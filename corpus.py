@@ -0,0 +1,523 @@
+import copy
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from pdf_extraction import PdfPageStream, join_pages
+from retrieval import HashingEmbedder, chunk_text, estimate_tokens, page_for_offset, tokenize
+from text_segmentation import segment_text
+from text_spill import iter_text_blocks
+
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.txt')
+MANIFEST_VERSION = 2
+
+
+def _ingest_file(path: str, chunk_chars: int, overlap_chars: int, vector_dim: int) -> Dict:
+    """Extract, chunk, tokenize and optionally embed one file (runs in a worker process)"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        if path.lower().endswith('.pdf'):
+            raw, page_offsets = join_pages(PdfPageStream(data, workers=1))
+        else:
+            # Same encoding detection as uploads (BOM, UTF-8, then charset-normalizer or cp1252)
+            raw, page_offsets = "".join(iter_text_blocks(io.BytesIO(data))), [0]
+        processed = segment_text(raw, page_offsets)
+        text, page_offsets = processed['full_text'], processed['page_offsets']
+
+        chunks = chunk_text(text, chunk_chars, overlap_chars)
+        texts = [c['text'] for c in chunks]
+        result = {
+            'path': path,
+            'hash': hashlib.sha256(data).hexdigest(),
+            'pages': len(page_offsets),
+            'texts': texts,
+            'chunk_pages': [page_for_offset(page_offsets, c['start']) or 1 for c in chunks],
+            'terms': [Counter(tokenize(t)) for t in texts],
+            'vectors': None
+        }
+        if vector_dim:
+            result['vectors'] = HashingEmbedder(vector_dim).embed(texts).astype(np.float16)
+        return result
+    except Exception as e:
+        return {'path': path, 'error': str(e)}
+
+
+def _save_segment(path: str, blob: bytes, offsets: np.ndarray, chunk_doc: np.ndarray, chunk_page: np.ndarray,
+                  chunk_len: np.ndarray, terms: List[str], term_ids: np.ndarray, chunk_ids: np.ndarray,
+                  tfs: np.ndarray, vectors: Optional[np.ndarray]) -> None:
+    """Write one immutable index segment as flat, memory-mappable arrays"""
+    os.makedirs(path, exist_ok=True)
+    order = np.lexsort((chunk_ids, term_ids))
+    df = np.bincount(term_ids, minlength=len(terms))
+
+    with open(os.path.join(path, 'chunks.bin'), 'wb') as f:
+        f.write(blob)
+    np.save(os.path.join(path, 'chunk_offsets.npy'), offsets.astype(np.int64))
+    np.save(os.path.join(path, 'chunk_doc.npy'), chunk_doc.astype(np.int32))
+    np.save(os.path.join(path, 'chunk_page.npy'), chunk_page.astype(np.int32))
+    np.save(os.path.join(path, 'chunk_len.npy'), chunk_len.astype(np.float32))
+    np.save(os.path.join(path, 'indptr.npy'), np.concatenate(([0], np.cumsum(df))).astype(np.int64))
+    np.save(os.path.join(path, 'post_chunk.npy'), chunk_ids[order].astype(np.int32))
+    np.save(os.path.join(path, 'post_tf.npy'), np.minimum(tfs[order], 65535).astype(np.uint16))
+    if vectors is not None:
+        np.save(os.path.join(path, 'vectors.npy'), vectors.astype(np.float16))
+    with open(os.path.join(path, 'terms.json'), 'w', encoding='utf-8') as f:
+        json.dump(terms, f)
+
+
+class Segment:
+    """Read-only view of a segment directory; arrays are memory-mapped"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode='r')
+
+        self.offsets = load('chunk_offsets.npy')
+        self.chunk_doc = load('chunk_doc.npy')
+        self.chunk_page = load('chunk_page.npy')
+        self.chunk_len = load('chunk_len.npy')
+        self.indptr = load('indptr.npy')
+        self.post_chunk = load('post_chunk.npy')
+        self.post_tf = load('post_tf.npy')
+        vectors_path = os.path.join(path, 'vectors.npy')
+        self.vectors = np.load(vectors_path, mmap_mode='r') if os.path.exists(vectors_path) else None
+        self.blob = np.memmap(os.path.join(path, 'chunks.bin'), dtype=np.uint8, mode='r')
+        with open(os.path.join(path, 'terms.json'), encoding='utf-8') as f:
+            self.terms = json.load(f)
+        self.vocab = {term: i for i, term in enumerate(self.terms)}
+
+    def __len__(self) -> int:
+        return len(self.chunk_doc)
+
+    def text(self, chunk: int) -> str:
+        return bytes(self.blob[self.offsets[chunk]:self.offsets[chunk + 1]]).decode('utf-8')
+
+    def postings(self, term: str):
+        term_id = self.vocab.get(term)
+        if term_id is None:
+            return None, None
+        lo, hi = self.indptr[term_id], self.indptr[term_id + 1]
+        return self.post_chunk[lo:hi], self.post_tf[lo:hi].astype(np.float32)
+
+
+class CorpusIndex:
+    """Persistent passage index over a library of PDF and TXT files.
+
+    The index directory holds a JSON manifest plus immutable segments. Each
+    ingest extracts new or changed files on a process pool (files whose size
+    and mtime, or else content hash, are unchanged are skipped) and writes
+    their passages as a new segment: chunk text in one UTF-8 blob with an
+    offsets array, chunk metadata as columns, BM25 postings as term-major
+    arrays, and optionally a float16 embedding matrix. Everything is
+    memory-mapped at query time. Replaced or removed documents are
+    tombstoned and dropped when segments are merged.
+
+    Documents are keyed by their path relative to ``root`` (absolute
+    without one), so several folders can be indexed into one library; an
+    ingest only drops documents from under the folder it reads. It works
+    on a copy of the manifest and writes only new segment directories, then
+    swaps the manifest and open segments in at once, so queries keep
+    reading the previous version meanwhile.
+    """
+
+    MAX_SEGMENTS = 8
+
+    def __init__(self, index_dir: str, chunk_chars: int = 1200, overlap_chars: int = 200,
+                 vector_dim: int = 256, k1: float = 1.5, b: float = 0.75, root: Optional[str] = None):
+        self.index_dir = index_dir
+        self.root = os.path.realpath(root) if root else None
+        self.chunk_chars = chunk_chars
+        self.overlap_chars = overlap_chars
+        self.vector_dim = vector_dim
+        self.k1 = k1
+        self.b = b
+        self.embedder = HashingEmbedder(vector_dim) if vector_dim else None
+
+        # Guards the swap of manifest, segments and summary; held only briefly
+        self._lock = threading.Lock()
+        # One ingest at a time
+        self._ingest_lock = threading.Lock()
+        os.makedirs(index_dir, exist_ok=True)
+        self._install(self._load_manifest())
+
+    def ingest(self, directory: str, workers: Optional[int] = None, segment_docs: int = 500,
+               progress: Optional[Callable[[int, int], None]] = None,
+               cancelled: Optional[Callable[[], bool]] = None) -> Dict:
+        """Index new and changed files under a directory and drop removed ones.
+
+        Only documents under ``directory`` can be removed; the rest of the
+        library is left alone. When ``cancelled()`` turns true, indexing
+        stops before the next file; files indexed so far are kept and the
+        rest stay pending for next time.
+        """
+        with self._ingest_lock:
+            manifest = copy.deepcopy(self._view()[0])
+            stats = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0, 'failed': 0}
+            docs = manifest['docs']
+            by_path = {doc['path']: doc_id for doc_id, doc in docs.items()}
+
+            directory = os.path.realpath(directory)
+            scope = self._key(directory)
+            found = {}
+            for root, _, names in os.walk(directory):
+                for name in names:
+                    if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                        path = os.path.join(root, name)
+                        found[self._key(path)] = path
+
+            for rel_path in {p for p in by_path if self._contains(scope, p)} - set(found):
+                self._delete_doc(manifest, by_path.pop(rel_path))
+                stats['removed'] += 1
+
+            pending = []
+            for rel_path, path in sorted(found.items()):
+                stat = os.stat(path)
+                doc = docs.get(by_path.get(rel_path))
+                if doc and doc['size'] == stat.st_size and doc['mtime'] == stat.st_mtime:
+                    stats['unchanged'] += 1
+                else:
+                    pending.append((rel_path, path, stat))
+
+            batch = []
+            extracted = self._extract(pending, workers)
+            for done, (rel_path, path, stat, result) in enumerate(extracted, start=1):
+                if progress:
+                    progress(done, len(pending))
+                if cancelled and cancelled():
+                    stats['cancelled'] = True
+                    extracted.close()
+                    break
+                if 'error' in result:
+                    stats['failed'] += 1
+                    continue
+
+                old_id = by_path.get(rel_path)
+                if old_id is not None and docs[old_id]['hash'] == result['hash']:
+                    # Touched but not modified: just remember the new mtime
+                    docs[old_id]['mtime'] = stat.st_mtime
+                    stats['unchanged'] += 1
+                    continue
+                if old_id is not None:
+                    self._delete_doc(manifest, old_id)
+                    stats['updated'] += 1
+                else:
+                    stats['added'] += 1
+
+                doc_id = str(manifest['next_doc_id'])
+                manifest['next_doc_id'] += 1
+                docs[doc_id] = {
+                    'path': rel_path,
+                    'hash': result['hash'],
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime,
+                    'pages': result['pages']
+                }
+                by_path[rel_path] = doc_id
+                batch.append((int(doc_id), result))
+                if len(batch) >= segment_docs:
+                    self._write_batch(manifest, batch)
+                    batch = []
+
+            if batch:
+                self._write_batch(manifest, batch)
+            obsolete = []
+            if len(manifest['segments']) > self.MAX_SEGMENTS:
+                obsolete = self._merge_segments(manifest)
+
+            self._save_manifest(manifest)
+            self._install(manifest)
+            # Open views keep their mappings after the files are removed
+            for name in obsolete:
+                shutil.rmtree(os.path.join(self.index_dir, name), ignore_errors=True)
+            stats['documents'] = len(docs)
+            stats['chunks'] = self._summary['chunk_count']
+            return stats
+
+    def _key(self, path: str) -> str:
+        """Manifest key of a file or folder: its path relative to ``root``, or its absolute path"""
+        path = os.path.abspath(path)
+        if self.root is None:
+            return path
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f"{path} is outside the corpus root {self.root}")
+        return os.path.relpath(path, self.root)
+
+    @staticmethod
+    def _contains(scope: str, key: str) -> bool:
+        """Whether a document key lies under the folder key ``scope``"""
+        return scope == os.curdir or key == scope or key.startswith(scope.rstrip(os.sep) + os.sep)
+
+    def _extract(self, pending, workers: Optional[int]):
+        args = (self.chunk_chars, self.overlap_chars, self.vector_dim)
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1 or len(pending) < 4:
+            for rel_path, path, stat in pending:
+                yield rel_path, path, stat, _ingest_file(path, *args)
+            return
+
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            futures = [pool.submit(_ingest_file, path, *args) for _, path, _ in pending]
+            for (rel_path, path, stat), future in zip(pending, futures):
+                yield rel_path, path, stat, future.result()
+        finally:
+            # Drop files not yet started if the caller stopped early
+            pool.shutdown(cancel_futures=True)
+
+    def _write_batch(self, manifest: Dict, batch: List[Tuple[int, Dict]]) -> None:
+        texts, chunk_doc, chunk_page, counters, vectors = [], [], [], [], []
+        for doc_id, result in batch:
+            texts.extend(result['texts'])
+            chunk_doc.extend([doc_id] * len(result['texts']))
+            chunk_page.extend(result['chunk_pages'])
+            counters.extend(result['terms'])
+            if result['vectors'] is not None:
+                vectors.append(result['vectors'])
+        if not texts:
+            return
+
+        vocab = {}
+        term_ids, chunk_ids, tfs = [], [], []
+        for chunk_id, counts in enumerate(counters):
+            for term, tf in counts.items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                chunk_ids.append(chunk_id)
+                tfs.append(tf)
+
+        encoded = [t.encode('utf-8') for t in texts]
+        offsets = np.concatenate(([0], np.cumsum([len(e) for e in encoded])))
+        chunk_len = np.array([sum(c.values()) for c in counters], dtype=np.float32)
+
+        name = f"seg_{manifest['next_segment']:06d}"
+        manifest['next_segment'] += 1
+        _save_segment(
+            os.path.join(self.index_dir, name), b"".join(encoded), offsets,
+            np.array(chunk_doc), np.array(chunk_page), chunk_len, list(vocab),
+            np.array(term_ids, dtype=np.int64), np.array(chunk_ids, dtype=np.int64),
+            np.array(tfs, dtype=np.int64), np.vstack(vectors) if vectors else None
+        )
+        manifest['segments'].append({'name': name, 'chunks': len(texts), 'total_len': float(chunk_len.sum())})
+
+    @staticmethod
+    def _delete_doc(manifest: Dict, doc_id: str) -> None:
+        manifest['docs'].pop(doc_id, None)
+        manifest['deleted'].append(int(doc_id))
+
+    def _merge_segments(self, manifest: Dict) -> List[str]:
+        """Merge all segments into one, dropping tombstoned documents; returns the replaced segments"""
+        segments = [Segment(os.path.join(self.index_dir, s['name'])) for s in manifest['segments']]
+        deleted = np.array(manifest['deleted'], dtype=np.int32)
+
+        vocab = {}
+        blobs, lengths, docs, pages, chunk_lens, vectors = [], [], [], [], [], []
+        term_ids, chunk_ids, tfs = [], [], []
+        base = 0
+        for segment in segments:
+            live = ~np.isin(segment.chunk_doc, deleted)
+            remap = np.where(live, np.cumsum(live) - 1 + base, -1)
+            local_to_global = np.array([vocab.setdefault(t, len(vocab)) for t in segment.terms], dtype=np.int64)
+
+            post_terms = np.repeat(np.arange(len(segment.terms)), np.diff(segment.indptr))
+            post_chunks = remap[segment.post_chunk]
+            keep = post_chunks >= 0
+            term_ids.append(local_to_global[post_terms[keep]])
+            chunk_ids.append(post_chunks[keep])
+            tfs.append(np.asarray(segment.post_tf)[keep].astype(np.int64))
+
+            for chunk in np.flatnonzero(live):
+                blobs.append(bytes(segment.blob[segment.offsets[chunk]:segment.offsets[chunk + 1]]))
+            lengths.append(np.diff(segment.offsets)[live])
+            docs.append(np.asarray(segment.chunk_doc)[live])
+            pages.append(np.asarray(segment.chunk_page)[live])
+            chunk_lens.append(np.asarray(segment.chunk_len)[live])
+            if segment.vectors is not None:
+                vectors.append(np.asarray(segment.vectors)[live])
+            base += int(live.sum())
+
+        old_names = [s['name'] for s in manifest['segments']]
+        name = f"seg_{manifest['next_segment']:06d}"
+        manifest['next_segment'] += 1
+        chunk_len = np.concatenate(chunk_lens)
+        _save_segment(
+            os.path.join(self.index_dir, name), b"".join(blobs),
+            np.concatenate(([0], np.cumsum(np.concatenate(lengths)))),
+            np.concatenate(docs), np.concatenate(pages), chunk_len, list(vocab),
+            np.concatenate(term_ids), np.concatenate(chunk_ids), np.concatenate(tfs),
+            np.vstack(vectors) if len(vectors) == len(segments) else None
+        )
+        manifest['segments'] = [{'name': name, 'chunks': base, 'total_len': float(chunk_len.sum())}] if base else []
+        manifest['deleted'] = []
+        if not base:
+            shutil.rmtree(os.path.join(self.index_dir, name), ignore_errors=True)
+        return old_names
+
+    def retrieve(self, query: str, top_k: int = 8, token_budget: int = 6000) -> List[Dict]:
+        """Best passages across the corpus, each citing its file and page"""
+        view = self._view()
+        manifest, segments, deleted_masks = view
+        tokens = set(tokenize(query))
+        total_chunks = sum(s['chunks'] for s in manifest['segments'])
+        if not tokens or not total_chunks:
+            return self._overview(view, token_budget)
+        avg_len = sum(s['total_len'] for s in manifest['segments']) / total_chunks
+
+        postings = {t: [segment.postings(t) for segment in segments] for t in tokens}
+        idf = {}
+        for term, per_segment in postings.items():
+            df = sum(len(chunks) for chunks, _ in per_segment if chunks is not None)
+            idf[term] = np.log(1.0 + (total_chunks - df + 0.5) / (df + 0.5))
+
+        candidates = []
+        for n, segment in enumerate(segments):
+            scores = np.zeros(len(segment), dtype=np.float32)
+            norm = self.k1 * (1 - self.b + self.b * segment.chunk_len / avg_len)
+            for term, per_segment in postings.items():
+                chunks, tf = per_segment[n]
+                if chunks is None:
+                    continue
+                scores[chunks] += idf[term] * tf * (self.k1 + 1) / (tf + norm[chunks])
+            scores[deleted_masks[n]] = 0
+
+            count = min(top_k * 4, len(segment))
+            best = np.argpartition(-scores, count - 1)[:count]
+            candidates.extend((float(scores[i]), n, int(i)) for i in best if scores[i] > 0)
+
+        candidates.sort(reverse=True)
+        candidates = candidates[:top_k * 4]
+        if not candidates:
+            return self._overview(view, token_budget)
+        ranked = self._rerank(query, candidates, segments)[:top_k]
+        return self._pack([self._passage(manifest, segments, n, i) for n, i in ranked], token_budget)
+
+    def overview(self, token_budget: int = 6000) -> List[Dict]:
+        """Passages sampled evenly across the corpus"""
+        return self._overview(self._view(), token_budget)
+
+    def _overview(self, view, token_budget: int) -> List[Dict]:
+        manifest, segments, deleted_masks = view
+        live = [(n, int(i)) for n, segment in enumerate(segments) for i in np.flatnonzero(~deleted_masks[n])]
+        if not live:
+            return []
+        count = max(1, min(len(live), token_budget // (self.chunk_chars // 4)))
+        picks = np.linspace(0, len(live) - 1, count).round().astype(int)
+        return self._pack([self._passage(manifest, segments, *live[p]) for p in dict.fromkeys(picks.tolist())],
+                          token_budget)
+
+    def build_context(self, query: Optional[str] = None, top_k: int = 8, token_budget: int = 6000) -> str:
+        """Prompt-ready passages labelled with their source file and page"""
+        passages = self.retrieve(query, top_k, token_budget) if query else self.overview(token_budget)
+        return "\n\n".join(f"[Source: {p['source']}, page {p['page']}]\n{p['text']}" for p in passages)
+
+    def describe(self) -> Dict:
+        """Corpus-level stand-in for a single document's processed data"""
+        with self._lock:
+            summary = self._summary
+        return {
+            'full_text': '',
+            **summary,
+            'char_count': 0,
+            'sentences': [],
+            'paragraphs': [],
+            'page_offsets': []
+        }
+
+    def _rerank(self, query: str, candidates: List[Tuple[float, int, int]],
+                segments: List[Segment]) -> List[Tuple[int, int]]:
+        scores = np.array([c[0] for c in candidates], dtype=np.float32)
+        scores /= scores.max()
+        if self.embedder is not None and all(segments[n].vectors is not None for _, n, _ in candidates):
+            query_vector = self.embedder.embed([query])[0]
+            similarity = np.array([
+                float(np.asarray(segments[n].vectors[i], dtype=np.float32) @ query_vector)
+                for _, n, i in candidates
+            ])
+            scores = 0.7 * scores + 0.3 * similarity
+        return [(candidates[j][1], candidates[j][2]) for j in np.argsort(-scores)]
+
+    @staticmethod
+    def _passage(manifest: Dict, segments: List[Segment], segment_index: int, chunk: int) -> Dict:
+        segment = segments[segment_index]
+        doc_id = str(int(segment.chunk_doc[chunk]))
+        return {
+            'text': segment.text(chunk),
+            'source': manifest['docs'][doc_id]['path'],
+            'page': int(segment.chunk_page[chunk]),
+            'doc_id': doc_id
+        }
+
+    @staticmethod
+    def _pack(passages: List[Dict], token_budget: int) -> List[Dict]:
+        selected = []
+        used = 0
+        for passage in passages:
+            cost = estimate_tokens(passage['text'])
+            if selected and used + cost > token_budget:
+                continue
+            selected.append(passage)
+            used += cost
+        return selected
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.index_dir, 'manifest.json')
+
+    def _load_manifest(self) -> Dict:
+        path = self._manifest_path()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest
+            # Written by another version: start over rather than mix key or segment layouts
+            for name in os.listdir(self.index_dir):
+                if name.startswith('seg_'):
+                    shutil.rmtree(os.path.join(self.index_dir, name), ignore_errors=True)
+        return {'version': MANIFEST_VERSION, 'next_doc_id': 0, 'next_segment': 0,
+                'segments': [], 'docs': {}, 'deleted': []}
+
+    def _save_manifest(self, manifest: Dict) -> None:
+        tmp_path = self._manifest_path() + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path())
+
+    def _view(self) -> Tuple[Dict, List[Segment], List[np.ndarray]]:
+        """Manifest, open segments and tombstone masks of one version of the index"""
+        with self._lock:
+            return self.manifest, self._segments, self._deleted_masks
+
+    def _install(self, manifest: Dict) -> None:
+        """Open a manifest's segments and make it the version queries read"""
+        segments = [Segment(os.path.join(self.index_dir, s['name'])) for s in manifest['segments']]
+        deleted = np.array(manifest['deleted'], dtype=np.int32)
+        deleted_masks = [np.isin(segment.chunk_doc, deleted) for segment in segments]
+        docs = manifest['docs'].values()
+        # Computed once per version, since every library request looks the corpus up by it
+        summary = {
+            'corpus_hash': hashlib.sha256(
+                json.dumps(sorted((d['path'], d['hash']) for d in docs)).encode('utf-8')
+            ).hexdigest(),
+            'document_count': len(docs),
+            'page_count': sum(d['pages'] for d in docs),
+            # Tombstoned chunks stay in their segment until the next merge
+            'chunk_count': int(sum(len(mask) - mask.sum() for mask in deleted_masks)),
+            'word_count': int(sum(np.asarray(segment.chunk_len)[~mask].sum()
+                                  for segment, mask in zip(segments, deleted_masks)))
+        }
+        with self._lock:
+            self.manifest = manifest
+            self._segments = segments
+            self._deleted_masks = deleted_masks
+            self._summary = summary
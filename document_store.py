@@ -0,0 +1,123 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+def content_hash(data: bytes) -> str:
+    """Return the SHA-256 hex digest used to key documents"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class DocumentStore:
+    """Two-tier cache of processed documents keyed by content hash.
+
+    Entries are plain dicts (``processed_data``, ``retriever``, ``summary``). The
+    memory tier is an LRU of ``max_entries`` items; when ``cache_dir`` is set,
+    entries are also pickled to disk and the directory is trimmed to
+    ``max_disk_bytes`` by evicting the least recently used files first.
+    """
+
+    def __init__(self, max_entries: int = 16, cache_dir: Optional[str] = None,
+                 max_disk_bytes: int = 512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.RLock()
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, doc_hash: str) -> Optional[Dict]:
+        """Look up a document, promoting disk hits into memory"""
+        with self._lock:
+            entry = self._memory.get(doc_hash)
+            if entry is not None:
+                self._memory.move_to_end(doc_hash)
+                return entry
+
+            entry = self._read_disk(doc_hash)
+            if entry is not None:
+                self._remember(doc_hash, entry)
+            return entry
+
+    def put(self, doc_hash: str, entry: Dict) -> None:
+        """Store a document in both tiers"""
+        with self._lock:
+            self._remember(doc_hash, entry)
+            self._write_disk(doc_hash, entry)
+
+    def delete(self, doc_hash: str) -> None:
+        """Drop a document from both tiers"""
+        with self._lock:
+            self._memory.pop(doc_hash, None)
+            path = self._disk_path(doc_hash)
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _remember(self, doc_hash: str, entry: Dict) -> None:
+        self._memory[doc_hash] = entry
+        self._memory.move_to_end(doc_hash)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_path(self, doc_hash: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, f"{doc_hash}.pkl")
+
+    def _read_disk(self, doc_hash: str) -> Optional[Dict]:
+        path = self._disk_path(doc_hash)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+            # Touch the file so eviction sees it as recently used
+            os.utime(path, None)
+            return entry
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+
+    def _write_disk(self, doc_hash: str, entry: Dict) -> None:
+        path = self._disk_path(doc_hash)
+        if not path:
+            return
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        files = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.pkl'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,274 @@
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Numeric span attributes that are also summed into Prometheus counters
+COUNTED_ATTRIBUTES = ('prompt_chars', 'prompt_tokens', 'cached_tokens', 'response_tokens', 'retries')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('current_span', default=None)
+
+# Set per request (e.g. from an HTTP header) to profile the next root span: 'cpu' or 'memory'
+profile_request: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('profile_request', default=None)
+
+
+class Span:
+    """One timed stage. Attributes are free-form; ``cache`` is 'hit' or 'miss'"""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'started', 'duration', 'status', 'error', 'attrs')
+
+    def __init__(self, name: str, parent: Optional['Span'], attrs: Dict):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.started = time.time()
+        self.duration = 0.0
+        self.status = 'ok'
+        self.error = None
+        self.attrs = dict(attrs)
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def add(self, key: str, amount: float = 1) -> None:
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+    def to_dict(self) -> Dict:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.started, 6),
+            'duration_ms': round(self.duration * 1000, 3),
+            'status': self.status,
+            'error': self.error,
+            'attrs': self.attrs
+        }
+
+
+class _NullSpan:
+    """Stand-in returned by ``current_span`` outside any span, so callers needn't check"""
+
+    def set(self, **attrs) -> None:
+        pass
+
+    def add(self, key: str, amount: float = 1) -> None:
+        pass
+
+
+class Metrics:
+    """Counters and latency histograms derived from finished spans"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = defaultdict(float)
+        self._histograms: Dict[str, List[float]] = {}
+
+    def record(self, span: Span) -> None:
+        with self._lock:
+            self._counters[('spans_total', (('span', span.name), ('status', span.status)))] += 1
+            for key in COUNTED_ATTRIBUTES:
+                value = span.attrs.get(key)
+                if isinstance(value, (int, float)):
+                    self._counters[(f'{key}_total', (('span', span.name),))] += value
+            if span.attrs.get('cache') in ('hit', 'miss'):
+                self._counters[('cache_total', (('span', span.name), ('result', span.attrs['cache'])))] += 1
+
+            # Per-bucket counts, then the running sum and count
+            histogram = self._histograms.setdefault(span.name, [0.0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if span.duration <= bound:
+                    histogram[i] += 1
+            histogram[-2] += span.duration
+            histogram[-1] += 1
+
+    def prometheus_text(self, prefix: str = 'assistant_') -> str:
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            by_name = defaultdict(list)
+            for (name, labels), value in sorted(self._counters.items()):
+                by_name[name].append((labels, value))
+            for name, samples in by_name.items():
+                lines.append(f"# TYPE {prefix}{name} counter")
+                for labels, value in samples:
+                    lines.append(f"{prefix}{name}{{{_labels(labels)}}} {_number(value)}")
+
+            if self._histograms:
+                lines.append(f"# TYPE {prefix}span_seconds histogram")
+            for span_name, histogram in sorted(self._histograms.items()):
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f'{prefix}span_seconds_bucket{{span="{span_name}",le="{bound}"}} {_number(count)}')
+                lines.append(f'{prefix}span_seconds_bucket{{span="{span_name}",le="+Inf"}} {_number(histogram[-1])}')
+                lines.append(f'{prefix}span_seconds_sum{{span="{span_name}"}} {histogram[-2]:.6f}')
+                lines.append(f'{prefix}span_seconds_count{{span="{span_name}"}} {_number(histogram[-1])}')
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """Records nested spans around pipeline stages and model calls.
+
+    Finished spans update ``metrics``, are kept in a bounded ``recent`` buffer
+    and, when ``log_path`` is set, are appended to it as JSON lines. A root
+    span (one with no parent) is profiled when ``profile_request`` is set for
+    the current request, or at random with ``profile_sample_rate``; the
+    report is stored in the span's ``profile`` attribute.
+    """
+
+    def __init__(self, log_path: Optional[str] = None, profile_sample_rate: float = 0.0,
+                 recent_spans: int = 1000):
+        self.log_path = log_path
+        self.profile_sample_rate = profile_sample_rate
+        self.metrics = Metrics()
+        self.recent = deque(maxlen=recent_spans)
+        self._log_lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, attach: bool = True, **attrs) -> Iterator[Span]:
+        """Time a block as a span nested under the current one.
+
+        Use ``attach=False`` inside generators: the span is then recorded but
+        never made current, since a generator can be resumed in a different
+        context (e.g. a thread pool) than the one it started in.
+        """
+        parent = _current_span.get()
+        span = Span(name, parent, attrs)
+        token = _current_span.set(span) if attach else None
+        profile = self._profile_mode() if parent is None and attach else None
+        profiler = _start_profile(profile)
+        started = time.perf_counter()
+        try:
+            yield span
+        except GeneratorExit:
+            # The consumer of a generator stopped reading early
+            span.status = 'cancelled'
+            raise
+        except BaseException as e:
+            span.status = 'error'
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            if profiler is not None:
+                span.attrs['profile'] = _stop_profile(profile, profiler)
+            if token is not None:
+                _current_span.reset(token)
+            self._finish(span)
+
+    def _profile_mode(self) -> Optional[str]:
+        requested = profile_request.get()
+        if requested:
+            return requested
+        if self.profile_sample_rate and random.random() < self.profile_sample_rate:
+            return 'cpu'
+        return None
+
+    def _finish(self, span: Span) -> None:
+        self.metrics.record(span)
+        record = span.to_dict()
+        self.recent.append(record)
+        if self.log_path:
+            line = json.dumps(record, default=str)
+            with self._log_lock, open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+
+    def recent_jsonl(self, limit: int = 100) -> str:
+        records = list(self.recent)[-limit:]
+        return "".join(json.dumps(r, default=str) + "\n" for r in records)
+
+
+def current_span():
+    """The innermost active span, or a no-op stand-in outside any span"""
+    return _current_span.get() or _NullSpan()
+
+
+def traced(name: str):
+    """Decorator running each call of a function in a span"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# Memory profiles in progress, and whether they started tracemalloc (and so must stop it)
+_memory_lock = threading.Lock()
+_memory_profiles = 0
+_tracing_started = False
+
+
+def _start_profile(mode: Optional[str]):
+    if mode == 'cpu':
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return None
+        return profiler
+    if mode == 'memory':
+        global _memory_profiles, _tracing_started
+        # tracemalloc is process-wide, so overlapping memory profiles share one tracing session
+        with _memory_lock:
+            if _memory_profiles == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _tracing_started = True
+            _memory_profiles += 1
+            return tracemalloc.take_snapshot()
+    return None
+
+
+def _stop_profile(mode: str, profiler, limit: int = 25) -> str:
+    if mode == 'cpu':
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+    global _memory_profiles, _tracing_started
+    with _memory_lock:
+        # Someone else may have stopped tracing meanwhile; then there is nothing to compare
+        after = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        _, peak = tracemalloc.get_traced_memory()
+        _memory_profiles -= 1
+        if _memory_profiles == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+    if after is None:
+        return "memory tracing was stopped before the span finished"
+    lines = [f"peak traced memory: {peak / 1024 / 1024:.1f} MB"]
+    lines.extend(str(stat) for stat in after.compare_to(profiler, 'lineno')[:limit])
+    return "\n".join(lines)
+
+
+def _labels(labels: Tuple) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in labels)
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.6f}"
+
+
+# Process-wide tracer used by the pipeline; configured from the environment
+tracer = Tracer(
+    log_path=os.environ.get("TRACE_LOG_PATH"),
+    profile_sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+)
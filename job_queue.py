@@ -0,0 +1,242 @@
+import contextvars
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+JOB_COLUMNS = "id, kind, key, status, stage, done, total, stages, result, error, cancel_requested, created_at, updated_at"
+
+
+class JobNotFound(KeyError):
+    """No job with the requested id"""
+
+
+class JobCancelled(BaseException):
+    """Raised inside a job once it has been asked to stop.
+
+    Like ``asyncio.CancelledError`` it is not an ``Exception``, so the
+    pipeline's catch-all fallbacks (e.g. for failed summaries) let it through.
+    """
+
+
+class Job:
+    """Handle a running job uses to report progress and notice cancellation"""
+
+    # Progress is written to the job table at most this often, unless a stage starts or ends
+    WRITE_INTERVAL = 0.25
+
+    def __init__(self, queue: 'JobQueue', job_id: str):
+        self.queue = queue
+        self.id = job_id
+        self.stages: Dict[str, List[int]] = {}
+        self._last_write = 0.0
+        self._cancelled = False
+
+    def progress(self, stage: str, done: int, total: int) -> None:
+        """Record progress through a stage; raises ``JobCancelled`` if cancellation was requested"""
+        if self.update(stage, done, total):
+            raise JobCancelled(self.id)
+
+    def update(self, stage: str, done: int, total: int) -> bool:
+        """Record progress without raising; returns whether cancellation was requested"""
+        new_stage = stage not in self.stages
+        self.stages[stage] = [done, total]
+        now = time.monotonic()
+        if new_stage or done >= total or now - self._last_write >= self.WRITE_INTERVAL:
+            self._last_write = now
+            self._cancelled = self.queue._update_progress(self.id, stage, done, total, self.stages)
+        return self._cancelled
+
+    def publish(self, result: Dict) -> None:
+        """Make an interim result visible to pollers before the job finishes"""
+        self.queue._set(self.id, result=json.dumps(result))
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether cancellation was requested, as of the last progress write"""
+        return self._cancelled
+
+
+class JobQueue:
+    """Background jobs on a thread pool, tracked in a persistent job table.
+
+    Each job runs ``func(job, *args)`` and reports its stage and progress
+    through the ``Job`` handle; its return value becomes the job's result.
+    Status, progress and results live in SQLite, so with a shared ``path``
+    every worker on the host can poll or cancel any job. Cancellation is
+    cooperative: it is noticed at the job's next progress report. Jobs left
+    queued or running by a process that has since exited are marked
+    ``interrupted`` on startup. Finished jobs are kept for ``retention_seconds``.
+    """
+
+    def __init__(self, path: str = ":memory:", workers: int = 2, retention_seconds: float = 7 * 24 * 3600):
+        self.retention_seconds = retention_seconds
+        # The random part tells this process apart from an earlier one that had the same pid
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                key TEXT,
+                status TEXT NOT NULL,
+                stage TEXT,
+                done INTEGER NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 0,
+                stages TEXT NOT NULL DEFAULT '{}',
+                result TEXT,
+                error TEXT,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                owner TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_kind_key ON jobs (kind, key, status);
+        """)
+        self._recover()
+
+    def submit(self, kind: str, func: Callable, *args, key: Optional[str] = None) -> Dict:
+        """Queue ``func(job, *args)``; ``key`` names what the job works on (e.g. a document hash)"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, key, status, owner, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, key, self.owner, now, now)
+            )
+            self._conn.execute("DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND updated_at < ?",
+                               (now - self.retention_seconds,))
+            self._conn.commit()
+        # Carry the caller's context so the job's spans join the request's trace
+        self._pool.submit(contextvars.copy_context().run, self._run, job_id, func, args)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Dict:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise JobNotFound(job_id)
+        return self._record(row)
+
+    def find(self, kind: str, key: str) -> Optional[Dict]:
+        """The queued or running job of a kind working on ``key``, if any"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {JOB_COLUMNS} FROM jobs WHERE kind = ? AND key = ? AND status IN (?, ?) "
+                "ORDER BY created_at DESC LIMIT 1",
+                (kind, key, *ACTIVE_STATUSES)
+            ).fetchone()
+        return self._record(row) if row else None
+
+    def jobs(self, limit: int = 50) -> List[Dict]:
+        """Most recent jobs first"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {JOB_COLUMNS} FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._record(row) for row in rows]
+
+    def cancel(self, job_id: str) -> Dict:
+        """Ask a job to stop; a job that hasn't started yet is cancelled outright"""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            self._conn.execute("UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status = 'queued'",
+                               (time.time(), job_id))
+            self._conn.commit()
+        return self.get(job_id)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    @staticmethod
+    def _record(row) -> Dict:
+        (job_id, kind, key, status, stage, done, total, stages, result, error,
+         cancel_requested, created_at, updated_at) = row
+        return {
+            'id': job_id,
+            'kind': kind,
+            'key': key,
+            'status': status,
+            'stage': stage,
+            'done': done,
+            'total': total,
+            'stages': json.loads(stages),
+            'result': json.loads(result) if result else None,
+            'error': error,
+            'cancel_requested': bool(cancel_requested),
+            'created_at': created_at,
+            'updated_at': updated_at
+        }
+
+    def _run(self, job_id: str, func: Callable, args) -> None:
+        with self._lock:
+            started = self._conn.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id)
+            ).rowcount
+            self._conn.commit()
+        if not started:
+            return  # cancelled while queued
+
+        try:
+            result = func(Job(self, job_id), *args)
+        except JobCancelled:
+            self._set(job_id, status='cancelled')
+        except Exception as e:
+            self._set(job_id, status='failed', error=str(e))
+        else:
+            self._set(job_id, status='done', result=json.dumps(result))
+
+    def _set(self, job_id: str, **fields) -> None:
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ?",
+                               (*fields.values(), time.time(), job_id))
+            self._conn.commit()
+
+    def _update_progress(self, job_id: str, stage: str, done: int, total: int, stages: Dict) -> bool:
+        """Write progress and return whether the job has been asked to stop"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET stage = ?, done = ?, total = ?, stages = ?, updated_at = ? WHERE id = ?",
+                (stage, done, total, json.dumps(stages), time.time(), job_id)
+            )
+            self._conn.commit()
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def _recover(self) -> None:
+        """Mark jobs whose process on this host is gone as interrupted"""
+        host = socket.gethostname()
+        with self._lock:
+            rows = self._conn.execute("SELECT id, owner FROM jobs WHERE status IN (?, ?)", ACTIVE_STATUSES).fetchall()
+            for job_id, owner in rows:
+                owner_host, pid, _ = owner.rsplit(':', 2)
+                if owner_host == host and owner != self.owner and (
+                        int(pid) == os.getpid() or not _process_alive(int(pid))):
+                    self._conn.execute("UPDATE jobs SET status = 'interrupted', updated_at = ? WHERE id = ?",
+                                       (time.time(), job_id))
+            self._conn.commit()
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,422 @@
+import asyncio
+import contextvars
+import datetime
+import hashlib
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from instrumentation import current_span, tracer
+from retrieval import estimate_tokens
+
+
+# Model that produced the latest successful response in this context; behind a
+# ``ModelRouter`` that may be a fallback tier rather than the primary model
+served_model: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('served_model', default=None)
+
+
+class TransientModelError(Exception):
+    """A model failure worth retrying (rate limit, overload, timeout)"""
+
+
+class CachedContentNotFound(Exception):
+    """A cached-content handle was deleted or has expired"""
+
+
+class GeminiBackend:
+    """Google Gemini through the google-generativeai SDK"""
+
+    # Models bound to cached contents are kept for reuse, up to this many
+    MAX_CACHED_MODELS = 64
+
+    def __init__(self, api_key: str, model_name: str = 'gemini-1.5-flash'):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.genai = genai
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+        self._cached_models: Dict[str, object] = {}
+
+    def generate(self, prompt: str, timeout: Optional[float] = None, cached_content: Optional[str] = None,
+                 json_output: bool = False) -> str:
+        request_options = {'timeout': timeout} if timeout else None
+        response = self._model(cached_content).generate_content(
+            prompt, generation_config=self._generation_config(json_output), request_options=request_options
+        )
+        return response.text
+
+    def stream(self, prompt: str, timeout: Optional[float] = None,
+               cached_content: Optional[str] = None, json_output: bool = False) -> Iterator[str]:
+        request_options = {'timeout': timeout} if timeout else None
+        for chunk in self._model(cached_content).generate_content(
+                prompt, stream=True, generation_config=self._generation_config(json_output),
+                request_options=request_options):
+            yield chunk.text
+
+    @staticmethod
+    def _generation_config(json_output: bool) -> Optional[Dict]:
+        # JSON mode makes the model emit a single well-formed JSON value
+        return {'response_mime_type': 'application/json'} if json_output else None
+
+    def create_cache(self, system_instruction: str, content: str, ttl_seconds: float) -> str:
+        """Pin a prompt prefix in Gemini's cached-content store, returning its name"""
+        from google.generativeai import caching
+
+        cache = caching.CachedContent.create(
+            model=self.model_name,
+            system_instruction=system_instruction,
+            contents=[content],
+            ttl=datetime.timedelta(seconds=ttl_seconds)
+        )
+        return cache.name
+
+    def delete_cache(self, name: str) -> None:
+        from google.generativeai import caching
+
+        self._cached_models.pop(name, None)
+        caching.CachedContent.get(name).delete()
+
+    def _model(self, cached_content: Optional[str]):
+        if not cached_content:
+            return self.model
+        model = self._cached_models.get(cached_content)
+        if model is None:
+            from google.generativeai import caching
+
+            if len(self._cached_models) >= self.MAX_CACHED_MODELS:
+                self._cached_models.clear()
+            model = self.genai.GenerativeModel.from_cached_content(
+                cached_content=caching.CachedContent.get(cached_content)
+            )
+            self._cached_models[cached_content] = model
+        return model
+
+    @staticmethod
+    def is_transient(error: Exception) -> bool:
+        from google.api_core import exceptions
+
+        return isinstance(error, (
+            TransientModelError,
+            exceptions.TooManyRequests,
+            exceptions.ResourceExhausted,
+            exceptions.ServiceUnavailable,
+            exceptions.InternalServerError,
+            exceptions.DeadlineExceeded,
+        ))
+
+
+class StubBackend:
+    """Deterministic offline backend for tests and benchmarks.
+
+    ``responder`` maps a prompt to the response text (by default a short echo
+    derived from the prompt hash). ``latency`` adds a fixed delay per call and
+    ``tokens_per_second`` a generation delay proportional to response length
+    (spread across chunks when streaming). ``prefill_tokens_per_second``
+    adds a delay for reading the uncached part of the prompt. The first
+    ``fail_first`` calls raise ``TransientModelError``.
+
+    Cached contents behave like Gemini's: ``create_cache`` pins a prefix
+    until its TTL runs out, calls that name it see the prefix followed by
+    the prompt, and only the prompt counts as uncached input. Using a
+    deleted or expired cache raises ``CachedContentNotFound``.
+    """
+
+    def __init__(self, responder: Optional[Callable[[str], str]] = None, latency: float = 0.0,
+                 tokens_per_second: Optional[float] = None, fail_first: int = 0,
+                 model_name: str = 'stub', prefill_tokens_per_second: Optional[float] = None):
+        self.responder = responder or self.echo
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.fail_first = fail_first
+        self.model_name = model_name
+        self.calls = 0
+        self.input_tokens = 0
+        self.cached_input_tokens = 0
+        self.caches_created = 0
+        self._caches: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def echo(prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+        return f"ANSWER: Stub response {digest}\nJUSTIFICATION: Offline stub model\nSOURCE_SNIPPET: {prompt.strip()[:80]}"
+
+    def generate(self, prompt: str, timeout: Optional[float] = None, cached_content: Optional[str] = None,
+                 json_output: bool = False) -> str:
+        self._count_call()
+        text = self.responder(self._resolve(prompt, cached_content))
+        delay = self.latency + self._prefill_delay(prompt)
+        if self.tokens_per_second:
+            delay += estimate_tokens(text) / self.tokens_per_second
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TransientModelError("Stub request timed out")
+        time.sleep(delay)
+        return text
+
+    def stream(self, prompt: str, timeout: Optional[float] = None, cached_content: Optional[str] = None,
+               json_output: bool = False, chunk_chars: int = 16) -> Iterator[str]:
+        self._count_call()
+        text = self.responder(self._resolve(prompt, cached_content))
+        time.sleep(self.latency + self._prefill_delay(prompt))
+        for start in range(0, len(text), chunk_chars):
+            chunk = text[start:start + chunk_chars]
+            if self.tokens_per_second:
+                time.sleep(estimate_tokens(chunk) / self.tokens_per_second)
+            yield chunk
+
+    def create_cache(self, system_instruction: str, content: str, ttl_seconds: float) -> str:
+        with self._lock:
+            self.caches_created += 1
+            name = f"cachedContents/stub-{self.caches_created}"
+            self._caches[name] = (f"{system_instruction}\n\n{content}", time.time() + ttl_seconds)
+        return name
+
+    def delete_cache(self, name: str) -> None:
+        with self._lock:
+            self._caches.pop(name, None)
+
+    def _resolve(self, prompt: str, cached_content: Optional[str]) -> str:
+        """The full prompt the model sees, counting cached and uncached input tokens"""
+        prefix = ""
+        if cached_content:
+            with self._lock:
+                cached = self._caches.get(cached_content)
+                if cached is None or cached[1] < time.time():
+                    self._caches.pop(cached_content, None)
+                    raise CachedContentNotFound(f"Cached content {cached_content} not found")
+            prefix = cached[0] + "\n\n"
+        with self._lock:
+            self.input_tokens += estimate_tokens(prompt)
+            if prefix:
+                self.cached_input_tokens += estimate_tokens(prefix)
+        return prefix + prompt
+
+    def _prefill_delay(self, prompt: str) -> float:
+        if not self.prefill_tokens_per_second:
+            return 0.0
+        return estimate_tokens(prompt) / self.prefill_tokens_per_second
+
+    def _count_call(self) -> None:
+        with self._lock:
+            self.calls += 1
+            call_number = self.calls
+        if call_number <= self.fail_first:
+            raise TransientModelError(f"Stub failure {call_number} of {self.fail_first}")
+
+    @staticmethod
+    def is_transient(error: Exception) -> bool:
+        return isinstance(error, TransientModelError)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at ``rate_per_minute``"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """Take ``amount`` tokens, returning how long the caller must wait first"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Requests larger than the bucket are allowed through once it is full
+            amount = min(amount, self.capacity)
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def wait_time(self, amount: float = 1) -> float:
+        """How long taking ``amount`` tokens now would wait, without taking them"""
+        with self._lock:
+            tokens = min(self.capacity, self.tokens + (time.monotonic() - self.updated) * self.rate)
+            shortfall = min(amount, self.capacity) - tokens
+            return max(0.0, shortfall / self.rate)
+
+    def acquire(self, amount: float = 1) -> None:
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ModelClient:
+    """Shared, thread-safe front end to a model backend.
+
+    Every call passes through a requests-per-minute and a tokens-per-minute
+    bucket, is retried with exponential backoff and full jitter on transient
+    errors, and is coalesced with any identical prompt already in flight so
+    concurrent duplicate requests share one upstream call. ``submit`` and
+    ``agenerate`` run calls on the client's thread pool for concurrent use.
+    ``task`` and ``session_id`` are routing hints: recorded on the call's
+    span here, and used by ``ModelRouter`` to pick a model and charge budgets.
+    """
+
+    def __init__(self, backend, requests_per_minute: float = 60, tokens_per_minute: float = 1_000_000,
+                 max_retries: int = 3, base_delay: float = 1.0, max_delay: float = 20.0,
+                 timeout: Optional[float] = 60.0, max_workers: int = 8):
+        self.backend = backend
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-client")
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.backend, 'model_name', 'unknown')
+
+    @property
+    def supports_cached_content(self) -> bool:
+        return hasattr(self.backend, 'create_cache')
+
+    def serving_models(self, task: Optional[str] = None, session_id: Optional[str] = None) -> List[str]:
+        """Models a call for ``task`` could be answered by, in the order they would be tried"""
+        return [self.model_name]
+
+    def create_cached_content(self, system_instruction: str, content: str, ttl_seconds: float) -> str:
+        """Pin a prompt prefix with the provider; pass the returned name as ``cached_content``"""
+        with tracer.span('model.cache_create', model=self.model_name, cached_tokens=estimate_tokens(content)):
+            self._throttle(estimate_tokens(content))
+            return self.backend.create_cache(system_instruction, content, ttl_seconds)
+
+    def delete_cached_content(self, name: str) -> None:
+        self.backend.delete_cache(name)
+
+    def pending_wait(self, prompt_tokens: int) -> float:
+        """Seconds a call of ``prompt_tokens`` would wait on the rate limits right now"""
+        return max(self.request_bucket.wait_time(1), self.token_bucket.wait_time(prompt_tokens))
+
+    def generate(self, prompt: str, cached_content: Optional[str] = None, json_output: bool = False,
+                 task: Optional[str] = None, session_id: Optional[str] = None) -> str:
+        """Run a prompt, sharing the result with identical concurrent calls.
+
+        With ``cached_content`` the prompt is appended to that cached prefix,
+        and only the prompt itself is sent and counted against rate limits.
+        ``json_output`` asks backends that support it for a JSON response.
+        """
+        key = hashlib.sha256(f"{cached_content or ''}\n{json_output}\n{prompt}".encode('utf-8')).hexdigest()
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+
+        with tracer.span('model.generate', model=self.model_name, coalesced=not owner,
+                         cached_content=bool(cached_content), task=task) as span:
+            if not owner:
+                result = future.result()
+                served_model.set(self.model_name)
+                return result
+
+            span.set(prompt_chars=len(prompt), prompt_tokens=estimate_tokens(prompt), retries=0)
+            try:
+                future.set_result(self._call_with_retries(prompt, cached_content, json_output))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._inflight[key]
+            result = future.result()
+            span.set(response_tokens=estimate_tokens(result))
+            served_model.set(self.model_name)
+            return result
+
+    def submit(self, prompt: str, cached_content: Optional[str] = None, json_output: bool = False,
+               task: Optional[str] = None, session_id: Optional[str] = None) -> Future:
+        """Run a prompt on the client's thread pool; options are those of ``generate``"""
+        # Run in a copy of the caller's context so the call's span nests under the caller's
+        return self._pool.submit(contextvars.copy_context().run, self.generate, prompt,
+                                 cached_content=cached_content, json_output=json_output,
+                                 task=task, session_id=session_id)
+
+    def generate_many(self, prompts: List[str], cached_content: Optional[str] = None, json_output: bool = False,
+                      task: Optional[str] = None, session_id: Optional[str] = None) -> List[str]:
+        """Run prompts concurrently with the same options, returning results in order"""
+        futures = [self.submit(p, cached_content, json_output, task, session_id) for p in prompts]
+        return [future.result() for future in futures]
+
+    async def agenerate(self, prompt: str, cached_content: Optional[str] = None, json_output: bool = False,
+                        task: Optional[str] = None, session_id: Optional[str] = None) -> str:
+        """Awaitable variant of ``generate`` for asyncio callers"""
+        return await asyncio.wrap_future(self.submit(prompt, cached_content, json_output, task, session_id))
+
+    def stream(self, prompt: str, cached_content: Optional[str] = None, json_output: bool = False,
+               task: Optional[str] = None, session_id: Optional[str] = None) -> Iterator[str]:
+        """Yield response text as it is generated.
+
+        Streams are not coalesced, and transient errors are only retried
+        until the first chunk arrives; after that they propagate.
+        """
+        # Generators may resume in other contexts, so this span is never made current
+        with tracer.span('model.stream', attach=False, model=self.model_name, prompt_chars=len(prompt),
+                         prompt_tokens=estimate_tokens(prompt), retries=0, response_tokens=0,
+                         cached_content=bool(cached_content), task=task) as span:
+            attempt = 0
+            while True:
+                self._throttle(estimate_tokens(prompt))
+                started = False
+                try:
+                    for chunk in self.backend.stream(prompt, timeout=self.timeout,
+                                                     **self._call_kwargs(cached_content, json_output)):
+                        if not started:
+                            span.set(first_chunk_ms=round((time.time() - span.started) * 1000, 3))
+                        started = True
+                        span.add('response_tokens', estimate_tokens(chunk))
+                        yield chunk
+                    served_model.set(self.model_name)
+                    return
+                except Exception as e:
+                    if started or attempt >= self.max_retries or not self.backend.is_transient(e):
+                        raise
+                self._backoff(attempt)
+                attempt += 1
+                span.set(retries=attempt)
+
+    def _call_with_retries(self, prompt: str, cached_content: Optional[str] = None, json_output: bool = False) -> str:
+        attempt = 0
+        while True:
+            self._throttle(estimate_tokens(prompt))
+            try:
+                return self.backend.generate(prompt, timeout=self.timeout,
+                                             **self._call_kwargs(cached_content, json_output))
+            except Exception as e:
+                if attempt >= self.max_retries or not self.backend.is_transient(e):
+                    raise
+            self._backoff(attempt)
+            attempt += 1
+            current_span().set(retries=attempt)
+
+    @staticmethod
+    def _call_kwargs(cached_content: Optional[str], json_output: bool) -> Dict:
+        # Only pass arguments that are used, so backends without caching or JSON mode still work
+        kwargs = {}
+        if cached_content:
+            kwargs['cached_content'] = cached_content
+        if json_output:
+            kwargs['json_output'] = True
+        return kwargs
+
+    def _backoff(self, attempt: int) -> None:
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        time.sleep(random.uniform(0, delay))
+
+    def _throttle(self, prompt_tokens: int) -> None:
+        wait = max(self.request_bucket.reserve(1), self.token_bucket.reserve(prompt_tokens))
+        if wait > 0:
+            time.sleep(wait)
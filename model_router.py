@@ -0,0 +1,392 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from instrumentation import tracer
+from model_client import GeminiBackend, ModelClient, StubBackend
+from retrieval import estimate_tokens
+
+
+class BudgetExceeded(Exception):
+    """A session, or the deployment as a whole, has used up its token budget"""
+
+
+# USD per million input and output tokens, for prompts up to 128K tokens
+MODEL_PRICES = {
+    'gemini-1.5-flash-8b': (0.0375, 0.15),
+    'gemini-1.5-flash': (0.075, 0.30),
+    'gemini-1.5-pro': (1.25, 5.00),
+}
+DEFAULT_PRICES = MODEL_PRICES['gemini-1.5-flash']
+
+# Latency assumed for a model until calls to it have been observed, in seconds
+EXPECTED_LATENCY = {
+    'lite': 2.0,
+    'standard': 4.0,
+    'pro': 12.0,
+}
+
+# Tier roles to models; MODEL_TIERS overrides it as "role=model,role=model". By default every task
+# runs on one model; the tiers named in TASK_POLICIES only take effect once MODEL_TIERS lists them
+DEFAULT_TIERS = "standard=gemini-1.5-flash"
+
+
+class TaskPolicy:
+    """How calls for one kind of task are routed.
+
+    ``tiers`` lists tier roles in order of preference, ``latency_slo`` is the
+    response time in seconds a tier is expected to meet, ``output_tokens``
+    the typical response length used for cost and budget estimates, and
+    ``max_cost`` (USD) the most one call may cost on a preferred tier.
+    """
+
+    def __init__(self, tiers: Sequence[str], latency_slo: float, output_tokens: int,
+                 max_cost: Optional[float] = None):
+        self.tiers = tuple(tiers)
+        self.latency_slo = latency_slo
+        self.output_tokens = output_tokens
+        self.max_cost = max_cost
+
+
+# Short, formulaic work goes to the cheapest tier; grading gets the strongest one while it stays affordable
+TASK_POLICIES = {
+    'summary': TaskPolicy(('lite', 'standard'), latency_slo=60.0, output_tokens=300),
+    'answer': TaskPolicy(('standard', 'lite', 'pro'), latency_slo=20.0, output_tokens=500),
+    'questions': TaskPolicy(('standard', 'lite'), latency_slo=45.0, output_tokens=1500),
+    'evaluation': TaskPolicy(('pro', 'standard', 'lite'), latency_slo=30.0, output_tokens=600, max_cost=0.02),
+    'reformat': TaskPolicy(('lite', 'standard'), latency_slo=15.0, output_tokens=500),
+}
+DEFAULT_TASK = 'answer'
+
+
+class ModelTier:
+    """One model the router can send calls to, with its prices and observed performance"""
+
+    # Weight of the newest call in the latency averages
+    LATENCY_WEIGHT = 0.2
+
+    def __init__(self, role: str, client: ModelClient, input_price: float, output_price: float,
+                 context_window: int = 1_000_000, expected_latency: float = 5.0):
+        self.role = role
+        self.client = client
+        self.input_price = input_price
+        self.output_price = output_price
+        self.context_window = context_window
+        self.prior_latency = expected_latency
+
+        self.calls = 0
+        self.failures = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+        self.cooldown_until = 0.0
+        # Moving average of latency per task, since tasks differ in prompt and response size
+        self._latency: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def model_name(self) -> str:
+        return self.client.model_name
+
+    def estimated_cost(self, input_tokens: int, output_tokens: int) -> float:
+        return (input_tokens * self.input_price + output_tokens * self.output_price) / 1e6
+
+    def expected_latency(self, task: str, prompt_tokens: int) -> float:
+        """Observed latency for the task (or the prior) plus any wait on the rate limits"""
+        with self._lock:
+            latency = self._latency.get(task, self.prior_latency)
+        return latency + self.client.pending_wait(prompt_tokens)
+
+    def available(self) -> bool:
+        """False while the tier is cooling down after being rate limited or overloaded"""
+        return time.monotonic() >= self.cooldown_until
+
+    def record(self, task: str, latency: float, input_tokens: int, output_tokens: int) -> float:
+        """Account for a completed call; returns its cost"""
+        cost = self.estimated_cost(input_tokens, output_tokens)
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.cost += cost
+            previous = self._latency.get(task)
+            self._latency[task] = latency if previous is None else (
+                previous + self.LATENCY_WEIGHT * (latency - previous))
+        return cost
+
+    def record_failure(self, cooldown: float) -> None:
+        with self._lock:
+            self.failures += 1
+            self.cooldown_until = time.monotonic() + cooldown
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'model': self.model_name,
+                'calls': self.calls,
+                'failures': self.failures,
+                'input_tokens': self.input_tokens,
+                'output_tokens': self.output_tokens,
+                'cost_usd': round(self.cost, 6),
+                'latency_seconds': {task: round(value, 3) for task, value in self._latency.items()},
+                'available': self.available()
+            }
+
+
+class TokenBudget:
+    """Per-session and global token allowances, reset every ``period`` seconds.
+
+    Usage is counted in the state store, so every worker sharing it draws
+    on the same allowances. A limit of 0 means unlimited. ``check`` refuses
+    a call whose estimated tokens would overrun a budget; ``charge`` records
+    what a call actually used.
+    """
+
+    def __init__(self, state, session_tokens: int = 0, global_tokens: int = 0, period: float = 24 * 3600):
+        self.state = state
+        self.session_tokens = session_tokens
+        self.global_tokens = global_tokens
+        self.period = period
+
+    def check(self, session_id: Optional[str], tokens: int) -> None:
+        if self.global_tokens and self._used(self._global_key()) + tokens > self.global_tokens:
+            raise BudgetExceeded("The assistant has reached its usage limit for now; please try again later.")
+        if session_id and self.session_tokens and self._used(self._session_key(session_id)) + tokens > self.session_tokens:
+            raise BudgetExceeded(f"This session has used its budget of {self.session_tokens:,} tokens; "
+                                 f"please try again later.")
+
+    def charge(self, session_id: Optional[str], tokens: int) -> None:
+        self.state.add(self._global_key(), tokens, ttl=self.period)
+        if session_id:
+            self.state.add(self._session_key(session_id), tokens, ttl=self.period)
+
+    def remaining_fraction(self, session_id: Optional[str]) -> float:
+        """Share of the tighter of the session and global budgets still unused"""
+        fractions = [1.0]
+        if self.global_tokens:
+            fractions.append(1 - self._used(self._global_key()) / self.global_tokens)
+        if session_id and self.session_tokens:
+            fractions.append(1 - self._used(self._session_key(session_id)) / self.session_tokens)
+        return max(0.0, min(fractions))
+
+    def usage(self, session_id: Optional[str] = None) -> Dict:
+        usage = {'global_tokens': self._used(self._global_key()), 'global_limit': self.global_tokens}
+        if session_id:
+            usage.update(session_tokens=self._used(self._session_key(session_id)),
+                         session_limit=self.session_tokens)
+        return usage
+
+    def _used(self, key: str) -> int:
+        return self.state.add(key, 0, ttl=self.period)
+
+    def _window(self) -> int:
+        return int(time.time() // self.period)
+
+    def _global_key(self) -> str:
+        return f"token_budget:{self._window()}:global"
+
+    def _session_key(self, session_id: str) -> str:
+        return f"token_budget:{self._window()}:session:{session_id}"
+
+
+class ModelRouter:
+    """Sends each model call to a tier chosen for its task, cost and latency.
+
+    Drop-in for ``ModelClient``: ``generate``, ``stream``, ``submit``,
+    ``generate_many`` and ``agenerate`` take the same arguments, and the ``task`` hint ('summary', 'answer', 'questions',
+    'evaluation', 'reformat') selects a ``TaskPolicy``. Its tiers are tried
+    in order of preference, skipping any whose context window is too small
+    or whose estimated cost is over the policy's ``max_cost``; tiers that
+    are cooling down after a rate limit or would miss the latency SLO (from
+    observed latency plus the wait on their own rate limits) move to the
+    back. When a session is close to its token budget the cheapest tiers go
+    first. A transient failure on one tier falls through to the next.
+
+    Cached document prefixes are bound to one model, so they are created on
+    and always used with the primary tier (the first of the 'answer' policy).
+    """
+
+    COOLDOWN_SECONDS = 30.0
+    # Below this share of budget left, a session's calls go to the cheapest tier first
+    LOW_BUDGET_FRACTION = 0.2
+
+    def __init__(self, tiers: List[ModelTier], budget: Optional[TokenBudget] = None,
+                 policies: Optional[Dict[str, TaskPolicy]] = None):
+        if not tiers:
+            raise ValueError("A model router needs at least one tier")
+        self.tiers = {tier.role: tier for tier in tiers}
+        self.budget = budget
+        self.policies = policies or TASK_POLICIES
+        primary = next((r for r in self._policy(DEFAULT_TASK).tiers if r in self.tiers), tiers[0].role)
+        self.primary = self.tiers[primary]
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="model-router")
+
+    @classmethod
+    def from_env(cls, api_key: str, state) -> 'ModelRouter':
+        """Tiers from MODEL_TIERS ("role=model,..."), budgets from SESSION/GLOBAL_TOKEN_BUDGET.
+
+        Models whose name starts with 'stub' run on the offline ``StubBackend``.
+        """
+        tiers = []
+        items = [item.strip().partition("=") for item in os.environ.get("MODEL_TIERS", DEFAULT_TIERS).split(",")]
+        items = [(role, model_name) for role, _, model_name in items if model_name]
+        for role, model_name in items:
+            if model_name.startswith("stub"):
+                backend = StubBackend(model_name=model_name)
+            else:
+                backend = GeminiBackend(api_key, model_name)
+            client = ModelClient(
+                backend,
+                requests_per_minute=float(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", "60")),
+                tokens_per_minute=float(os.environ.get("GEMINI_TOKENS_PER_MINUTE", "1000000")),
+                # With several tiers, one retry and then the router tries another tier
+                max_retries=1 if len(items) > 1 else 3
+            )
+            input_price, output_price = MODEL_PRICES.get(model_name, DEFAULT_PRICES)
+            tiers.append(ModelTier(role, client, input_price, output_price,
+                                   expected_latency=EXPECTED_LATENCY.get(role, 5.0)))
+        budget = TokenBudget(
+            state,
+            session_tokens=int(os.environ.get("SESSION_TOKEN_BUDGET", "0")),
+            global_tokens=int(os.environ.get("GLOBAL_TOKEN_BUDGET", "0")),
+            period=float(os.environ.get("TOKEN_BUDGET_PERIOD", str(24 * 3600)))
+        )
+        return cls(tiers, budget)
+
+    @property
+    def model_name(self) -> str:
+        return self.primary.model_name
+
+    @property
+    def supports_cached_content(self) -> bool:
+        return self.primary.client.supports_cached_content
+
+    def create_cached_content(self, system_instruction: str, content: str, ttl_seconds: float) -> str:
+        return self.primary.client.create_cached_content(system_instruction, content, ttl_seconds)
+
+    def delete_cached_content(self, name: str) -> None:
+        self.primary.client.delete_cached_content(name)
+
+    def serving_models(self, task: Optional[str] = None, session_id: Optional[str] = None) -> List[str]:
+        """Models a call for ``task`` would be tried on right now, best first"""
+        return [tier.model_name for tier in self._plan(task or DEFAULT_TASK, 0, None, session_id)]
+
+    def generate(self, prompt: str, cached_content: Optional[str] = None, json_output: bool = False,
+                 task: Optional[str] = None, session_id: Optional[str] = None) -> str:
+        task = task or DEFAULT_TASK
+        prompt_tokens = estimate_tokens(prompt)
+        with tracer.span('model.route', task=task, prompt_tokens=prompt_tokens) as span:
+            plan = self._plan(task, prompt_tokens, cached_content, session_id)
+            self._check_budget(task, prompt_tokens, session_id)
+            error = None
+            for fallbacks, tier in enumerate(plan):
+                started = time.monotonic()
+                try:
+                    result = tier.client.generate(prompt, cached_content=cached_content, json_output=json_output,
+                                                  task=task, session_id=session_id)
+                except Exception as e:
+                    if not tier.client.backend.is_transient(e):
+                        raise
+                    tier.record_failure(self.COOLDOWN_SECONDS)
+                    error = e
+                    continue
+                cost = self._record(tier, task, time.monotonic() - started, prompt_tokens,
+                                    estimate_tokens(result), session_id)
+                span.set(model=tier.model_name, tier=tier.role, fallbacks=fallbacks, cost_usd=cost)
+                return result
+            span.set(fallbacks=len(plan))
+            raise error
+
+    def submit(self, prompt: str, cached_content: Optional[str] = None, json_output: bool = False,
+               task: Optional[str] = None, session_id: Optional[str] = None) -> Future:
+        """Route a prompt on the router's thread pool; options are those of ``generate``"""
+        # Run in a copy of the caller's context so the call's span nests under the caller's
+        return self._pool.submit(contextvars.copy_context().run, self.generate, prompt,
+                                 cached_content=cached_content, json_output=json_output,
+                                 task=task, session_id=session_id)
+
+    def generate_many(self, prompts: List[str], cached_content: Optional[str] = None, json_output: bool = False,
+                      task: Optional[str] = None, session_id: Optional[str] = None) -> List[str]:
+        """Route prompts concurrently with the same options, returning results in order"""
+        futures = [self.submit(p, cached_content, json_output, task, session_id) for p in prompts]
+        return [future.result() for future in futures]
+
+    async def agenerate(self, prompt: str, cached_content: Optional[str] = None, json_output: bool = False,
+                        task: Optional[str] = None, session_id: Optional[str] = None) -> str:
+        """Awaitable variant of ``generate`` for asyncio callers"""
+        return await asyncio.wrap_future(self.submit(prompt, cached_content, json_output, task, session_id))
+
+    def stream(self, prompt: str, cached_content: Optional[str] = None, json_output: bool = False,
+               task: Optional[str] = None, session_id: Optional[str] = None) -> Iterator[str]:
+        """Stream from the first tier that starts answering; a tier that fails mid-stream is not replaced"""
+        task = task or DEFAULT_TASK
+        prompt_tokens = estimate_tokens(prompt)
+        with tracer.span('model.route', attach=False, task=task, prompt_tokens=prompt_tokens) as span:
+            plan = self._plan(task, prompt_tokens, cached_content, session_id)
+            self._check_budget(task, prompt_tokens, session_id)
+            error = None
+            for fallbacks, tier in enumerate(plan):
+                started = time.monotonic()
+                output_tokens = 0
+                try:
+                    for chunk in tier.client.stream(prompt, cached_content=cached_content, json_output=json_output,
+                                                    task=task, session_id=session_id):
+                        output_tokens += estimate_tokens(chunk)
+                        yield chunk
+                except Exception as e:
+                    if output_tokens or not tier.client.backend.is_transient(e):
+                        raise
+                    tier.record_failure(self.COOLDOWN_SECONDS)
+                    error = e
+                    continue
+                cost = self._record(tier, task, time.monotonic() - started, prompt_tokens, output_tokens, session_id)
+                span.set(model=tier.model_name, tier=tier.role, fallbacks=fallbacks, cost_usd=cost)
+                return
+            span.set(fallbacks=len(plan))
+            raise error
+
+    def stats(self, session_id: Optional[str] = None) -> Dict:
+        """Per-tier calls, tokens, cost and observed latency, plus budget usage"""
+        return {
+            'tiers': {role: tier.stats() for role, tier in self.tiers.items()},
+            'budget': self.budget.usage(session_id) if self.budget else None
+        }
+
+    def _policy(self, task: str) -> TaskPolicy:
+        return self.policies.get(task) or self.policies[DEFAULT_TASK]
+
+    def _plan(self, task: str, prompt_tokens: int, cached_content: Optional[str],
+              session_id: Optional[str]) -> List[ModelTier]:
+        """Tiers to try for a call, best first"""
+        if cached_content:
+            return [self.primary]
+        policy = self._policy(task)
+        output_tokens = policy.output_tokens
+        tiers = [self.tiers[role] for role in policy.tiers if role in self.tiers] or list(self.tiers.values())
+        tiers = [t for t in tiers if prompt_tokens + output_tokens <= t.context_window] or tiers
+        if policy.max_cost is not None:
+            # Over-budget tiers stay as a last resort rather than failing the call
+            tiers = sorted(tiers, key=lambda t: t.estimated_cost(prompt_tokens, output_tokens) > policy.max_cost)
+        if self.budget and self.budget.remaining_fraction(session_id) < self.LOW_BUDGET_FRACTION:
+            tiers = sorted(tiers, key=lambda t: t.estimated_cost(prompt_tokens, output_tokens))
+
+        ready = [t for t in tiers
+                 if t.available() and t.expected_latency(task, prompt_tokens) <= policy.latency_slo]
+        # The rest go last, fastest first, with tiers cooling down after them
+        slow = sorted((t for t in tiers if t not in ready),
+                      key=lambda t: (not t.available(), t.expected_latency(task, prompt_tokens)))
+        return ready + slow
+
+    def _check_budget(self, task: str, prompt_tokens: int, session_id: Optional[str]) -> None:
+        if self.budget:
+            self.budget.check(session_id, prompt_tokens + self._policy(task).output_tokens)
+
+    def _record(self, tier: ModelTier, task: str, latency: float, input_tokens: int, output_tokens: int,
+                session_id: Optional[str]) -> float:
+        if self.budget:
+            self.budget.charge(session_id, input_tokens + output_tokens)
+        return tier.record(task, latency, input_tokens, output_tokens)
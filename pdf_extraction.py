@@ -0,0 +1,414 @@
+import importlib.util
+import io
+import math
+import multiprocessing
+import os
+import re
+import shutil
+import time
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import PyPDF2
+
+
+# Below this many pages the process pool costs more than it saves
+PARALLEL_MIN_PAGES = 24
+PAGES_PER_TASK = 8
+# Rough cost of spawning one worker process and importing this module in it
+WORKER_START_SECONDS = 1.0
+
+# 'auto' picks the fastest installed backend; see EXTRACTION_BACKENDS for the names
+DEFAULT_BACKEND = os.environ.get("PDF_BACKEND", "auto")
+# PDF_OCR=0 turns the OCR fallback for low-quality pages off
+OCR_ENABLED = os.environ.get("PDF_OCR", "1") != "0"
+OCR_DPI = 200
+
+# Pages scoring below this are treated as scanned or garbled and sent to OCR
+MIN_PAGE_QUALITY = 0.5
+# Fewer visible characters than this is an empty page
+MIN_PAGE_CHARS = 16
+# Unmapped glyphs, as printed by pdfminer and PyPDF2 for fonts without a text mapping
+GARBLED_GLYPHS = re.compile(r"\(cid:\d+\)|�")
+
+_worker_backend = None
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+class PyPDF2Backend:
+    """Default extraction backend; pure Python, always available"""
+
+    name = 'pypdf2'
+
+    def __init__(self, pdf_bytes: bytes):
+        self._reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+
+    @staticmethod
+    def available() -> bool:
+        return True
+
+    @property
+    def page_count(self) -> int:
+        return len(self._reader.pages)
+
+    def page_text(self, index: int) -> str:
+        return self._reader.pages[index].extract_text() or ""
+
+    def page_image(self, index: int):
+        """The largest image embedded in the page (a scanned page is usually one image), if any"""
+        from PIL import Image
+
+        images = self._reader.pages[index].images
+        if not images:
+            return None
+        largest = max(images, key=lambda image: len(image.data))
+        return Image.open(io.BytesIO(largest.data))
+
+
+class PdfiumBackend:
+    """pypdfium2 (Chrome's PDF engine): much faster text extraction, and page rendering for OCR"""
+
+    name = 'pdfium'
+
+    def __init__(self, pdf_bytes: bytes):
+        import pypdfium2 as pdfium
+
+        self._pdf = pdfium.PdfDocument(pdf_bytes)
+
+    @staticmethod
+    def available() -> bool:
+        return _installed('pypdfium2')
+
+    @property
+    def page_count(self) -> int:
+        return len(self._pdf)
+
+    def page_text(self, index: int) -> str:
+        page = self._pdf[index]
+        textpage = page.get_textpage()
+        try:
+            return textpage.get_text_range()
+        finally:
+            textpage.close()
+            page.close()
+
+    def page_image(self, index: int):
+        page = self._pdf[index]
+        try:
+            return page.render(scale=OCR_DPI / 72).to_pil()
+        finally:
+            page.close()
+
+
+class PdfminerBackend:
+    """pdfminer.six: slower, but its layout analysis keeps multi-column text in reading order"""
+
+    name = 'pdfminer'
+
+    def __init__(self, pdf_bytes: bytes):
+        from pdfminer.pdfdocument import PDFDocument
+        from pdfminer.pdfinterp import PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+        from pdfminer.pdfparser import PDFParser
+
+        self._resources = PDFResourceManager(caching=True)
+        self._pages = list(PDFPage.create_pages(PDFDocument(PDFParser(io.BytesIO(pdf_bytes)))))
+
+    @staticmethod
+    def available() -> bool:
+        return _installed('pdfminer')
+
+    @property
+    def page_count(self) -> int:
+        return len(self._pages)
+
+    def page_text(self, index: int) -> str:
+        from pdfminer.converter import TextConverter
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfinterp import PDFPageInterpreter
+
+        out = io.StringIO()
+        device = TextConverter(self._resources, out, laparams=LAParams())
+        try:
+            PDFPageInterpreter(self._resources, device).process_page(self._pages[index])
+        finally:
+            device.close()
+        return out.getvalue()
+
+    def page_image(self, index: int):
+        return None
+
+
+EXTRACTION_BACKENDS = {backend.name: backend for backend in (PyPDF2Backend, PdfiumBackend, PdfminerBackend)}
+
+# Tried in this order by 'auto'
+FAST_BACKENDS = ('pdfium', 'pypdf2')
+
+
+def backend_name(name: str = DEFAULT_BACKEND) -> str:
+    """Resolve 'auto' to an installed backend and check that a named one can be used"""
+    if name == 'auto':
+        return next(n for n in FAST_BACKENDS if EXTRACTION_BACKENDS[n].available())
+    backend = EXTRACTION_BACKENDS.get(name)
+    if backend is None:
+        raise ValueError(f"Unknown PDF backend {name!r}; choose from {', '.join(EXTRACTION_BACKENDS)} or 'auto'")
+    if not backend.available():
+        raise ValueError(f"PDF backend {name!r} is not installed")
+    return name
+
+
+def ocr_available() -> bool:
+    """Whether Tesseract can be used for pages without usable text"""
+    return OCR_ENABLED and _installed('pytesseract') and _installed('PIL') and shutil.which('tesseract') is not None
+
+
+def page_quality(text: str) -> float:
+    """Score from 0 (empty or garbled) to 1 (ordinary text) for one page's extracted text.
+
+    Combines the share of letters and digits among visible characters, the
+    character entropy (runs of one repeated glyph score low) and the share
+    of unmapped glyphs such as ``(cid:12)``. Alphabets are not assumed, so
+    non-Latin text scores as well as English.
+    """
+    visible = "".join(text.split())
+    if len(visible) < MIN_PAGE_CHARS:
+        return 0.0
+    counts = Counter(visible)
+    total = len(visible)
+    entropy = -sum(c / total * math.log2(c / total) for c in counts.values())
+    alnum = sum(c for char, c in counts.items() if char.isalnum()) / total
+    garbled = sum(len(m) for m in GARBLED_GLYPHS.findall(visible)) / total
+
+    # English prose has about 4.2 bits per character; below 2 is mostly repetition
+    entropy_score = min(1.0, max(0.0, (entropy - 2.0) / 1.5))
+    alnum_score = min(1.0, max(0.0, (alnum - 0.4) / 0.3))
+    return round(min(entropy_score, alnum_score) * (1.0 - garbled), 3)
+
+
+def _init_worker(pdf_bytes: bytes, backend: str) -> None:
+    # Each worker parses the document once and reuses it for all its pages
+    global _worker_backend
+    _worker_backend = EXTRACTION_BACKENDS[backend](pdf_bytes)
+
+
+def _page_text(backend, index: int) -> str:
+    # One unreadable page shouldn't fail the whole document; it scores as empty instead
+    try:
+        return backend.page_text(index)
+    except Exception:
+        return ""
+
+
+def _extract_page_range(first: int, last: int) -> List[Tuple[int, str]]:
+    return [(n + 1, _page_text(_worker_backend, n)) for n in range(first, last)]
+
+
+def _ocr_page(backend, index: int) -> str:
+    """Tesseract text for a page rendered (or its scanned image taken) from ``backend``"""
+    import pytesseract
+
+    image = backend.page_image(index)
+    if image is None:
+        return ""
+    return pytesseract.image_to_string(image)
+
+
+def _ocr_backend_name() -> str:
+    # Rendering needs pdfium; PyPDF2 can only hand over a scanned page's embedded image
+    return 'pdfium' if PdfiumBackend.available() else 'pypdf2'
+
+
+def _ocr_worker_page(index: int) -> str:
+    return _ocr_page(_worker_backend, index)
+
+
+class PdfPageStream:
+    """Iterate over ``(page_number, text)`` records of a PDF in page order.
+
+    Text comes from a pluggable backend (``EXTRACTION_BACKENDS``; 'auto'
+    prefers pypdfium2 when installed, otherwise PyPDF2). Small documents are
+    read in-process. For larger ones the first pages are read in-process
+    and timed; the rest is split into page ranges that a pool of worker
+    processes extracts in parallel, each worker holding its own parser over
+    the shared PDF bytes. Every worker parses the whole document before its
+    first page, so only as many are started as have enough pages to pay
+    for that (see ``_parallel_workers``). Every page's text gets a
+    ``page_quality`` score; pages below ``MIN_PAGE_QUALITY`` (scans, broken
+    font mappings) are sent to Tesseract on a separate worker pool while
+    later pages keep streaming, and its text is used when it scores better.
+    Reading stops at ``max_pages`` or once ``time_budget`` seconds have
+    elapsed; ``truncated`` tells whether that happened.
+    """
+
+    # Low-quality pages that may be waiting for OCR before the stream blocks on the oldest
+    OCR_LOOKAHEAD = 16
+
+    def __init__(self, pdf_bytes: bytes, max_pages: Optional[int] = None,
+                 time_budget: Optional[float] = None, workers: Optional[int] = None,
+                 backend: str = DEFAULT_BACKEND, ocr: Optional[bool] = None):
+        self.pdf_bytes = pdf_bytes
+        self.time_budget = time_budget
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.backend = backend_name(backend)
+        self.ocr = ocr_available() if ocr is None else ocr
+
+        started = time.monotonic()
+        self._backend = EXTRACTION_BACKENDS[self.backend](pdf_bytes)
+        # Each pool worker repeats this parse before extracting anything
+        self._parse_seconds = time.monotonic() - started
+        self.page_count = self._backend.page_count
+        self.pages_to_read = min(self.page_count, max_pages) if max_pages else self.page_count
+        self.pages_read = 0
+        # Quality of each page's final text, and the pages whose text came from OCR
+        self.page_quality: Dict[int, float] = {}
+        self.ocr_pages: List[int] = []
+        self._ocr_backend = None
+
+    @property
+    def truncated(self) -> bool:
+        return self.pages_read < self.page_count
+
+    @property
+    def low_quality_pages(self) -> List[int]:
+        """Pages whose final text is still empty or garbled"""
+        return [n for n, quality in sorted(self.page_quality.items()) if quality < MIN_PAGE_QUALITY]
+
+    def __iter__(self) -> Iterator[Tuple[int, str]]:
+        deadline = time.monotonic() + self.time_budget if self.time_budget else None
+        if self.pages_to_read < PARALLEL_MIN_PAGES or self.workers <= 1:
+            pages = self._iter_serial(deadline)
+        else:
+            pages = self._iter_sampled(deadline)
+        for page_number, text in self._with_ocr(pages, deadline):
+            self.pages_read = page_number
+            yield page_number, text
+
+    def _iter_serial(self, deadline: Optional[float], first: int = 0,
+                     last: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        for n in range(first, self.pages_to_read if last is None else last):
+            if deadline and time.monotonic() > deadline:
+                return
+            yield n + 1, _page_text(self._backend, n)
+
+    def _iter_sampled(self, deadline: Optional[float]) -> Iterator[Tuple[int, str]]:
+        """Read the first pages in-process, then hand the rest to a pool if that pays off"""
+        started = time.monotonic()
+        sampled = 0
+        for page in self._iter_serial(deadline, 0, PAGES_PER_TASK):
+            sampled += 1
+            yield page
+        if sampled < PAGES_PER_TASK:
+            return
+        workers = self._parallel_workers((time.monotonic() - started) / sampled)
+        if workers > 1:
+            yield from self._iter_parallel(deadline, PAGES_PER_TASK, workers)
+        else:
+            yield from self._iter_serial(deadline, PAGES_PER_TASK)
+
+    def _parallel_workers(self, page_seconds: float) -> int:
+        """How many workers to start for the pages left after the sample.
+
+        A worker first spends ``WORKER_START_SECONDS`` plus one full parse of
+        the document, so it is only worth starting if its share of the pages
+        takes at least that long to extract; 1 means read on in-process.
+        """
+        remaining = self.pages_to_read - PAGES_PER_TASK
+        overhead = WORKER_START_SECONDS + self._parse_seconds
+        return max(1, min(self.workers, int(remaining * page_seconds / overhead)))
+
+    def _iter_parallel(self, deadline: Optional[float], start: int = 0,
+                       workers: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        pool = self._pool(workers or self.workers)
+        try:
+            futures = [
+                pool.submit(_extract_page_range, first, min(first + PAGES_PER_TASK, self.pages_to_read))
+                for first in range(start, self.pages_to_read, PAGES_PER_TASK)
+            ]
+            # Yield in page order; later ranges keep extracting while earlier ones are consumed
+            for future in futures:
+                timeout = max(0.0, deadline - time.monotonic()) if deadline else None
+                try:
+                    yield from future.result(timeout=timeout)
+                except FutureTimeoutError:
+                    return
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _with_ocr(self, pages: Iterator[Tuple[int, str]], deadline: Optional[float]) -> Iterator[Tuple[int, str]]:
+        """Score pages and replace low-quality ones with OCR text, keeping page order"""
+        pending = deque()
+        ocr_count = 0
+        pool = None
+        try:
+            for page_number, text in pages:
+                quality = page_quality(text)
+                ocr = None
+                if quality < MIN_PAGE_QUALITY and self.ocr:
+                    if self.workers <= 1:
+                        ocr = Future()
+                        ocr.set_result(self._ocr_in_process(page_number - 1))
+                    else:
+                        pool = pool or self._pool(self.workers, ocr=True)
+                        ocr = pool.submit(_ocr_worker_page, page_number - 1)
+                    ocr_count += 1
+                pending.append((page_number, text, quality, ocr))
+
+                # Hand over everything that is ready; only wait once too many OCR pages are queued
+                while pending and (pending[0][3] is None or pending[0][3].done() or ocr_count > self.OCR_LOOKAHEAD):
+                    ocr_count -= pending[0][3] is not None
+                    yield self._settle(*pending.popleft(), deadline)
+            while pending:
+                yield self._settle(*pending.popleft(), deadline)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def _settle(self, page_number: int, text: str, quality: float, ocr: Optional[Future],
+                deadline: Optional[float]) -> Tuple[int, str]:
+        if ocr is not None:
+            timeout = max(0.0, deadline - time.monotonic()) if deadline else None
+            try:
+                ocr_text = ocr.result(timeout=timeout)
+            except Exception:
+                # OCR failed or ran out of time; keep whatever the backend found
+                ocr_text = ""
+            ocr_quality = page_quality(ocr_text)
+            if ocr_quality > quality:
+                text, quality = ocr_text, ocr_quality
+                self.ocr_pages.append(page_number)
+        self.page_quality[page_number] = quality
+        return page_number, text
+
+    def _ocr_in_process(self, index: int) -> str:
+        if self._ocr_backend is None:
+            name = _ocr_backend_name()
+            self._ocr_backend = self._backend if name == self.backend else EXTRACTION_BACKENDS[name](self.pdf_bytes)
+        try:
+            return _ocr_page(self._ocr_backend, index)
+        except Exception:
+            return ""
+
+    def _pool(self, workers: int, ocr: bool = False) -> ProcessPoolExecutor:
+        backend = _ocr_backend_name() if ocr else self.backend
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.pdf_bytes, backend)
+        )
+
+
+def join_pages(pages: Iterator[Tuple[int, str]]) -> Tuple[str, List[int]]:
+    """Concatenate page texts, returning the text and each page's start offset"""
+    parts = []
+    page_offsets = []
+    position = 0
+    for _, text in pages:
+        page_offsets.append(position)
+        parts.append(text)
+        position += len(text) + 1
+    return "\n".join(parts), page_offsets
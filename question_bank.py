@@ -0,0 +1,66 @@
+import random
+from typing import Dict, List, Optional, Sequence
+
+QUESTION_TYPES = ('comprehension', 'analysis', 'inference')
+
+
+class QuestionBank:
+    """Pool of challenge questions about one document.
+
+    Questions are dicts with 'question', 'type', 'answer_guidance' and
+    'section' (the part of the document they are about, when known). The
+    pool only grows, so a question's index is stable and callers remember
+    what they have already asked as a list of indices. ``draw`` picks new
+    questions locally: one of each type first, from different sections
+    where possible, never repeating an index that was asked before.
+    """
+
+    def __init__(self, questions: Optional[List[Dict]] = None):
+        self.questions: List[Dict] = list(questions or [])
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def extend(self, questions: Sequence[Dict]) -> int:
+        """Add questions that are not already in the pool; returns how many were added"""
+        seen = {self._normalize(q['question']) for q in self.questions}
+        added = 0
+        for question in questions:
+            key = self._normalize(question['question'])
+            if key and key not in seen:
+                seen.add(key)
+                self.questions.append(question)
+                added += 1
+        return added
+
+    def remaining(self, asked: Sequence[int]) -> int:
+        return len(self.questions) - len(set(asked))
+
+    def draw(self, asked: Sequence[int], count: int = 3, rng: Optional[random.Random] = None) -> List[int]:
+        """Indices of up to ``count`` questions not in ``asked``, varied by type and section"""
+        rng = rng or random
+        asked = set(asked)
+        unseen = [i for i in range(len(self.questions)) if i not in asked]
+        rng.shuffle(unseen)
+
+        picks = []
+        sections = set()
+        # One question per type, preferring sections not covered yet
+        for question_type in QUESTION_TYPES:
+            candidates = [i for i in unseen if i not in picks and self.questions[i]['type'] == question_type]
+            fresh = [i for i in candidates if self.questions[i].get('section') not in sections]
+            choice = (fresh or candidates or [None])[0]
+            if choice is not None and len(picks) < count:
+                picks.append(choice)
+                sections.add(self.questions[choice].get('section'))
+
+        for i in unseen:
+            if len(picks) >= count:
+                break
+            if i not in picks:
+                picks.append(i)
+        return picks
+
+    @staticmethod
+    def _normalize(question: str) -> str:
+        return " ".join(question.lower().split())
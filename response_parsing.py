@@ -0,0 +1,354 @@
+import json
+import re
+from typing import Dict, List, Optional, Sequence, Union
+
+# Markdown models wrap section markers in: headings, bullets, quotes and bold
+MARKER_PREFIX = re.compile(r"^[\s>#*-]+")
+
+JSON_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*")
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+PARTIAL_ESCAPE = re.compile(r"\\(u[0-9a-fA-F]{0,3})?$")
+
+
+class SectionStreamParser:
+    """Incremental parser for ``MARKER: text`` style model responses.
+
+    ``markers`` maps each marker (e.g. ``'ANSWER:'``) to the section name it
+    starts. Text can be fed in arbitrary chunks; complete lines are parsed
+    once, and ``sections()`` also includes the trailing partial line so
+    callers can render text as it arrives. Lines that don't start a new
+    section are appended to the current one with a single space. Markers
+    are matched regardless of case, markdown decoration (``**ANSWER:**``,
+    ``## Answer``) and spaces for underscores; a marker alone on its line
+    starts a section whose text follows on the next lines.
+    """
+
+    def __init__(self, markers: Dict[str, str]):
+        self.markers = markers
+        self._sections = {name: "" for name in markers.values()}
+        self._current: Optional[str] = None
+        self._pending = ""
+        self.text = ""
+
+        self._names = {self._key(marker): name for marker, name in markers.items()}
+        labels = sorted((marker.rstrip(':') for marker in markers), key=len, reverse=True)
+        alternation = "|".join(re.escape(label).replace('_', '[_ ]?') for label in labels)
+        self._pattern = re.compile(rf"^[\s>#*-]*({alternation})\s*\**\s*(?::|$)\**\s*(.*)$", re.IGNORECASE)
+
+    def feed(self, chunk: str) -> Dict[str, str]:
+        """Consume a chunk of response text and return the sections so far"""
+        self.text += chunk
+        lines = (self._pending + chunk).split('\n')
+        self._pending = lines.pop()
+        for line in lines:
+            self._consume(line)
+        return self.sections()
+
+    def close(self) -> Dict[str, str]:
+        """Flush the last line and return the final sections"""
+        if self._pending:
+            self._consume(self._pending)
+            self._pending = ""
+        return self.sections()
+
+    def sections(self) -> Dict[str, str]:
+        sections = dict(self._sections)
+        line = self._pending.strip()
+        if line:
+            name, rest = self._split_marker(line)
+            if name:
+                sections[name] = rest
+            elif self._current and not self._could_be_marker(line):
+                sections[self._current] = self._join(sections[self._current], line)
+        return sections
+
+    @property
+    def matched(self) -> bool:
+        """Whether any section marker has been seen"""
+        return self._current is not None
+
+    def _consume(self, line: str) -> None:
+        line = line.strip()
+        name, rest = self._split_marker(line)
+        if name:
+            self._current = name
+            self._sections[self._current] = rest
+        elif line and self._current:
+            self._sections[self._current] = self._join(self._sections[self._current], line)
+
+    def _split_marker(self, line: str):
+        match = self._pattern.match(line)
+        if match is None:
+            return None, line
+        return self._names[self._key(match.group(1))], match.group(2).strip()
+
+    def _could_be_marker(self, line: str) -> bool:
+        # A partial line such as "JUSTIF" or "**" may still turn into a marker
+        partial = self._key(MARKER_PREFIX.sub("", line))
+        return any(key.startswith(partial) for key in self._names)
+
+    @staticmethod
+    def _key(marker: str) -> str:
+        return re.sub(r"[\s_:*]", "", marker).upper()
+
+    @staticmethod
+    def _join(existing: str, line: str) -> str:
+        return f"{existing} {line}" if existing else line
+
+
+def parse_sections(text: str, markers: Dict[str, str]) -> Dict[str, str]:
+    """Parse a complete response in one call"""
+    parser = SectionStreamParser(markers)
+    parser.feed(text)
+    return parser.close()
+
+
+class ResponseSchema:
+    """The fields a structured model response must have.
+
+    ``fields`` maps each field name to a description used in the prompt.
+    Prompts ask for a JSON object with those keys, or for ``count`` of them
+    in a list under ``list_key``; ``instructions`` renders that request.
+    ``parse`` reads either JSON (repairing fences, trailing commas and
+    truncation locally) or the older ``FIELD:`` marker format, whichever the
+    model actually produced; ``markers`` renames a field's marker (and
+    accepted JSON key) where it differs from the field name. Parsed
+    responses have every field, empty when missing; ``missing`` lists what
+    the ``required`` fields lack so callers can ask again with
+    ``repair_prompt``, which only carries the response, not the document.
+    """
+
+    def __init__(self, fields: Dict[str, str], required: Sequence[str] = (), list_key: Optional[str] = None,
+                 markers: Optional[Dict[str, str]] = None):
+        self.fields = fields
+        self.required = tuple(required)
+        self.list_key = list_key
+        self.markers = {name: (markers or {}).get(name, name.upper()) for name in fields}
+        self._aliases = {}
+        for name, marker in self.markers.items():
+            self._aliases[self._normalize_key(name)] = name
+            self._aliases[self._normalize_key(marker)] = name
+
+    def instructions(self, count: Optional[int] = None) -> str:
+        """Prompt text asking for a response in this schema"""
+        item = {name: f"[{description}]" for name, description in self.fields.items()}
+        if self.list_key is None:
+            example = json.dumps(item, indent=2)
+            return f"Respond with only a JSON object of this form:\n{example}"
+        example = json.dumps({self.list_key: [item]}, indent=2)
+        return (f"Respond with only a JSON object of this form, with exactly {count} objects "
+                f"in the \"{self.list_key}\" list, in order:\n{example}")
+
+    def parser(self, count: Optional[int] = None) -> 'ResponseParser':
+        return ResponseParser(self, count)
+
+    def parse(self, text: str, count: Optional[int] = None) -> Union[Dict[str, str], List[Dict[str, str]]]:
+        """Parse a complete response in one call"""
+        parser = self.parser(count)
+        parser.feed(text)
+        return parser.close()
+
+    def missing(self, parsed: Union[Dict, List[Dict]]) -> List:
+        """Required fields left empty, or for list schemas the positions of incomplete items"""
+        if self.list_key is None:
+            return [name for name in self.required if not parsed.get(name)]
+        return [n for n, item in enumerate(parsed) if any(not item.get(name) for name in self.required)]
+
+    def merge(self, parsed: Union[Dict, List[Dict]], repaired: Union[Dict, List[Dict]]):
+        """Fill the empty fields of ``parsed`` from a repaired parse of the same response"""
+        def fill(item: Dict, other: Dict) -> Dict:
+            return {name: item.get(name) or other.get(name, "") for name in self.fields}
+
+        if self.list_key is None:
+            return fill(parsed, repaired)
+        return [fill(a, b) for a, b in zip(parsed, repaired)]
+
+    def repair_prompt(self, text: str, count: Optional[int] = None) -> str:
+        """Cheap follow-up asking the model to restructure its own response"""
+        return f"""
+            The response below was supposed to follow a structured format but could not be read.
+            Rewrite it in the required format. Use only information that is in the response;
+            leave a field as an empty string if the response doesn't contain it.
+
+            {self.instructions(count)}
+
+            RESPONSE:
+            {text}
+            """
+
+    def empty(self) -> Dict[str, str]:
+        return {name: "" for name in self.fields}
+
+    def from_json(self, data, count: Optional[int] = None) -> Union[Dict[str, str], List[Dict[str, str]]]:
+        """Fields from decoded JSON, tolerating renamed keys and a missing list wrapper"""
+        if self.list_key is None:
+            if isinstance(data, list):
+                data = data[0] if data and isinstance(data[0], dict) else {}
+            return self._item(data)
+
+        items = data
+        if isinstance(data, dict):
+            lists = [value for value in data.values() if isinstance(value, list)]
+            items = data.get(self.list_key) or (lists[0] if len(lists) == 1 else [data])
+        items = [self._item(item) for item in items if isinstance(item, dict)]
+        if count is not None:
+            items = items[:count] + [self.empty() for _ in range(count - len(items))]
+        return items
+
+    def _item(self, data: Dict) -> Dict[str, str]:
+        item = self.empty()
+        for key, value in data.items():
+            name = self._aliases.get(self._normalize_key(key))
+            if name is not None:
+                item[name] = self._text(value)
+        return item
+
+    @staticmethod
+    def _text(value) -> str:
+        if value is None:
+            return ""
+        if isinstance(value, str):
+            return value.strip()
+        if isinstance(value, list):
+            return "; ".join(ResponseSchema._text(v) for v in value)
+        if isinstance(value, dict):
+            return json.dumps(value)
+        return str(value)
+
+    @staticmethod
+    def _normalize_key(key: str) -> str:
+        return re.sub(r"[\s_-]", "", key).lower()
+
+
+class ResponseParser:
+    """Single parser for structured responses, as they stream in or all at once.
+
+    The first characters decide the format: JSON (optionally in a code
+    fence) or ``FIELD:`` markers. While streaming, ``feed`` returns the
+    fields read so far; for JSON that includes string values still being
+    written, so answers can be rendered as they arrive. ``close`` returns
+    the final fields (a list of items for list schemas). ``valid_json`` tells
+    whether the response was well-formed JSON without any local repair.
+    """
+
+    def __init__(self, schema: ResponseSchema, count: Optional[int] = None):
+        self.schema = schema
+        self.count = count
+        self.text = ""
+        self.valid_json = False
+        self._format: Optional[str] = None
+        self._sections: Optional[SectionStreamParser] = None
+
+    def feed(self, chunk: str) -> Dict[str, str]:
+        self.text += chunk
+        if self._format is None:
+            start = JSON_FENCE.sub("", self.text).lstrip()
+            if not start or start == '`' * len(start):
+                return self.schema.empty()
+            self._format = 'json' if start[0] in '{[' else 'markers'
+            if self._format == 'markers':
+                self._sections = SectionStreamParser(self._marker_map())
+                chunk = self.text
+        if self._format == 'markers':
+            return self._flat(self._sections.feed(chunk))
+        return self._partial_json()
+
+    def close(self) -> Union[Dict[str, str], List[Dict[str, str]]]:
+        if self._format == 'markers':
+            sections = self._sections.close()
+            if self._sections.matched:
+                return self._unflatten(sections)
+        data = self._load_json()
+        if data is not None:
+            return self.schema.from_json(data, self.count)
+        return self._unflatten(self._sections.close() if self._sections else {})
+
+    def _marker_map(self) -> Dict[str, str]:
+        if self.schema.list_key is None:
+            return {f"{marker}:": name for name, marker in self.schema.markers.items()}
+        return {f"{marker}_{n}:": f"{name}_{n}"
+                for n in range(1, (self.count or 1) + 1) for name, marker in self.schema.markers.items()}
+
+    def _flat(self, sections: Dict[str, str]) -> Dict[str, str]:
+        return {name: sections.get(name) or "" for name in self.schema.fields}
+
+    def _unflatten(self, sections: Dict[str, str]):
+        if self.schema.list_key is None:
+            return self._flat(sections)
+        return [{name: sections.get(f"{name}_{n}") or "" for name in self.schema.fields}
+                for n in range(1, (self.count or 1) + 1)]
+
+    def _partial_json(self) -> Dict[str, str]:
+        """String fields of a JSON object that may still be incomplete"""
+        fields = self.schema.empty()
+        if self.schema.list_key is not None:
+            return fields
+        for match in re.finditer(r'"([^"\\]+)"\s*:\s*"', self.text):
+            name = self.schema._aliases.get(self.schema._normalize_key(match.group(1)))
+            if name is not None:
+                fields[name] = _partial_string(self.text, match.end()).strip()
+        return fields
+
+    def _load_json(self):
+        body = JSON_FENCE.sub("", self.text.strip())
+        starts = [i for i in (body.find('{'), body.find('[')) if i != -1]
+        if not starts:
+            return None
+        body = body[min(starts):].rstrip().rstrip('`').rstrip()
+        try:
+            data = json.loads(body, strict=False)
+            self.valid_json = True
+            return data
+        except ValueError:
+            pass
+        # Local repairs: trailing commas, text after the value, and truncated output
+        body = TRAILING_COMMA.sub(r"\1", body)
+        for candidate in (body, _close_json(body), _close_json(body[:body.rfind(',')])):
+            try:
+                return json.loads(candidate, strict=False)
+            except ValueError:
+                continue
+        try:
+            return json.JSONDecoder(strict=False).raw_decode(body)[0]
+        except ValueError:
+            return None
+
+
+def _partial_string(text: str, start: int) -> str:
+    """Decode a JSON string starting at ``start``, up to its closing quote or the end of the text"""
+    end = start
+    while end < len(text):
+        if text[end] == '\\':
+            end += 2
+            continue
+        if text[end] == '"':
+            break
+        end += 1
+    raw = PARTIAL_ESCAPE.sub("", text[start:min(end, len(text))])
+    try:
+        return json.loads(f'"{raw}"', strict=False)
+    except ValueError:
+        return raw
+
+
+def _close_json(body: str) -> str:
+    """Close a truncated JSON document's open string, objects and lists"""
+    closers = []
+    in_string = False
+    escaped = False
+    for char in body:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            closers.append('}' if char == '{' else ']')
+        elif char in '}]' and closers:
+            closers.pop()
+    body = PARTIAL_ESCAPE.sub("", body) if in_string else body.rstrip().rstrip(':,')
+    return body + ('"' if in_string else "") + "".join(reversed(closers))
@@ -0,0 +1,259 @@
+import re
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from snippet_verification import SnippetIndex
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have how i if in
+into is it its may might of on or should so than that the their them then there these they
+this those to was were what when where which who whom why will with would you your
+""".split())
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English)"""
+    return max(1, len(text) // 4)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with stopwords removed"""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def page_for_offset(page_offsets: List[int], offset: int) -> Optional[int]:
+    """1-based page number containing a character offset, if pages are known"""
+    if not page_offsets:
+        return None
+    return max(1, bisect_right(page_offsets, offset))
+
+
+def chunk_text(text: str, chunk_chars: int = 1200, overlap_chars: int = 200) -> List[Dict]:
+    """Split text into overlapping passages with character offsets.
+
+    Passage ends are pulled back to the nearest sentence or word boundary in
+    the last fifth of the window so passages don't cut words in half.
+    """
+    chunks = []
+    length = len(text)
+    start = 0
+    while start < length:
+        end = min(start + chunk_chars, length)
+        if end < length:
+            floor = start + int(chunk_chars * 0.8)
+            boundary = max(text.rfind('. ', floor, end), text.rfind('\n', floor, end))
+            if boundary == -1:
+                boundary = text.rfind(' ', floor, end)
+            if boundary != -1:
+                end = boundary + 1
+
+        raw = text[start:end]
+        passage = raw.strip()
+        if passage:
+            lead = len(raw) - len(raw.lstrip())
+            chunks.append({
+                'id': len(chunks),
+                'text': passage,
+                'start': start + lead,
+                'end': start + lead + len(passage)
+            })
+
+        if end >= length:
+            break
+        next_start = end - overlap_chars
+        # Resume on a word boundary inside the overlap
+        space = text.find(' ', next_start, end)
+        start = max(space + 1 if space != -1 else next_start, start + 1)
+    return chunks
+
+
+class HashingEmbedder:
+    """Offline embedding backend: signed feature hashing of unigrams and bigrams.
+
+    Any object with an ``embed(texts) -> np.ndarray`` method returning one
+    L2-normalised row per text can be passed to ``DocumentRetriever`` instead.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                h = zlib.crc32(feature.encode('utf-8'))
+                vectors[row, h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class BM25Index:
+    """Okapi BM25 over term-major postings arrays.
+
+    ``documents`` may be a generator of token lists, so only one document's
+    tokens need to exist at a time while the index is built.
+    """
+
+    def __init__(self, documents: Iterable[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+
+        term_ids, doc_ids, freqs, lengths = array('q'), array('i'), array('f'), array('f')
+        for doc_id, tokens in enumerate(documents):
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_ids.append(self.vocab.setdefault(term, len(self.vocab)))
+                doc_ids.append(doc_id)
+                freqs.append(tf)
+        self.doc_count = len(lengths)
+        lengths = np.frombuffer(lengths, dtype=np.float32)
+
+        term_ids = np.frombuffer(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind='stable')
+        self.postings_docs = np.frombuffer(doc_ids, dtype=np.int32)[order]
+        self.postings_tf = np.frombuffer(freqs, dtype=np.float32)[order]
+        df = np.bincount(term_ids, minlength=len(self.vocab))
+        self.indptr = np.concatenate(([0], np.cumsum(df)))
+        self.idf = np.log(1.0 + (self.doc_count - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        avg_length = lengths.mean() if self.doc_count else 0.0
+        self.length_norm = k1 * (1 - b + b * lengths / (avg_length or 1.0))
+
+    def scores(self, query_tokens: List[str]) -> np.ndarray:
+        """BM25 score of every document for the query"""
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        for term in set(query_tokens):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            lo, hi = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.postings_docs[lo:hi]
+            tf = self.postings_tf[lo:hi]
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + self.length_norm[docs])
+        return scores
+
+    def search(self, query_tokens: List[str], top_n: int) -> List[Tuple[int, float]]:
+        """Top documents with a positive score, best first"""
+        scores = self.scores(query_tokens)
+        if not self.doc_count:
+            return []
+        top_n = min(top_n, self.doc_count)
+        candidates = np.argpartition(-scores, top_n - 1)[:top_n]
+        ranked = candidates[np.argsort(-scores[candidates])]
+        return [(int(i), float(scores[i])) for i in ranked if scores[i] > 0]
+
+
+class DocumentRetriever:
+    """Passage index over a processed document.
+
+    Lexical BM25 retrieval picks candidates, which are then reranked by mixing
+    the BM25 score with cosine similarity from the embedding backend.
+    Results are packed into a token budget so prompts stay bounded regardless
+    of document length.
+    """
+
+    def __init__(self, processed_data: Dict, chunk_chars: int = 1200, overlap_chars: int = 200,
+                 embedder=None, dense_weight: float = 0.3):
+        self.full_text = processed_data['full_text']
+        self.page_offsets = processed_data.get('page_offsets') or []
+        self.chunks = chunk_text(self.full_text, chunk_chars, overlap_chars)
+        for chunk in self.chunks:
+            chunk['page'] = page_for_offset(self.page_offsets, chunk['start'])
+        self.index = BM25Index(tokenize(c['text']) for c in self.chunks)
+
+        # A dense_weight of 0 turns reranking off and skips embedding entirely
+        self.embedder = embedder or HashingEmbedder()
+        self.dense_weight = dense_weight
+        self.embeddings = self.embedder.embed([c['text'] for c in self.chunks]) if dense_weight else None
+
+    def retrieve(self, query: str, top_k: int = 8, token_budget: int = 6000) -> List[Dict]:
+        """Best passages for the query, in document order, within the token budget"""
+        candidates = self.index.search(tokenize(query), top_k * 4)
+        if not candidates:
+            return self.overview(token_budget)
+
+        ids = np.array([i for i, _ in candidates])
+        scores = np.array([s for _, s in candidates], dtype=np.float32)
+        scores /= scores.max()
+        if self.embeddings is not None:
+            query_vector = self.embedder.embed([query])[0]
+            similarity = self.embeddings[ids] @ query_vector
+            scores = (1 - self.dense_weight) * scores + self.dense_weight * similarity
+        ranked = ids[np.argsort(-scores)][:top_k]
+
+        return self._pack([self.chunks[i] for i in ranked], token_budget)
+
+    def overview(self, token_budget: int = 6000) -> List[Dict]:
+        """Passages spread evenly across the whole document"""
+        if not self.chunks:
+            return []
+        chunk_tokens = max(estimate_tokens(c['text']) for c in self.chunks)
+        count = max(1, min(len(self.chunks), token_budget // chunk_tokens))
+        picks = np.linspace(0, len(self.chunks) - 1, count).round().astype(int)
+        return self._pack([self.chunks[i] for i in dict.fromkeys(picks.tolist())], token_budget)
+
+    def build_context(self, query: Optional[str] = None, top_k: int = 8, token_budget: int = 6000) -> str:
+        """Prompt-ready document context; short documents are sent whole"""
+        if estimate_tokens(self.full_text) <= token_budget:
+            return self.paged_text()
+        passages = self.retrieve(query, top_k, token_budget) if query else self.overview(token_budget)
+        return self.format_passages(passages)
+
+    @staticmethod
+    def format_passages(passages: List[Dict]) -> str:
+        blocks = []
+        for p in passages:
+            label = f"Passage {p['id'] + 1}"
+            if p.get('page'):
+                label += f", page {p['page']}"
+            blocks.append(f"[{label}]\n{p['text']}")
+        return "\n\n".join(blocks)
+
+    def use_text(self, text) -> None:
+        """Swap in an equal copy of the document text, such as a memory-mapped ``MappedText``"""
+        self.full_text = text
+        if getattr(self, '_snippet_index', None) is not None:
+            self._snippet_index.text = text
+
+    def snippet_index(self) -> SnippetIndex:
+        """Index for checking quotes against the document, built on first use"""
+        # Retrievers pickled before the index existed don't have the attribute
+        if getattr(self, '_snippet_index', None) is None:
+            self._snippet_index = SnippetIndex(self.full_text, self.page_offsets)
+        return self._snippet_index
+
+    def paged_text(self) -> str:
+        """The whole document with a [Page n] label before each page"""
+        if not self.page_offsets:
+            return str(self.full_text)
+        bounds = self.page_offsets + [len(self.full_text)]
+        blocks = []
+        for n, (a, b) in enumerate(zip(bounds, bounds[1:]), start=1):
+            page = self.full_text[a:b].strip()
+            if page:
+                blocks.append(f"[Page {n}]\n{page}")
+        return "\n\n".join(blocks)
+
+    @staticmethod
+    def _pack(passages: List[Dict], token_budget: int) -> List[Dict]:
+        selected = []
+        used = 0
+        for passage in passages:
+            cost = estimate_tokens(passage['text'])
+            if selected and used + cost > token_budget:
+                continue
+            selected.append(passage)
+            used += cost
+        return sorted(selected, key=lambda p: p['start'])
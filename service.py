@@ -0,0 +1,560 @@
+import io
+import os
+import threading
+from typing import Callable, Dict, Iterator, List, Optional
+
+from answer_cache import AnswerCache
+from assistant import DocumentError, DocumentProcessor, GeminiDocumentAssistant
+from context_cache import ContextCache
+from conversation_memory import ConversationMemory
+from corpus import CorpusIndex
+from document_store import DocumentStore, content_hash
+from instrumentation import current_span, traced
+from job_queue import Job, JobCancelled, JobQueue
+from model_client import ModelClient
+from model_router import ModelRouter
+from pdf_extraction import join_pages
+from question_bank import QuestionBank
+from retrieval import DocumentRetriever
+from state_store import open_state_store
+from text_spill import MappedText, SpillStore
+
+
+class DocumentNotFound(KeyError):
+    """No processed document (or library) with the requested hash"""
+
+
+class AssistantService:
+    """Front-end independent API over the document assistant.
+
+    Processed documents are keyed by the hash of the uploaded bytes and kept
+    in a local ``DocumentStore``; when the state store is shared (SQLite or
+    Redis) they are also written there so any worker can serve them.
+    Conversation memory and challenge questions are kept per session and
+    document in the state store. The Streamlit UI calls this class directly
+    in-process, or over HTTP through ``api.py`` and ``api_client.py``.
+    """
+
+    SESSION_TTL = 24 * 3600
+
+    # A background ingest publishes the pages read so far after this many, then at every doubling
+    PARTIAL_FIRST_PAGES = 8
+    SUMMARY_PENDING = "The summary will be ready once the whole document has been processed."
+
+    # Shorter texts stay in memory; mapping them would save little
+    SPILL_MIN_CHARS = 256 * 1024
+    # Peak working memory of processing an upload, as a multiple of its size
+    INGEST_MEMORY_FACTOR = 16
+
+    def __init__(self, client: ModelClient, state=None, documents: DocumentStore = None,
+                 summary_cache: DocumentStore = None, answer_cache: AnswerCache = None,
+                 corpus: CorpusIndex = None, context_cache: ContextCache = None,
+                 memory_turns: int = 4, memory_tokens: int = 1200, jobs: JobQueue = None,
+                 spill: SpillStore = None, session_memory_bytes: int = 0, library_root: str = None):
+        # A ModelClient, or a ModelRouter that charges calls to their session's token budget
+        self.client = client
+        self.state = state or open_state_store()
+        self.context_cache = context_cache
+        self.documents = documents or DocumentStore()
+        self.summary_cache = summary_cache
+        self.answer_cache = answer_cache
+        self.corpus = corpus
+        # Library folders must lie under this directory; without it library indexing is off
+        self.library_root = library_root
+        self.memory_turns = memory_turns
+        self.memory_tokens = memory_tokens
+        self.jobs = jobs or JobQueue()
+        self.spill = spill
+        # 0 means no per-session limit
+        self.session_memory_bytes = session_memory_bytes
+        self._lock = threading.Lock()
+        self._pool_locks: Dict[str, threading.Lock] = {}
+        # Estimated bytes in use by each session's uploads that are still being processed
+        self._session_memory: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls, api_key: str) -> 'AssistantService':
+        """Build the service from the same environment variables as the UI"""
+        cache_dir = os.environ.get("DOCUMENT_CACHE_DIR")
+        max_disk_mb = int(os.environ.get("DOCUMENT_CACHE_MAX_MB", "512"))
+        answer_cache_path = os.environ.get("ANSWER_CACHE_PATH")
+        if not answer_cache_path and cache_dir:
+            answer_cache_path = os.path.join(cache_dir, "answers.sqlite3")
+        job_table_path = os.environ.get("JOB_TABLE_PATH")
+        if not job_table_path and cache_dir:
+            job_table_path = os.path.join(cache_dir, "jobs.sqlite3")
+        spill_dir = os.environ.get("DOCUMENT_SPILL_DIR")
+        if not spill_dir and cache_dir:
+            spill_dir = os.path.join(cache_dir, "texts")
+
+        state = open_state_store(os.environ.get("STATE_STORE_URL"))
+        # One model per tier (MODEL_TIERS), with token budgets counted in the shared state
+        client = ModelRouter.from_env(api_key, state)
+        # CONTEXT_CACHE_TTL=0 turns provider-side document caching off
+        context_ttl = float(os.environ.get("CONTEXT_CACHE_TTL", "3600"))
+        return cls(
+            client,
+            state=state,
+            documents=DocumentStore(cache_dir=cache_dir, max_disk_bytes=max_disk_mb * 1024 * 1024),
+            summary_cache=DocumentStore(max_entries=4096,
+                                        cache_dir=os.path.join(cache_dir, "summaries") if cache_dir else None),
+            answer_cache=AnswerCache(answer_cache_path or ":memory:"),
+            corpus=CorpusIndex(os.environ.get("CORPUS_INDEX_DIR", ".corpus_index"),
+                               root=os.environ.get("CORPUS_DIR")),
+            library_root=os.environ.get("CORPUS_DIR"),
+            context_cache=ContextCache(
+                client, state, ttl_seconds=context_ttl,
+                min_tokens=int(os.environ.get("CONTEXT_CACHE_MIN_TOKENS", "32768"))
+            ) if context_ttl > 0 else None,
+            memory_turns=int(os.environ.get("CONVERSATION_MAX_TURNS", "4")),
+            memory_tokens=int(os.environ.get("CONVERSATION_TOKEN_BUDGET", "1200")),
+            jobs=JobQueue(job_table_path or ":memory:", workers=int(os.environ.get("JOB_WORKERS", "2"))),
+            spill=SpillStore(spill_dir, max_disk_bytes=int(os.environ.get("DOCUMENT_SPILL_MAX_MB", "4096")) * 1024 * 1024),
+            session_memory_bytes=int(os.environ.get("SESSION_MEMORY_LIMIT_MB", "1024")) * 1024 * 1024
+        )
+
+    # Documents
+
+    @traced('service.ingest')
+    def ingest(self, data: bytes, filename: str, session_id: Optional[str] = None) -> Dict:
+        """Process an uploaded PDF or TXT file (or reuse it if already known).
+
+        While it is processed the upload is charged against the session's
+        memory ceiling. With a ``SpillStore`` the text of a large document
+        is kept in a memory-mapped file that every session's indexes share.
+        """
+        doc_hash = content_hash(data)
+        entry = self._find_entry(doc_hash)
+        complete = entry is not None and 'stage' not in entry
+        current_span().set(bytes=len(data), cache='hit' if complete else 'miss')
+        if complete:
+            return {**self._describe(doc_hash, entry), 'warnings': []}
+        reserved = self._reserve_memory(session_id, len(data))
+        try:
+            return self._process(doc_hash, data, filename)
+        finally:
+            self._release_memory(session_id, reserved)
+
+    def start_ingest(self, data: bytes, filename: str, session_id: Optional[str] = None) -> Dict:
+        """Process an upload in the background and return its job (see ``job``).
+
+        Stages are 'extract' (per page), 'index' and 'summarize' (per section).
+        As soon as some pages are indexed the job's ``result`` describes the
+        partial document, which can already be asked about by its hash. The
+        upload is charged to the session's memory ceiling as in ``ingest``.
+        """
+        doc_hash = content_hash(data)
+        active = self.jobs.find('ingest', doc_hash)
+        if active is not None:
+            return active
+        # Charged from submission, since the upload is held in memory while it waits in the queue
+        reserved = self._reserve_memory(session_id, len(data))
+        try:
+            return self.jobs.submit('ingest', self._ingest_job, doc_hash, data, filename, session_id, reserved,
+                                    key=doc_hash)
+        except Exception:
+            self._release_memory(session_id, reserved)
+            raise
+
+    def document(self, doc_hash: str) -> Dict:
+        """Metrics and summary of a processed document"""
+        return self._describe(doc_hash, self._entry(doc_hash))
+
+    @traced('service.summary')
+    def summary(self, doc_hash: str) -> str:
+        entry = self._entry(doc_hash)
+        if entry.get('summary'):
+            return entry['summary']
+        if 'stage' in entry and self.jobs.find('ingest', doc_hash) is not None:
+            return self.SUMMARY_PENDING
+        summary = self._make_assistant(doc_hash, entry['processed_data'], entry['retriever']).generate_summary()
+        if summary != GeminiDocumentAssistant.SUMMARY_UNAVAILABLE:
+            entry['summary'] = summary
+            self._save_entry(doc_hash, entry)
+        return summary
+
+    # Interaction
+
+    @traced('service.ask')
+    def ask(self, doc_hash: str, question: str, session_id: Optional[str] = None) -> Dict:
+        """Answer a question in the context of the session's conversation.
+
+        The conversation memory (recent turns plus a rolling summary, see
+        ``ConversationMemory``) is fed into the prompt. With a ``ContextCache``
+        the document is pinned once as a provider-side prompt prefix that
+        every session's questions reuse.
+        """
+        session = self._load_session(doc_hash, session_id)
+        assistant = self._assistant(doc_hash, session, session_id)
+        result = assistant.answer_question(question)
+        self._save_session(doc_hash, session_id, session)
+        return result
+
+    def ask_stream(self, doc_hash: str, question: str, session_id: Optional[str] = None) -> Iterator[Dict]:
+        """Answer a question, yielding the parsed sections as they stream in"""
+        session = self._load_session(doc_hash, session_id)
+        assistant = self._assistant(doc_hash, session, session_id)
+        yield from assistant.answer_question_stream(question)
+        self._save_session(doc_hash, session_id, session)
+
+    @traced('service.challenge')
+    def challenge(self, doc_hash: str, session_id: Optional[str] = None) -> List[Dict]:
+        """Draw new challenge questions for the session from the document's question bank.
+
+        The ``QuestionBank`` is generated in one batched call and stored with
+        the document; sessions only remember which questions they saw.
+        """
+        session = self._load_session(doc_hash, session_id)
+        assistant = self._assistant(doc_hash, session, session_id)
+        asked = session.setdefault('asked_questions', [])
+        # One pool generation per document; concurrent sessions wait and draw from it
+        with self._pool_lock(doc_hash):
+            assistant.question_bank = QuestionBank(self.state.get(self._pool_key(doc_hash)))
+            assistant.asked_questions = asked
+            pool_size = len(assistant.question_bank)
+            session['challenge_questions'] = assistant.generate_challenge_questions()
+            # Kept even while the document is still being processed, since the session's
+            # asked indices refer to it; later top-ups cover pages read since
+            if len(assistant.question_bank) > pool_size:
+                self.state.put(self._pool_key(doc_hash), assistant.question_bank.questions)
+        current_span().set(pool_size=len(assistant.question_bank), generated=len(assistant.question_bank) > pool_size)
+        self._save_session(doc_hash, session_id, session)
+        return session['challenge_questions']
+
+    @traced('service.evaluate')
+    def evaluate(self, doc_hash: str, submissions: List[Dict], session_id: Optional[str] = None) -> List[Dict]:
+        """Grade answers; each submission has 'question', 'user_answer' and 'type'"""
+        return self._assistant(doc_hash, session_id=session_id).evaluate_answers(submissions)
+
+    def session(self, doc_hash: str, session_id: Optional[str] = None) -> Dict:
+        """A session's conversation and challenge questions for one document.
+
+        ``history`` holds the turns kept verbatim; ``turn_count`` counts every
+        question asked and ``summary`` condenses the ones no longer kept.
+        """
+        session = self._load_session(doc_hash, session_id)
+        memory = session['memory']
+        return {
+            'history': memory.history(),
+            'summary': memory.summary_text(),
+            'turn_count': memory.turn_count,
+            'challenge_questions': session['challenge_questions']
+        }
+
+    def invalidate_context(self, doc_hash: str) -> bool:
+        """Drop the document's cached prompt prefix; the next question re-pins it"""
+        self._entry(doc_hash)
+        return self.context_cache.invalidate(doc_hash) if self.context_cache else False
+
+    def stats(self) -> Dict:
+        return {
+            'answer_cache': self.answer_cache.stats() if self.answer_cache else None,
+            'context_cache': self.context_cache.stats() if self.context_cache else None,
+            # Per-tier calls, cost and latency when the client is a ``ModelRouter``
+            'models': self.client.stats() if hasattr(self.client, 'stats') else None
+        }
+
+    # Jobs
+
+    def job(self, job_id: str) -> Dict:
+        """Status, per-stage progress and (interim) result of a background job"""
+        return self.jobs.get(job_id)
+
+    def cancel_job(self, job_id: str) -> Dict:
+        return self.jobs.cancel(job_id)
+
+    def list_jobs(self, limit: int = 50) -> List[Dict]:
+        return self.jobs.jobs(limit)
+
+    # Library
+
+    @traced('service.ingest_library')
+    def ingest_library(self, directory: str, progress: Optional[Callable[[int, int], None]] = None) -> Dict:
+        """Index a folder of documents into the shared library"""
+        return self.corpus.ingest(self._library_path(directory), progress=progress)
+
+    def start_library_ingest(self, directory: str) -> Dict:
+        """Index a library folder in the background and return its job"""
+        directory = self._library_path(directory)
+        active = self.jobs.find('library', directory)
+        if active is not None:
+            return active
+        return self.jobs.submit('library', self._library_job, directory, key=directory)
+
+    def library(self) -> Dict:
+        """Library statistics; its ``corpus_hash`` is used like a document hash"""
+        if self.corpus is None:
+            return {'document_count': 0, 'page_count': 0, 'chunk_count': 0, 'corpus_hash': None}
+        info = self.corpus.describe()
+        return {key: info[key] for key in ('corpus_hash', 'document_count', 'page_count', 'chunk_count')}
+
+    # Internals
+
+    def _process(self, doc_hash: str, data: bytes, filename: str, job: Optional[Job] = None) -> Dict:
+        """Extract, index and summarize a document, reporting progress to ``job`` if given"""
+        processor = DocumentProcessor()
+        if filename.lower().endswith('.pdf'):
+            on_page = self._page_reporter(job, doc_hash, processor) if job else None
+            text, page_offsets = processor.extract_pdf(io.BytesIO(data), on_page)
+        else:
+            text = processor.extract_text_from_txt(io.BytesIO(data))
+            page_offsets = None
+        if not text.strip():
+            raise DocumentError("No text could be extracted from the document")
+
+        if job:
+            job.progress('index', 0, 1)
+        processed_data = processor.preprocess_text(text, page_offsets)
+        del text
+        # The summary is shared by every session, so it only counts against the global token budget
+        assistant = self._make_assistant(doc_hash, processed_data)
+        self._spill_text(doc_hash, processed_data, assistant.retriever)
+        entry = {'processed_data': processed_data, 'retriever': assistant.retriever, 'summary': None}
+        if job:
+            job.progress('index', 1, 1)
+            # The whole document can be asked about while its summary is written
+            self._save_entry(doc_hash, dict(entry, stage='summarizing'))
+            job.publish({**self._describe(doc_hash, dict(entry, stage='summarizing')), 'warnings': processor.warnings})
+
+        summary = assistant.generate_summary(progress=(lambda done, total: job.progress('summarize', done, total))
+                                             if job else None)
+        # A failed summary is retried on the next request for it
+        entry['summary'] = summary if summary != GeminiDocumentAssistant.SUMMARY_UNAVAILABLE else None
+        self._save_entry(doc_hash, entry)
+        return {**self._describe(doc_hash, entry), 'warnings': processor.warnings}
+
+    def _page_reporter(self, job: Job, doc_hash: str, processor: DocumentProcessor) -> Callable[[int, int, str], None]:
+        """Per-page callback that reports progress and publishes the pages read so far"""
+        pages = []
+        next_publish = [self.PARTIAL_FIRST_PAGES]
+
+        def on_page(page_number: int, page_count: int, text: str) -> None:
+            pages.append((page_number, text))
+            # Doubling keeps the total re-indexing work within twice a single pass
+            if len(pages) >= next_publish[0] and page_number < page_count:
+                next_publish[0] *= 2
+                partial_text, page_offsets = join_pages(pages)
+                processed_data = processor.preprocess_text(partial_text, page_offsets)
+                entry = {'processed_data': processed_data, 'summary': None,
+                         'retriever': DocumentRetriever(processed_data), 'stage': 'extracting'}
+                self._save_entry(doc_hash, entry)
+                job.publish({**self._describe(doc_hash, entry), 'warnings': []})
+            job.progress('extract', page_number, page_count)
+
+        return on_page
+
+    @traced('job.ingest')
+    def _ingest_job(self, job: Job, doc_hash: str, data: bytes, filename: str,
+                    session_id: Optional[str] = None, reserved: int = 0) -> Dict:
+        try:
+            entry = self._find_entry(doc_hash)
+            if entry is not None and 'stage' not in entry:
+                return {**self._describe(doc_hash, entry), 'warnings': []}
+            return self._process(doc_hash, data, filename, job)
+        except JobCancelled:
+            # Don't leave a half-read document behind
+            entry = self._find_entry(doc_hash)
+            if entry is not None and entry.get('stage') == 'extracting':
+                self.documents.delete(doc_hash)
+                self.state.delete(self._document_key(doc_hash))
+            raise
+        finally:
+            self._release_memory(session_id, reserved)
+
+    def _reserve_memory(self, session_id: Optional[str], upload_bytes: int) -> int:
+        """Charge an upload's estimated working memory to its session, or refuse it"""
+        needed = upload_bytes * self.INGEST_MEMORY_FACTOR
+        if not session_id or not self.session_memory_bytes:
+            return 0
+        with self._lock:
+            in_use = self._session_memory.get(session_id, 0)
+            if in_use + needed > self.session_memory_bytes:
+                limit_mb = self.session_memory_bytes / 2 ** 20
+                if in_use:
+                    raise DocumentError(f"This session is already processing other uploads; wait for them to "
+                                        f"finish (each session may use up to {limit_mb:.0f} MB).")
+                raise DocumentError(f"The file is too large to process: it needs about {needed / 2 ** 20:.0f} MB "
+                                    f"and each session may use up to {limit_mb:.0f} MB.")
+            self._session_memory[session_id] = in_use + needed
+        return needed
+
+    def _release_memory(self, session_id: Optional[str], reserved: int) -> None:
+        if not reserved:
+            return
+        with self._lock:
+            remaining = self._session_memory.get(session_id, 0) - reserved
+            if remaining > 0:
+                self._session_memory[session_id] = remaining
+            else:
+                self._session_memory.pop(session_id, None)
+
+    def _spill_text(self, doc_hash: str, processed_data: Dict, retriever: DocumentRetriever) -> None:
+        """Move a large document's text to the spill store and point every index at the mapped copy"""
+        text = processed_data['full_text']
+        if self.spill is None or len(text) < self.SPILL_MIN_CHARS:
+            return
+        mapped = self.spill.put(doc_hash, text)
+        self._use_mapped_text(processed_data, retriever, mapped)
+        current_span().set(spilled_chars=len(mapped))
+
+    @staticmethod
+    def _use_mapped_text(processed_data: Dict, retriever: DocumentRetriever, mapped: MappedText) -> None:
+        processed_data['full_text'] = mapped
+        processed_data['sentences'].text = mapped
+        processed_data['paragraphs'].text = mapped
+        retriever.use_text(mapped)
+
+    @traced('job.library')
+    def _library_job(self, job: Job, directory: str) -> Dict:
+        stats = self.corpus.ingest(directory, progress=lambda done, total: job.update('index', done, total),
+                                   cancelled=lambda: job.cancelled)
+        if stats.get('cancelled'):
+            raise JobCancelled(job.id)
+        return stats
+
+    def _library_path(self, directory: str) -> str:
+        """Resolve a library folder (absolute, or relative to ``library_root``), refusing any outside the root"""
+        if self.corpus is None or not self.library_root:
+            raise DocumentError("No document library is configured")
+        root = os.path.realpath(self.library_root)
+        path = os.path.realpath(os.path.join(root, directory))
+        if os.path.commonpath([root, path]) != root:
+            raise DocumentError("The library folder must be inside the configured library directory")
+        if not os.path.isdir(path):
+            raise DocumentError("Library folder not found")
+        return path
+
+    def _find_entry(self, doc_hash: str) -> Optional[Dict]:
+        entry = self.documents.get(doc_hash)
+        if entry is None and self.state.shared:
+            record = self.state.get(self._document_key(doc_hash))
+            entry = self._restore_entry(doc_hash, record) if record is not None else None
+            if entry is not None:
+                self.documents.put(doc_hash, entry)
+        # A spilled text evicted from disk (or on another host's disk) has to be uploaded again
+        text = entry['processed_data']['full_text'] if entry is not None else None
+        if isinstance(text, MappedText) and not text.available():
+            self.documents.delete(doc_hash)
+            return None
+        return entry
+
+    def _entry(self, doc_hash: str) -> Dict:
+        if self.corpus is not None:
+            library = self.corpus.describe()
+            if doc_hash == library['corpus_hash']:
+                return {'processed_data': library, 'retriever': self.corpus, 'summary': None}
+        entry = self._find_entry(doc_hash)
+        if entry is None:
+            raise DocumentNotFound(doc_hash)
+        return entry
+
+    def _save_entry(self, doc_hash: str, entry: Dict) -> None:
+        self.documents.put(doc_hash, entry)
+        if self.state.shared:
+            self.state.put(self._document_key(doc_hash), self._document_record(entry))
+
+    @staticmethod
+    def _document_record(entry: Dict) -> Dict:
+        """Plain data a shared state store keeps for a document; other workers rebuild its indexes"""
+        processed_data = entry['processed_data']
+        text = processed_data['full_text']
+        record = {
+            # A spilled text is opened again from the spill store under the document hash
+            'text': None if isinstance(text, MappedText) else text,
+            'page_offsets': list(processed_data.get('page_offsets') or []),
+            'summary': entry.get('summary')
+        }
+        if 'stage' in entry:
+            record['stage'] = entry['stage']
+        return record
+
+    def _restore_entry(self, doc_hash: str, record: Dict) -> Optional[Dict]:
+        """Processed data and passage index rebuilt from a shared document record"""
+        text = record['text']
+        if text is None:
+            text = self.spill.open(doc_hash) if self.spill is not None else None
+            if text is None:
+                return None
+        # The stored text is already cleaned, so segmenting it again gives the same spans and pages
+        processed_data = DocumentProcessor().preprocess_text(str(text), record['page_offsets'])
+        retriever = DocumentRetriever(processed_data)
+        if isinstance(text, MappedText):
+            self._use_mapped_text(processed_data, retriever, text)
+        entry = {'processed_data': processed_data, 'retriever': retriever, 'summary': record['summary']}
+        if 'stage' in record:
+            entry['stage'] = record['stage']
+        return entry
+
+    def _load_session(self, doc_hash: str, session_id: Optional[str]) -> Dict:
+        self._entry(doc_hash)
+        stored = self.state.get(self._session_key(doc_hash, session_id)) if session_id else None
+        if stored is None:
+            return {'memory': self._new_memory(), 'challenge_questions': []}
+        # A copy, so the memory store's value stays plain data
+        session = dict(stored)
+        limits = {'max_turns': self.memory_turns, 'token_budget': self.memory_tokens}
+        if 'memory' in session:
+            session['memory'] = ConversationMemory.from_dict(session['memory'], **limits)
+        else:
+            # Sessions saved before conversation memory kept a plain history list
+            session['memory'] = ConversationMemory.from_history(session.pop('history'), **limits)
+        return session
+
+    def _new_memory(self) -> ConversationMemory:
+        return ConversationMemory(max_turns=self.memory_turns, token_budget=self.memory_tokens)
+
+    def _assistant(self, doc_hash: str, session: Optional[Dict] = None,
+                   session_id: Optional[str] = None) -> GeminiDocumentAssistant:
+        entry = self._entry(doc_hash)
+        assistant = self._make_assistant(doc_hash, entry['processed_data'], entry['retriever'],
+                                         complete=entry.get('stage') != 'extracting', session_id=session_id)
+        if session is not None:
+            # Answers are recorded straight into the session's memory
+            assistant.memory = session['memory']
+        return assistant
+
+    def _make_assistant(self, doc_hash: str, processed_data: Dict, retriever=None,
+                        complete: bool = True, session_id: Optional[str] = None) -> GeminiDocumentAssistant:
+        # Answers about a partly read document must not be cached under its hash
+        return GeminiDocumentAssistant(processed_data, retriever=retriever, summary_cache=self.summary_cache,
+                                       client=self.client, answer_cache=self.answer_cache if complete else None,
+                                       document_hash=doc_hash,
+                                       context_cache=self.context_cache if complete else None,
+                                       session_id=session_id)
+
+    def _save_session(self, doc_hash: str, session_id: Optional[str], session: Dict) -> None:
+        if session_id:
+            self.state.put(self._session_key(doc_hash, session_id),
+                           dict(session, memory=session['memory'].to_dict()), ttl=self.SESSION_TTL)
+
+    def _describe(self, doc_hash: str, entry: Dict) -> Dict:
+        processed_data = entry['processed_data']
+        summary = entry.get('summary')
+        if not summary:
+            summary = self.SUMMARY_PENDING if 'stage' in entry else GeminiDocumentAssistant.SUMMARY_UNAVAILABLE
+        return {
+            'document_hash': doc_hash,
+            'word_count': processed_data['word_count'],
+            'char_count': processed_data['char_count'],
+            'paragraph_count': len(processed_data['paragraphs']),
+            'page_count': len(processed_data.get('page_offsets') or []),
+            'summary': summary,
+            # 'extracting' while pages are still being read, 'summarizing' until the summary is ready
+            'stage': entry.get('stage')
+        }
+
+    def _pool_lock(self, doc_hash: str) -> threading.Lock:
+        with self._lock:
+            return self._pool_locks.setdefault(doc_hash, threading.Lock())
+
+    @staticmethod
+    def _pool_key(doc_hash: str) -> str:
+        return f"question_pool:{doc_hash}"
+
+    @staticmethod
+    def _document_key(doc_hash: str) -> str:
+        return f"document:{doc_hash}"
+
+    @staticmethod
+    def _session_key(doc_hash: str, session_id: str) -> str:
+        return f"session:{session_id}:{doc_hash}"
@@ -0,0 +1,272 @@
+import re
+from itertools import islice
+from typing import Dict, List, Optional
+
+import numpy as np
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Passage and page labels we add to prompts; models sometimes copy them into quotes
+PROMPT_LABEL = re.compile(r"\[(?:Page|Passage|SECTION)\b[^\]]*\]", re.IGNORECASE)
+
+# Quotes often elide text with an ellipsis; fragments are aligned around the best-matching one
+ELLIPSIS = re.compile(r"\.\s*\.\s*\.|…")
+
+
+class SnippetIndex:
+    """Locates quoted snippets in a document by fuzzy alignment.
+
+    The document is split into lowercase word tokens, and every run of
+    ``shingle_words`` consecutive words (a shingle) is encoded as one
+    integer. The shingles are kept sorted with their word positions, a
+    suffix-array-like layout where every occurrence of a shingle is found by
+    binary search. A snippet is first looked up verbatim (ignoring case,
+    punctuation and whitespace), then aligned by voting: each of its
+    shingles that occurs in the document votes for a start position, and the
+    band of positions with the most votes is the match. Lookups touch only
+    the snippet's own shingles, so they take milliseconds on
+    million-character documents; building the index is a single pass.
+    Besides the word offsets and shingles only the text itself is held,
+    which may be a memory-mapped ``MappedText``.
+    """
+
+    # Shingles occurring more often than this (boilerplate) don't vote
+    MAX_OCCURRENCES = 2000
+    # Matches covering less than this share of the snippet are reported as not found
+    MIN_CONFIDENCE = 0.5
+    # Words tokenized per batch while building; bounds the temporary Python objects
+    BUILD_BATCH_WORDS = 65536
+    # Most words an ellipsis may stand for between two fragments of one quote
+    MAX_ELLIPSIS_GAP = 150
+    # Longest document text returned for a match
+    MAX_TEXT_CHARS = 2000
+
+    def __init__(self, text: str, page_offsets: Optional[List[int]] = None, shingle_words: int = 3):
+        self.text = text
+        self.page_offsets = page_offsets or []
+        self.shingle_words = shingle_words
+
+        # Offsets come from the original text; words are lowercased one by one so they can't shift.
+        # Matches are consumed in batches so only one batch of Python strings and ints exists at a time.
+        self.vocab: Dict[str, int] = {}
+        # Word offsets fit in 32 bits below 2 GB of text, halving the index's largest arrays
+        offset_type = np.int32 if len(text) < 2 ** 31 else np.int64
+        starts, ends, ids = [], [], []
+        # A memory-mapped text is decoded once for the build; lookups only read the slices they check
+        source = text if isinstance(text, str) else str(text)
+        matches = WORD_PATTERN.finditer(source)
+        while True:
+            batch = list(islice(matches, self.BUILD_BATCH_WORDS))
+            if not batch:
+                break
+            starts.append(np.fromiter((m.start() for m in batch), dtype=offset_type, count=len(batch)))
+            ends.append(np.fromiter((m.end() for m in batch), dtype=offset_type, count=len(batch)))
+            ids.append(np.fromiter((self.vocab.setdefault(m.group().lower(), len(self.vocab)) for m in batch),
+                                   dtype=np.int64, count=len(batch)))
+            del batch
+        del matches, source
+        self.starts = np.concatenate(starts) if starts else np.zeros(0, dtype=offset_type)
+        self.ends = np.concatenate(ends) if ends else np.zeros(0, dtype=offset_type)
+        del starts, ends
+        ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+
+        keys = self._shingles(ids)
+        del ids
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        del keys
+        self.positions = order.astype(np.int32)
+
+    def __setstate__(self, state):
+        # Indexes pickled by older versions also kept a lowercased copy of the text
+        state.pop('joined', None)
+        state.pop('joined_starts', None)
+        self.__dict__.update(state)
+
+    def verify(self, snippet: Optional[str]) -> Optional[Dict]:
+        """Where ``snippet`` occurs in the document, and how confidently.
+
+        Returns None for an empty snippet. Otherwise a dict with ``found``,
+        ``confidence`` (the share of the snippet's word shingles found in
+        one place, 1.0 for a verbatim match), ``hallucinated`` (no sufficiently close match),
+        ``exact``, and for found snippets the ``start``/``end`` character
+        offsets, ``page``/``end_page`` and the document's own ``text`` there
+        (cut at ``MAX_TEXT_CHARS``). Fragments of an elided quote that don't
+        fall near the best-matching one in order count as not found.
+        """
+        if not snippet:
+            return None
+        fragments = []
+        for fragment in ELLIPSIS.split(PROMPT_LABEL.sub(" ", snippet)):
+            words = [w.lower() for w in WORD_PATTERN.findall(fragment)]
+            if words:
+                fragments.append(words)
+        if not fragments or not len(self.starts):
+            return None
+
+        total = sum(len(words) for words in fragments)
+        located = [self._locate(words) for words in fragments]
+        if not any(located):
+            return {'found': False, 'hallucinated': True, 'exact': False, 'confidence': 0.0}
+
+        # The fragment matching the most words anchors the quote; the others only count
+        # where they follow (or precede) it in order, within MAX_ELLIPSIS_GAP words
+        anchor = max((n for n, match in enumerate(located) if match),
+                     key=lambda n: located[n][2] * len(fragments[n]))
+        first, last, score = located[anchor]
+        matched = score * len(fragments[anchor])
+        spans = 1
+        end_word = last
+        for words in fragments[anchor + 1:]:
+            match = self._locate(words, end_word + 1, end_word + self.MAX_ELLIPSIS_GAP + len(words))
+            if match is not None:
+                matched += match[2] * len(words)
+                spans += 1
+                end_word = max(end_word, match[1])
+        start_word = first
+        for words in reversed(fragments[:anchor]):
+            match = self._locate(words, start_word - self.MAX_ELLIPSIS_GAP - len(words), start_word - 1)
+            if match is not None:
+                matched += match[2] * len(words)
+                spans += 1
+                start_word = min(start_word, match[0])
+
+        confidence = round(matched / total, 3)
+        if confidence < self.MIN_CONFIDENCE:
+            return {'found': False, 'hallucinated': True, 'exact': False, 'confidence': confidence}
+
+        start, end = int(self.starts[start_word]), int(self.ends[end_word])
+        text = self.text[start:min(end, start + self.MAX_TEXT_CHARS)]
+        return {
+            'found': True,
+            'hallucinated': False,
+            'exact': confidence == 1.0 and spans == 1,
+            'confidence': confidence,
+            'start': start,
+            'end': end,
+            'page': self._page(start),
+            'end_page': self._page(max(start, end - 1)),
+            'text': text if end - start <= self.MAX_TEXT_CHARS else text + "…"
+        }
+
+    def _locate(self, words: List[str], lo: int = 0, hi: Optional[int] = None):
+        """(first word, last word, score) of the best match for a word sequence within words ``lo``..``hi``, if any"""
+        hi = len(self.starts) - 1 if hi is None else min(hi, len(self.starts) - 1)
+        lo = max(lo, 0)
+        if hi < lo:
+            return None
+        exact = self._find_verbatim(words, lo, hi)
+        if exact is not None:
+            return exact, exact + len(words) - 1, 1.0
+
+        k = self.shingle_words
+        if len(words) < k:
+            return None
+        ids = np.fromiter((self.vocab.get(w, -1) for w in words), dtype=np.int64, count=len(words))
+        keys = self._shingles(ids)
+        # Shingles containing a word the document never uses can't match anywhere
+        known = np.flatnonzero(np.lib.stride_tricks.sliding_window_view(ids, k).min(axis=1) >= 0)
+        if not len(known):
+            return None
+        key_lo = np.searchsorted(self.keys, keys[known], side='left')
+        key_hi = np.searchsorted(self.keys, keys[known], side='right')
+
+        hit_positions = []
+        hit_offsets = []
+        for offset, a, b in zip(known.tolist(), key_lo.tolist(), key_hi.tolist()):
+            if 0 < b - a <= self.MAX_OCCURRENCES:
+                hit_positions.append(self.positions[a:b])
+                hit_offsets.append(np.full(b - a, offset, dtype=np.int64))
+        if not hit_positions:
+            return None
+        positions = np.concatenate(hit_positions).astype(np.int64)
+        offsets = np.concatenate(hit_offsets)
+        inside = (positions >= lo) & (positions + k - 1 <= hi)
+        if not inside.any():
+            return None
+        positions, offsets = positions[inside], offsets[inside]
+
+        # Each hit votes for the document position where the snippet would start;
+        # the densest band of votes (allowing for a few inserted or dropped words) wins
+        starts = positions - offsets
+        order = np.argsort(starts, kind='stable')
+        starts, positions, offsets = starts[order], positions[order], offsets[order]
+        band = max(2, len(words) // 8)
+        votes = np.searchsorted(starts, starts + band, side='right') - np.arange(len(starts))
+        best = int(np.argmax(votes))
+        chosen = slice(best, best + int(votes[best]))
+
+        shingle_count = len(words) - k + 1
+        score = len(np.unique(offsets[chosen])) / shingle_count
+        # Cover the snippet's unmatched head and tail as well
+        first = int(positions[chosen].min() - offsets[chosen].min())
+        last = int(positions[chosen].max() + k - 1 + (shingle_count - 1 - offsets[chosen].max()))
+        return max(lo, first), min(hi, last), score
+
+    def _find_verbatim(self, words: List[str], lo: int = 0, hi: Optional[int] = None) -> Optional[int]:
+        """Index of the first word of a verbatim occurrence within words ``lo``..``hi``, if any.
+
+        Candidates come from the snippet's rarest shingle and are checked
+        against the document's own words at their recorded offsets, so no
+        lowercased copy of the text is kept. Sequences shorter than a shingle
+        are searched a batch of words at a time.
+        """
+        hi = len(self.starts) - 1 if hi is None else min(hi, len(self.starts) - 1)
+        last = hi - len(words) + 1
+        if last < lo or any(w not in self.vocab for w in words):
+            return None
+        if len(words) < self.shingle_words:
+            return self._scan_verbatim(words, lo, last)
+
+        ids = np.fromiter((self.vocab[w] for w in words), dtype=np.int64, count=len(words))
+        keys = self._shingles(ids)
+        key_lo = np.searchsorted(self.keys, keys, side='left')
+        key_hi = np.searchsorted(self.keys, keys, side='right')
+        offset = int(np.argmin(key_hi - key_lo))
+        # Positions of one shingle are in document order (the sort is stable)
+        candidates = self.positions[key_lo[offset]:key_hi[offset]].astype(np.int64) - offset
+        candidates = candidates[(candidates >= lo) & (candidates <= last)]
+        for first in candidates.tolist():
+            # Shingle keys can collide, so every candidate is confirmed
+            if self._words(first, len(words)) == words:
+                return first
+        return None
+
+    def _scan_verbatim(self, words: List[str], lo: int, last: int) -> Optional[int]:
+        """First verbatim occurrence of a short word sequence starting within words ``lo``..``last``"""
+        needle = " ".join(words)
+        for first in range(lo, last + 1, self.BUILD_BATCH_WORDS):
+            count = min(self.BUILD_BATCH_WORDS, last + 1 - first)
+            joined = " ".join(self._words(first, count + len(words) - 1))
+            position = joined.find(needle)
+            while position != -1:
+                end = position + len(needle)
+                # Only whole-word matches count ("he said" is not in "the said")
+                if (position == 0 or joined[position - 1] == " ") and (end == len(joined) or joined[end] == " "):
+                    word = joined.count(" ", 0, position)
+                    if word < count:
+                        return first + word
+                position = joined.find(needle, position + 1)
+        return None
+
+    def _words(self, first: int, count: int) -> List[str]:
+        """Lowercase words ``first``..``first + count - 1``, read from their span of the text"""
+        span = self.text[int(self.starts[first]):int(self.ends[first + count - 1])]
+        return [w.lower() for w in WORD_PATTERN.findall(span)]
+
+    def _page(self, offset: int) -> Optional[int]:
+        if not self.page_offsets:
+            return None
+        return max(1, int(np.searchsorted(self.page_offsets, offset, side='right')))
+
+    def _shingles(self, ids: np.ndarray) -> np.ndarray:
+        """One integer per run of ``shingle_words`` word ids (wrapping on overflow is harmless)"""
+        k = self.shingle_words
+        if len(ids) < k:
+            return np.zeros(0, dtype=np.int64)
+        base = np.int64(max(len(self.vocab), 1))
+        keys = ids[:len(ids) - k + 1].copy()
+        with np.errstate(over='ignore'):
+            for i in range(1, k):
+                keys = keys * base + ids[i:len(ids) - k + 1 + i]
+        return keys
@@ -0,0 +1,206 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+
+def _decode(data) -> Optional[Any]:
+    try:
+        return json.loads(data)
+    except ValueError:
+        # Written by an older version that pickled values; treated as missing
+        return None
+
+
+def _count(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class MemoryStateStore:
+    """Process-local key/value store; the default for a single worker.
+
+    Values are kept as live objects, so callers must not mutate what they
+    get back if they expect the stored copy to stay unchanged. Callers store
+    the same plain JSON data here as in the shared stores.
+    """
+
+    # Visible to this process only, so other workers can't read what is stored here
+    shared = False
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self):
+        self._items: Dict[str, Tuple[Any, Optional[float]]] = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.time() + self.SWEEP_INTERVAL
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                del self._items[key]
+                return None
+            return value
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._items[key] = (value, now + ttl if ttl else None)
+            if now >= self._next_sweep:
+                # Drop expired items that were never read again
+                self._items = {k: v for k, v in self._items.items() if v[1] is None or v[1] >= now}
+                self._next_sweep = now + self.SWEEP_INTERVAL
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def add(self, key: str, amount: int, ttl: Optional[float] = None) -> int:
+        """Atomically add to a counter and return its new value; ``ttl`` applies when it is created"""
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or (item[1] is not None and item[1] < now):
+                item = (0, now + ttl if ttl else None)
+            total = item[0] + amount
+            self._items[key] = (total, item[1])
+            return total
+
+
+class SQLiteStateStore:
+    """JSON values in a SQLite table, shared by workers on one host.
+
+    Values must be plain JSON data (dicts, lists, strings, numbers), so
+    reading the file never runs code and stored sessions survive renamed
+    classes. Whoever can write the file can still change any session's
+    conversation and the documents served, so keep it private to the app.
+    Counters are stored as SQLite integers.
+    """
+
+    shared = True
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                (key, time.time())
+            ).fetchone()
+        return _decode(row[0]) if row else None
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        data = json.dumps(value, separators=(',', ':'))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, data, time.time() + ttl if ttl else None)
+            )
+            self._conn.execute("DELETE FROM state WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM state WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def add(self, key: str, amount: int, ttl: Optional[float] = None) -> int:
+        """Atomically add to a counter and return its new value; ``ttl`` applies when it is created"""
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock, so other processes can't interleave
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                    (key, now)
+                ).fetchone()
+                total = (_count(row[0]) if row else 0) + int(amount)
+                expires_at = row[1] if row else (now + ttl if ttl else None)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, total, expires_at)
+                )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return total
+
+
+class RedisStateStore:
+    """JSON values in Redis (or any server speaking its protocol).
+
+    As with ``SQLiteStateStore``, values are plain JSON data and nothing
+    read back is executed, but anyone who can write to the server can alter
+    sessions and documents; don't share it with untrusted clients.
+    """
+
+    shared = True
+
+    def __init__(self, url: str, prefix: str = "assistant:"):
+        import redis
+
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[Any]:
+        blob = self._redis.get(self.prefix + key)
+        return _decode(blob) if blob is not None else None
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        data = json.dumps(value, separators=(',', ':'))
+        self._redis.set(self.prefix + key, data, px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key: str) -> None:
+        self._redis.delete(self.prefix + key)
+        self._redis.delete(self._counter_key(key))
+
+    def add(self, key: str, amount: int, ttl: Optional[float] = None) -> int:
+        """Atomically add to a counter and return its new value; ``ttl`` applies when it is created"""
+        # Counters are plain Redis integers, so they live apart from JSON values and are read with add(key, 0)
+        counter = self._counter_key(key)
+        pipe = self._redis.pipeline()
+        if ttl:
+            # Creates the counter with its expiry only if it doesn't exist yet
+            pipe.set(counter, 0, px=int(ttl * 1000), nx=True)
+        pipe.incrby(counter, int(amount))
+        return int(pipe.execute()[-1])
+
+    def _counter_key(self, key: str) -> str:
+        return f"{self.prefix}counter:{key}"
+
+
+def open_state_store(url: Optional[str] = None):
+    """Create a state store from a URL.
+
+    ``memory://`` (or no URL) keeps state in this process, ``sqlite:///path``
+    shares it through a SQLite file and ``redis://host:port/db`` through Redis.
+    """
+    if not url or url == "memory://":
+        return MemoryStateStore()
+
+    scheme = urlparse(url).scheme
+    if scheme == "sqlite":
+        return SQLiteStateStore(url[len("sqlite:///"):] or ":memory:")
+    if scheme in ("redis", "rediss", "unix"):
+        return RedisStateStore(url)
+    raise ValueError(f"Unsupported state store URL: {url}")
@@ -0,0 +1,159 @@
+import contextvars
+import hashlib
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from document_store import DocumentStore
+from instrumentation import current_span
+from retrieval import estimate_tokens
+
+
+# Bump when the map/reduce prompts change so cached partial summaries are not reused
+SUMMARY_PROMPT_VERSION = "1"
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def split_sections(text: str, target_tokens: int = 3000) -> List[str]:
+    """Split text into sections of roughly ``target_tokens`` at sentence ends.
+
+    Cut points are content-defined: a section may end after any sentence whose
+    hash hits a fixed residue once the section is at least half the target,
+    and must end at twice the target. An edit therefore only changes the
+    sections around it; boundaries before and after it fall in the same places,
+    so their cache keys still match.
+    """
+    target_chars = target_tokens * 4
+    min_chars = target_chars // 2
+    max_chars = target_chars * 2
+    # With ~200-character sentences an anchor turns up about once per target_chars
+    divisor = max(1, target_chars // 200)
+
+    sections = []
+    current = []
+    size = 0
+    for sentence in SENTENCE_END.split(text):
+        current.append(sentence)
+        size += len(sentence) + 1
+        at_anchor = zlib.crc32(sentence.encode('utf-8')) % divisor == 0
+        if size >= max_chars or (size >= min_chars and at_anchor):
+            sections.append(" ".join(current))
+            current = []
+            size = 0
+    if current:
+        sections.append(" ".join(current))
+    return [s for s in sections if s.strip()]
+
+
+class HierarchicalSummarizer:
+    """Map-reduce summarization for documents that don't fit in one prompt.
+
+    Sections are summarized concurrently, then partial summaries are merged
+    in groups of ``fan_in`` until they fit a single prompt for the final
+    summary. Every intermediate summary is cached under the hash of its
+    input, so re-summarizing an edited document only calls the model for the
+    sections that changed.
+    """
+
+    def __init__(self, generate: Callable[[str], str], cache: Optional[DocumentStore] = None,
+                 max_workers: int = 4, section_tokens: int = 3000, fan_in: int = 8):
+        self.generate = generate
+        self.cache = cache if cache is not None else DocumentStore(max_entries=1024)
+        self.max_workers = max_workers
+        self.section_tokens = section_tokens
+        self.fan_in = fan_in
+
+    def summarize(self, text: str, max_words: int = 150,
+                  progress: Optional[Callable[[int, int], None]] = None) -> str:
+        """Summarize text of any length into at most ``max_words`` words.
+
+        ``progress(done, total)`` is called as sections are summarized; the
+        total grows as reduce levels are added.
+        """
+        if estimate_tokens(text) <= self.section_tokens:
+            summary = self.generate(self._final_prompt(text, max_words))
+            if progress:
+                progress(1, 1)
+            return summary
+
+        partial_words = max(max_words, 120)
+        sections = split_sections(text, self.section_tokens)
+        counts = {'done': 0, 'total': len(sections) + 1}
+
+        def advance() -> None:
+            counts['done'] += 1
+            if progress:
+                progress(counts['done'], counts['total'])
+
+        partials = self._map(sections, lambda section: self._section_prompt(section, partial_words), advance)
+
+        # Reduce level by level until everything fits in one prompt
+        while len(partials) > 1 and estimate_tokens("\n\n".join(partials)) > self.section_tokens:
+            groups = ["\n\n".join(partials[i:i + self.fan_in]) for i in range(0, len(partials), self.fan_in)]
+            counts['total'] += len(groups)
+            partials = self._map(groups, lambda group: self._merge_prompt(group, partial_words), advance)
+
+        summary = self.generate(self._final_prompt("\n\n".join(partials), max_words))
+        advance()
+        return summary
+
+    def _map(self, inputs: List[str], make_prompt: Callable[[str], str],
+             advance: Callable[[], None] = lambda: None) -> List[str]:
+        prompts = [make_prompt(text) for text in inputs]
+        keys = [hashlib.sha256(f"{SUMMARY_PROMPT_VERSION}\n{p}".encode('utf-8')).hexdigest() for p in prompts]
+
+        entries = [self.cache.get(key) for key in keys]
+        results = [entry['summary'] if entry else None for entry in entries]
+        missing = [i for i, result in enumerate(results) if result is None]
+        current_span().add('cached_sections', len(inputs) - len(missing))
+        current_span().add('generated_sections', len(missing))
+        for _ in range(len(inputs) - len(missing)):
+            advance()
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                # Copy the caller's context so model call spans nest under the summary span
+                futures = [pool.submit(contextvars.copy_context().run, self.generate, prompts[i]) for i in missing]
+                for i, future in zip(missing, futures):
+                    summary = future.result()
+                    self.cache.put(keys[i], {'summary': summary})
+                    results[i] = summary
+                    advance()
+        return results
+
+    @staticmethod
+    def _section_prompt(section: str, max_words: int) -> str:
+        return f"""
+            The following is one section of a longer document. Summarize it in no more than {max_words} words.
+            Keep the key facts, figures, names and conclusions; do not add information that is not in the text.
+
+            Section:
+            {section}
+
+            Section summary (max {max_words} words):
+            """
+
+    @staticmethod
+    def _merge_prompt(partials: str, max_words: int) -> str:
+        return f"""
+            The following are summaries of consecutive sections of one document.
+            Combine them into a single summary of no more than {max_words} words, keeping the most important points in order.
+
+            Section summaries:
+            {partials}
+
+            Combined summary (max {max_words} words):
+            """
+
+    @staticmethod
+    def _final_prompt(text: str, max_words: int) -> str:
+        return f"""
+            Please provide a concise summary of the following document in no more than {max_words} words.
+            Focus on the main topics, key points, and overall purpose of the document.
+
+            Document:
+            {text}
+
+            Summary (max {max_words} words):
+            """
@@ -0,0 +1,74 @@
+import types
+
+import pytest
+
+import answer_cache
+from answer_cache import AnswerCache, normalize_question
+
+QUESTION = "When was the quokka census completed?"
+RESULT = {'answer': "In March", 'justification': "Stated in the summary", 'source_snippet': "completed in March"}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = types.SimpleNamespace(value=1_000_000.0)
+    monkeypatch.setattr(answer_cache, 'time', types.SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+def test_normalization_ignores_case_punctuation_and_spacing():
+    assert normalize_question("  When was the  Quokka census, completed?? ") == "when was the quokka census completed"
+
+
+def test_exact_and_near_duplicate_questions_hit():
+    cache = AnswerCache()
+    cache.put('doc', QUESTION, 'model', 'v1', RESULT)
+    assert cache.get('doc', "when was the QUOKKA census completed", 'model', 'v1') == RESULT
+    assert cache.get('doc', "When was quokka census completed?", 'model', 'v1') == RESULT
+    assert cache.get('doc', "Who funded the census?", 'model', 'v1') is None
+    stats = cache.stats()
+    assert (stats['exact_hits'], stats['semantic_hits'], stats['misses']) == (1, 1, 1)
+    assert stats['hit_rate'] == pytest.approx(2 / 3)
+
+
+def test_entries_are_scoped_by_document_model_and_prompt_version():
+    cache = AnswerCache()
+    cache.put('doc', QUESTION, 'model', 'v1', RESULT)
+    assert cache.get('other-doc', QUESTION, 'model', 'v1') is None
+    assert cache.get('doc', QUESTION, 'other-model', 'v1') is None
+    assert cache.get('doc', QUESTION, 'model', 'v2') is None
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = AnswerCache(ttl_seconds=60)
+    cache.put('doc', QUESTION, 'model', 'v1', RESULT)
+    clock.value += 59
+    assert cache.get('doc', QUESTION, 'model', 'v1') == RESULT
+    clock.value += 2
+    assert cache.get('doc', QUESTION, 'model', 'v1') is None
+    # Expired entries are dropped on the next write
+    cache.put('doc', "Who funded the census?", 'model', 'v1', RESULT)
+    assert cache.stats()['entries'] == 1
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    cache = AnswerCache(max_entries=2)
+    cache.put('doc', "first question about quokkas", 'model', 'v1', RESULT)
+    clock.value += 1
+    cache.put('doc', "second question about wombats", 'model', 'v1', RESULT)
+    clock.value += 1
+    assert cache.get('doc', "first question about quokkas", 'model', 'v1') is not None
+    clock.value += 1
+    cache.put('doc', "third question about numbats", 'model', 'v1', RESULT)
+    assert cache.stats()['entries'] == 2
+    assert cache.get('doc', "second question about wombats", 'model', 'v1') is None
+    assert cache.get('doc', "first question about quokkas", 'model', 'v1') is not None
+
+
+def test_rewriting_a_question_replaces_its_answer():
+    cache = AnswerCache()
+    cache.put('doc', QUESTION, 'model', 'v1', RESULT)
+    cache.put('doc', QUESTION.upper(), 'model', 'v1', {'answer': "In April"})
+    assert cache.get('doc', QUESTION, 'model', 'v1') == {'answer': "In April", 'justification': None,
+                                                         'source_snippet': None}
+    assert cache.stats()['entries'] == 1
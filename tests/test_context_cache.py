@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from assistant import DocumentProcessor, GeminiDocumentAssistant
+from context_cache import ContextCache
+from model_client import CachedContentNotFound, ModelClient, StubBackend
+from state_store import MemoryStateStore
+
+DOCUMENT = "The quokka census was completed in March. " * 40
+
+
+def make_cache(backend=None, **options):
+    backend = backend or StubBackend()
+    client = ModelClient(backend, requests_per_minute=1e6, tokens_per_minute=1e9, max_retries=0)
+    options.setdefault('min_tokens', 10)
+    return backend, ContextCache(client, MemoryStateStore(), **options)
+
+
+def test_document_is_pinned_once_and_reused():
+    backend, cache = make_cache()
+    reads = []
+    content = lambda: reads.append(1) or DOCUMENT
+    name = cache.handle('doc', "system", content)
+    assert cache.handle('doc', "system", content) == name
+    assert backend.caches_created == 1 and len(reads) == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['creates'] == 1
+
+    assert cache.client.generate("When?", cached_content=name) == StubBackend.echo(f"system\n\n{DOCUMENT}\n\nWhen?")
+    assert backend.cached_input_tokens > 0
+
+
+def test_documents_outside_the_token_range_are_not_cached():
+    backend, cache = make_cache(min_tokens=10_000)
+    reads = []
+    assert cache.handle('doc', "system", lambda: reads.append(1) or DOCUMENT) is None
+    # Checked once; the content isn't read again for the same key
+    assert cache.handle('doc', "system", lambda: reads.append(1) or DOCUMENT) is None
+    assert backend.caches_created == 0 and len(reads) == 1
+
+
+def test_handles_are_recreated_before_their_ttl_runs_out():
+    backend, cache = make_cache(ttl_seconds=0.3, refresh_margin=0.1)
+    first = cache.handle('doc', "system", lambda: DOCUMENT)
+    time.sleep(0.25)
+    second = cache.handle('doc', "system", lambda: DOCUMENT)
+    assert second != first and backend.caches_created == 2
+    time.sleep(0.1)
+    # The stub expires the old handle at its TTL, like the provider
+    with pytest.raises(CachedContentNotFound):
+        cache.client.generate("When?", cached_content=first)
+
+
+def test_invalidate_deletes_the_provider_cache():
+    backend, cache = make_cache()
+    name = cache.handle('doc', "system", lambda: DOCUMENT)
+    assert cache.invalidate('doc')
+    assert not cache.invalidate('doc')
+    with pytest.raises(CachedContentNotFound):
+        cache.client.generate("When?", cached_content=name)
+    assert cache.handle('doc', "system", lambda: DOCUMENT) != name
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_a_rejected_handle_is_replaced_and_the_question_answered():
+    backend, cache = make_cache()
+    processed = DocumentProcessor().preprocess_text(DOCUMENT)
+    assistant = GeminiDocumentAssistant(processed, client=cache.client, context_cache=cache)
+    assistant.answer_question("When was the census completed?")
+    assert backend.caches_created == 1
+
+    # The provider drops the cache before its TTL
+    backend.delete_cache(cache.state.get(cache._state_key(assistant.document_hash))['name'])
+    result = assistant.answer_question("Who counted the quokkas?")
+    assert result['answer'].startswith("Stub response")
+    assert backend.caches_created == 2
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_creation_errors_fall_back_to_no_cache():
+    class Failing(StubBackend):
+        def create_cache(self, system_instruction, content, ttl_seconds):
+            raise RuntimeError("quota exceeded")
+
+    backend, cache = make_cache(Failing())
+    assert cache.handle('doc', "system", lambda: DOCUMENT) is None
+    assert cache.stats()['errors'] == 1
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from corpus import CorpusIndex
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+@pytest.fixture
+def library(tmp_path):
+    root = tmp_path / 'library'
+    write(str(root / 'a' / 'x.txt'), "Quokkas live on Rottnest Island. " * 40)
+    write(str(root / 'b' / 'x.txt'), "Wombats dig long burrows in the forest. " * 40)
+    return root, CorpusIndex(str(tmp_path / 'index'), root=str(root))
+
+
+def sources(index):
+    return sorted(doc['path'] for doc in index.manifest['docs'].values())
+
+
+def test_folders_share_one_library_without_colliding(library):
+    root, index = library
+    index.ingest(str(root / 'a'), workers=1)
+    stats = index.ingest(str(root / 'b'), workers=1)
+    assert stats['removed'] == 0
+    assert sources(index) == [os.path.join('a', 'x.txt'), os.path.join('b', 'x.txt')]
+    assert index.retrieve("wombats burrows")[0]['source'] == os.path.join('b', 'x.txt')
+
+
+def test_reingesting_a_folder_only_drops_its_own_missing_files(library):
+    root, index = library
+    index.ingest(str(root), workers=1)
+    os.remove(str(root / 'a' / 'x.txt'))
+    stats = index.ingest(str(root / 'a'), workers=1)
+    assert stats['removed'] == 1
+    assert sources(index) == [os.path.join('b', 'x.txt')]
+
+
+def test_folders_outside_the_root_are_refused(library, tmp_path):
+    _, index = library
+    write(str(tmp_path / 'elsewhere' / 'y.txt'), "Outside the library. " * 20)
+    with pytest.raises(ValueError):
+        index.ingest(str(tmp_path / 'elsewhere'), workers=1)
+
+
+def test_chunk_count_leaves_out_replaced_documents(library):
+    root, index = library
+    index.ingest(str(root), workers=1)
+    before = index.describe()['chunk_count']
+    write(str(root / 'a' / 'x.txt'), "Numbats eat termites. " * 40)
+    stats = index.ingest(str(root), workers=1)
+    assert stats['updated'] == 1
+    # The old version is tombstoned in its segment until a merge
+    assert sum(s['chunks'] for s in index.manifest['segments']) > index.describe()['chunk_count']
+    assert index.describe()['chunk_count'] == stats['chunks'] <= before
@@ -0,0 +1,145 @@
+import multiprocessing
+import socket
+import threading
+import time
+
+import pytest
+
+from job_queue import Job, JobCancelled, JobNotFound, JobQueue
+
+
+def wait_for(queue, job_id, statuses=('done', 'failed', 'cancelled'), timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job stayed {job['status']}")
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(workers=1)
+    yield queue
+    queue.shutdown(wait=False)
+
+
+def test_result_and_progress_are_recorded(queue):
+    def work(job, pages):
+        for n in range(1, pages + 1):
+            job.progress('extract', n, pages)
+        job.progress('index', 1, 1)
+        return {'pages': pages}
+
+    job = wait_for(queue, queue.submit('ingest', work, 3, key='doc')['id'])
+    assert job['status'] == 'done'
+    assert job['result'] == {'pages': 3}
+    assert job['stages'] == {'extract': [3, 3], 'index': [1, 1]}
+    assert (job['stage'], job['done'], job['total']) == ('index', 1, 1)
+
+
+def test_failures_are_reported(queue):
+    def work(job):
+        raise ValueError("unreadable file")
+
+    job = wait_for(queue, queue.submit('ingest', work)['id'])
+    assert job['status'] == 'failed'
+    assert job['error'] == "unreadable file"
+
+
+def test_running_jobs_stop_at_their_next_progress_report(queue):
+    started = threading.Event()
+    swallowed = []
+
+    def work(job):
+        started.set()
+        for n in range(1000):
+            try:
+                job.progress('index', n, 1000)
+            except Exception:
+                # Catch-all fallbacks in the pipeline must not swallow cancellation
+                swallowed.append(n)
+            time.sleep(0.01)
+        return {}
+
+    job_id = queue.submit('ingest', work)['id']
+    started.wait(5)
+    assert queue.cancel(job_id)['cancel_requested']
+    job = wait_for(queue, job_id)
+    assert job['status'] == 'cancelled'
+    assert job['done'] < 1000
+    assert not swallowed
+    assert issubclass(JobCancelled, BaseException) and not issubclass(JobCancelled, Exception)
+
+
+def test_queued_jobs_are_cancelled_without_running(queue):
+    release = threading.Event()
+    ran = []
+    blocker = queue.submit('ingest', lambda job: release.wait(5) and {})
+    queued = queue.submit('ingest', lambda job: ran.append(1))
+    assert queue.cancel(queued['id'])['status'] == 'cancelled'
+    release.set()
+    wait_for(queue, blocker['id'])
+    time.sleep(0.05)
+    assert not ran
+    assert queue.get(queued['id'])['status'] == 'cancelled'
+
+
+def test_find_returns_only_active_jobs(queue):
+    release = threading.Event()
+    job = queue.submit('library', lambda job: release.wait(5) and {}, key='/library/a')
+    assert queue.find('library', '/library/a')['id'] == job['id']
+    assert queue.find('library', '/library/b') is None
+    release.set()
+    wait_for(queue, job['id'])
+    assert queue.find('library', '/library/a') is None
+
+
+def test_interim_results_are_visible_while_running(queue):
+    published = threading.Event()
+    release = threading.Event()
+
+    def work(job):
+        job.publish({'pages_read': 8})
+        published.set()
+        release.wait(5)
+        return {'pages_read': 40}
+
+    job_id = queue.submit('ingest', work)['id']
+    published.wait(5)
+    assert queue.get(job_id)['result'] == {'pages_read': 8}
+    release.set()
+    assert wait_for(queue, job_id)['result'] == {'pages_read': 40}
+
+
+def test_progress_writes_are_throttled_within_a_stage(queue, monkeypatch):
+    writes = []
+    monkeypatch.setattr(queue, '_update_progress', lambda *args: writes.append(args[2:4]) or False)
+    job = Job(queue, 'job')
+    for n in range(1, 101):
+        job.update('extract', n, 100)
+    # The first and last reports always reach the table; the rest only every WRITE_INTERVAL
+    assert writes[0] == (1, 100) and writes[-1] == (100, 100)
+    assert len(writes) < 10
+
+
+def test_jobs_of_an_exited_process_are_marked_interrupted(tmp_path):
+    process = multiprocessing.get_context('spawn').Process(target=time.sleep, args=(0,))
+    process.start()
+    process.join()
+    path = str(tmp_path / 'jobs.sqlite3')
+
+    first = JobQueue(path)
+    first._conn.execute(
+        "INSERT INTO jobs (id, kind, status, owner, created_at, updated_at) VALUES ('old', 'ingest', 'running', ?, 0, 0)",
+        (f"{socket.gethostname()}:{process.pid}:deadbeef",)
+    )
+    first._conn.commit()
+    first.shutdown()
+
+    second = JobQueue(path)
+    assert second.get('old')['status'] == 'interrupted'
+    with pytest.raises(JobNotFound):
+        second.get('missing')
+    second.shutdown()
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from model_client import ModelClient, StubBackend, TokenBucket, TransientModelError
+
+
+def make_client(backend, **options):
+    options.setdefault('requests_per_minute', 1e6)
+    options.setdefault('tokens_per_minute', 1e9)
+    options.setdefault('base_delay', 0.001)
+    return ModelClient(backend, **options)
+
+
+def test_identical_inflight_prompts_share_one_call():
+    backend = StubBackend(latency=0.2)
+    client = make_client(backend)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.generate("same prompt"))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.calls == 1
+    assert results == [StubBackend.echo("same prompt")] * 2
+    # Once the first call finished, the same prompt is sent again
+    client.generate("same prompt")
+    assert backend.calls == 2
+
+
+def test_different_options_are_not_coalesced():
+    backend = StubBackend(latency=0.1)
+    client = make_client(backend)
+    futures = [client.submit("prompt"), client.submit("prompt", json_output=True)]
+    [future.result() for future in futures]
+    assert backend.calls == 2
+
+
+def test_transient_failures_are_retried():
+    backend = StubBackend(fail_first=2)
+    client = make_client(backend, max_retries=3)
+    assert client.generate("question") == StubBackend.echo("question")
+    assert backend.calls == 3
+
+
+def test_retries_give_up_after_max_retries():
+    backend = StubBackend(fail_first=5)
+    client = make_client(backend, max_retries=2)
+    with pytest.raises(TransientModelError):
+        client.generate("question")
+    assert backend.calls == 3
+
+
+def test_stream_retries_before_the_first_chunk():
+    backend = StubBackend(fail_first=1)
+    client = make_client(backend, max_retries=1)
+    assert "".join(client.stream("question")) == StubBackend.echo("question")
+    assert backend.calls == 2
+
+
+def test_token_bucket_makes_callers_wait_once_empty():
+    bucket = TokenBucket(60, capacity=2)
+    assert bucket.reserve(1) == 0.0
+    assert bucket.reserve(1) == 0.0
+    assert bucket.wait_time(1) == pytest.approx(1.0, abs=0.05)
+    assert bucket.reserve(1) == pytest.approx(1.0, abs=0.05)
+
+
+def test_requests_per_minute_throttles_calls():
+    client = make_client(StubBackend())
+    client.request_bucket = TokenBucket(600, capacity=1)
+    started = time.monotonic()
+    for n in range(4):
+        client.generate(f"prompt {n}")
+    # One call goes through at once, the other three wait 0.1 s each
+    assert time.monotonic() - started >= 0.25
+    assert client.pending_wait(1) > 0
+
+
+def test_tokens_per_minute_throttles_large_prompts():
+    client = make_client(StubBackend())
+    client.token_bucket = TokenBucket(60_000, capacity=100)
+    started = time.monotonic()
+    client.generate("word " * 100)
+    client.generate("word " * 101)
+    assert time.monotonic() - started >= 0.05
+
+
+def test_batch_and_async_calls_forward_their_options():
+    backend = StubBackend()
+    client = make_client(backend)
+    cache = client.create_cached_content("system", "document " * 200, ttl_seconds=60)
+    prompts = ["first", "second"]
+    results = client.generate_many(prompts, cached_content=cache, task='summary', session_id='s')
+    assert results == [StubBackend.echo(f"system\n\n{'document ' * 200}\n\n{p}") for p in prompts]
+    assert backend.cached_input_tokens > 0
+
+    result = asyncio.run(client.agenerate("third", cached_content=cache, json_output=True))
+    assert result == StubBackend.echo(f"system\n\n{'document ' * 200}\n\nthird")
@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+
+from model_client import ModelClient, StubBackend, TransientModelError, served_model
+import model_router
+from model_router import BudgetExceeded, ModelRouter, ModelTier, TokenBudget
+from state_store import MemoryStateStore
+
+
+def make_tier(role, model_name, price, fail_first=0, responder=None):
+    backend = StubBackend(responder, fail_first=fail_first, model_name=model_name)
+    client = ModelClient(backend, requests_per_minute=1e6, tokens_per_minute=1e9, max_retries=0)
+    return ModelTier(role, client, price, price * 4, expected_latency=1.0)
+
+
+def make_router(budget=None, standard_failures=0):
+    return ModelRouter([
+        make_tier('lite', 'stub-lite', 0.04),
+        make_tier('standard', 'stub-standard', 0.08, fail_first=standard_failures),
+        make_tier('pro', 'stub-pro', 1.25),
+    ], budget)
+
+
+def test_tasks_go_to_their_preferred_tier():
+    router = make_router()
+    for task in ('summary', 'answer', 'evaluation'):
+        router.generate(f"prompt for {task}", task=task)
+    calls = {role: tier['calls'] for role, tier in router.stats()['tiers'].items()}
+    assert calls == {'lite': 1, 'standard': 1, 'pro': 1}
+    assert router.model_name == 'stub-standard'
+
+
+def test_transient_error_falls_back_and_cools_the_tier_down():
+    router = make_router(standard_failures=1)
+    assert router.generate("question", task='answer').startswith("ANSWER: Stub response")
+    assert served_model.get() == 'stub-lite'
+    assert router.stats()['tiers']['standard']['failures'] == 1
+    assert not router.tiers['standard'].available()
+    assert [tier.role for tier in router._plan('answer', 10, None, None)][0] == 'lite'
+
+
+def test_stream_falls_back_before_the_first_chunk():
+    router = make_router(standard_failures=1)
+    text = "".join(router.stream("question", task='answer'))
+    assert text.startswith("ANSWER: Stub response")
+    assert router.stats()['tiers']['lite']['calls'] == 1
+
+
+def test_non_transient_errors_are_not_retried_elsewhere():
+    def broken(prompt):
+        raise ValueError("bad request")
+
+    router = ModelRouter([make_tier('standard', 'stub-standard', 0.08, responder=broken),
+                          make_tier('lite', 'stub-lite', 0.04)])
+    with pytest.raises(ValueError):
+        router.generate("question", task='answer')
+    assert router.stats()['tiers']['lite']['calls'] == 0
+
+
+def test_every_tier_failing_raises_the_last_error():
+    router = ModelRouter([make_tier('standard', 'stub-standard', 0.08, fail_first=1),
+                          make_tier('lite', 'stub-lite', 0.04, fail_first=1)])
+    with pytest.raises(TransientModelError):
+        router.generate("question", task='answer')
+
+
+def test_cached_content_stays_on_the_primary_tier():
+    router = make_router()
+    assert [tier.role for tier in router._plan('summary', 10, 'cachedContents/x', None)] == ['standard']
+
+
+def test_session_budget_is_enforced_per_session():
+    router = make_router(TokenBudget(MemoryStateStore(), session_tokens=2000))
+    with pytest.raises(BudgetExceeded):
+        for _ in range(20):
+            router.generate("word " * 400, task='answer', session_id='a')
+    usage = router.stats('a')['budget']
+    assert 0 < usage['session_tokens'] <= 2000
+    # Other sessions have their own allowance
+    router.generate("word " * 400, task='answer', session_id='b')
+
+
+def test_global_budget_covers_every_session():
+    router = make_router(TokenBudget(MemoryStateStore(), global_tokens=3000))
+    with pytest.raises(BudgetExceeded):
+        for n in range(20):
+            router.generate("word " * 400, task='answer', session_id=f"s{n}")
+    assert router.stats()['budget']['global_tokens'] <= 3000
+
+
+def test_low_budget_prefers_the_cheapest_tier():
+    budget = TokenBudget(MemoryStateStore(), session_tokens=10000)
+    router = make_router(budget)
+    budget.charge('a', 9000)
+    assert [tier.role for tier in router._plan('evaluation', 10, None, 'a')][0] == 'lite'
+    assert [tier.role for tier in router._plan('evaluation', 10, None, 'b')][0] == 'pro'
+
+
+def test_generate_many_keeps_order():
+    router = make_router()
+    prompts = [f"prompt {n}" for n in range(5)]
+    assert router.generate_many(prompts, task='summary') == [StubBackend.echo(p) for p in prompts]
+
+
+def test_batch_and_async_calls_forward_their_options():
+    budget = TokenBudget(MemoryStateStore())
+    router = make_router(budget)
+    cache = router.create_cached_content("system", "document " * 200, ttl_seconds=60)
+    prompts = ["first", "second"]
+    results = router.generate_many(prompts, cached_content=cache, task='summary', session_id='s')
+    assert results == [StubBackend.echo(f"system\n\n{'document ' * 200}\n\n{p}") for p in prompts]
+    # Cached calls stay on the primary tier whatever the task prefers
+    assert router.stats()['tiers']['standard']['calls'] == 2
+    assert router.stats('s')['budget']['session_tokens'] > 0
+
+    result = asyncio.run(router.agenerate("third", cached_content=cache, json_output=True, session_id='t'))
+    assert result == StubBackend.echo(f"system\n\n{'document ' * 200}\n\nthird")
+    assert router.stats('t')['budget']['session_tokens'] > 0
+
+
+def test_every_task_runs_on_the_default_single_model(monkeypatch):
+    # Tiers are opt-in; the default is one model
+    assert "," not in model_router.DEFAULT_TIERS
+    monkeypatch.setattr(model_router, 'DEFAULT_TIERS', "standard=stub-default")
+    monkeypatch.delenv("MODEL_TIERS", raising=False)
+    router = ModelRouter.from_env("key", MemoryStateStore())
+    for task in ('summary', 'answer', 'questions', 'evaluation', 'reformat'):
+        assert router.serving_models(task) == ['stub-default']
+    # With no other tier to fall back to, the client retries as an unrouted one would
+    assert router.primary.client.max_retries == 3
+
+
+def ask_with_cache(router, cache):
+    from assistant import DocumentProcessor, GeminiDocumentAssistant
+
+    processed = DocumentProcessor().preprocess_text("The quokka census was completed in March. " * 20)
+    assistant = GeminiDocumentAssistant(processed, client=router, answer_cache=cache)
+    return assistant, assistant.answer_question("When was the census completed?")
+
+
+def test_answers_are_cached_under_the_model_that_wrote_them():
+    from answer_cache import AnswerCache
+    from assistant import GeminiDocumentAssistant
+
+    cache = AnswerCache(":memory:")
+    router = make_router(standard_failures=1)
+    assistant, _ = ask_with_cache(router, cache)
+    version = GeminiDocumentAssistant.ANSWER_PROMPT_VERSION
+    doc_hash = assistant.document_hash
+    assert cache.get(doc_hash, "When was the census completed?", 'stub-lite', version) is not None
+    assert cache.get(doc_hash, "When was the census completed?", 'stub-standard', version) is None
+
+    # Asked again, the fallback's answer is found whichever tier would serve the call now
+    calls = sum(tier['calls'] for tier in router.stats()['tiers'].values())
+    _, result = ask_with_cache(router, cache)
+    assert result.get('cached')
+    router.tiers['standard'].cooldown_until = 0
+    _, result = ask_with_cache(router, cache)
+    assert result.get('cached')
+    assert sum(tier['calls'] for tier in router.stats()['tiers'].values()) == calls
@@ -0,0 +1,52 @@
+import pytest
+
+import pdf_extraction
+from benchmark import make_pdf, synthetic_pages
+from pdf_extraction import PAGES_PER_TASK, PdfPageStream, join_pages
+
+
+@pytest.fixture(scope='module')
+def pdf_bytes():
+    return make_pdf(synthetic_pages(40))
+
+
+def read(pdf_bytes, **options):
+    stream = PdfPageStream(pdf_bytes, backend='pypdf2', ocr=False, **options)
+    pages = list(stream)
+    return stream, pages
+
+
+def test_parallel_and_serial_extraction_match(pdf_bytes, monkeypatch):
+    _, serial = read(pdf_bytes, workers=1)
+    monkeypatch.setattr(PdfPageStream, '_parallel_workers', lambda self, page_seconds: 2)
+    stream, parallel = read(pdf_bytes, workers=2)
+    assert [n for n, _ in parallel] == list(range(1, 41))
+    assert parallel == serial
+    assert join_pages(iter(parallel)) == join_pages(iter(serial))
+    assert not stream.truncated
+
+
+def test_pool_is_skipped_when_parsing_costs_more_than_it_saves(pdf_bytes, monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("the pool should not be started")
+
+    monkeypatch.setattr(PdfPageStream, '_pool', no_pool)
+    monkeypatch.setattr(pdf_extraction, 'WORKER_START_SECONDS', 3600.0)
+    stream, pages = read(pdf_bytes, workers=4)
+    assert len(pages) == 40
+
+
+def test_workers_scale_with_the_work_left(pdf_bytes):
+    stream = PdfPageStream(pdf_bytes, backend='pypdf2', ocr=False, workers=4)
+    stream._parse_seconds = 0.0
+    overhead = pdf_extraction.WORKER_START_SECONDS
+    remaining = stream.pages_to_read - PAGES_PER_TASK
+    assert stream._parallel_workers(overhead / remaining / 2) == 1
+    assert stream._parallel_workers(2 * overhead / remaining) == 2
+    assert stream._parallel_workers(1.0) == 4
+
+
+def test_max_pages_stops_early(pdf_bytes):
+    stream, pages = read(pdf_bytes, workers=1, max_pages=5)
+    assert [n for n, _ in pages] == [1, 2, 3, 4, 5]
+    assert stream.truncated
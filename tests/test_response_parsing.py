@@ -0,0 +1,119 @@
+import json
+
+from assistant import DocumentProcessor, GeminiDocumentAssistant
+from model_client import ModelClient, StubBackend
+from response_parsing import ResponseSchema, SectionStreamParser, parse_sections
+
+ANSWER = ResponseSchema({
+    'answer': "Your answer",
+    'justification': "Where you found it",
+    'source_snippet': "Quote from the document"
+}, required=('answer',))
+QUESTIONS = ResponseSchema({
+    'question': "A question",
+    'answer_guidance': "Hint"
+}, required=('question',), list_key='questions', markers={'answer_guidance': 'GUIDANCE'})
+
+
+def feed_in_chunks(parser, text, size=3):
+    seen = []
+    for start in range(0, len(text), size):
+        seen.append(parser.feed(text[start:start + size]))
+    return seen
+
+
+def test_markers_tolerate_markdown_case_and_line_breaks():
+    text = "Sure!\n**ANSWER:** In March\nafter the rains.\n## Justification\nPage 1 says so.\n- source snippet: completed in March"
+    assert parse_sections(text, {'ANSWER:': 'answer', 'JUSTIFICATION:': 'justification',
+                                 'SOURCE_SNIPPET:': 'snippet'}) == {
+        'answer': "In March after the rains.",
+        'justification': "Page 1 says so.",
+        'snippet': "completed in March"
+    }
+
+
+def test_streamed_markers_match_a_single_parse():
+    text = "ANSWER: In March.\nJUSTIFICATION: Page 1.\nSOURCE_SNIPPET: completed in March"
+    markers = {'ANSWER:': 'answer', 'JUSTIFICATION:': 'justification', 'SOURCE_SNIPPET:': 'snippet'}
+    parser = SectionStreamParser(markers)
+    seen = feed_in_chunks(parser, text)
+    # A half-written marker never leaks into the previous section
+    assert all("JUST" not in sections['answer'] for sections in seen)
+    assert parser.close() == parse_sections(text, markers)
+
+
+def test_json_is_read_from_fences_with_trailing_commas():
+    text = '```json\n{"answer": "In March", "Source Snippet": "completed in March",}\n```'
+    parser = ANSWER.parser()
+    parser.feed(text)
+    assert parser.close() == {'answer': "In March", 'justification': "", 'source_snippet': "completed in March"}
+    assert not parser.valid_json
+
+
+def test_truncated_json_keeps_what_was_written():
+    parsed = ANSWER.parse('{"answer": "In March", "justification": "The census on page 1 \\u00')
+    assert parsed['answer'] == "In March"
+    # The escape cut off mid-way is dropped rather than failing the parse
+    assert parsed['justification'] == "The census on page 1"
+    assert ANSWER.parse('{"answer": "In March", "justif')['answer'] == "In March"
+
+
+def test_streamed_json_shows_fields_as_they_arrive():
+    text = json.dumps({'answer': "The census was completed in March.", 'justification': "Page 1"})
+    seen = feed_in_chunks(ANSWER.parser(), text, size=7)
+    answers = [sections['answer'] for sections in seen if sections['answer']]
+    assert answers[0] != answers[-1]
+    assert all("The census was completed in March.".startswith(answer) for answer in answers)
+    assert seen[-1]['justification'] == "Page 1"
+
+
+def test_list_schemas_read_json_and_numbered_markers():
+    bare = '[{"question": "Why?", "guidance": "Look"}]'
+    assert QUESTIONS.parse(bare, count=2) == [{'question': "Why?", 'answer_guidance': "Look"},
+                                              {'question': "", 'answer_guidance': ""}]
+    markers = "QUESTION_1: Why?\nGUIDANCE_1: Look\nQUESTION_2: How?\nGUIDANCE_2: Compare"
+    assert QUESTIONS.parse(markers, count=2) == [{'question': "Why?", 'answer_guidance': "Look"},
+                                                 {'question': "How?", 'answer_guidance': "Compare"}]
+
+
+def test_missing_and_merge():
+    parsed = QUESTIONS.parse('{"questions": [{"question": "Why?"}, {"guidance": "Compare"}]}', count=2)
+    assert QUESTIONS.missing(parsed) == [1]
+    repaired = [{'question': "Ignored", 'answer_guidance': "Look"}, {'question': "How?", 'answer_guidance': ""}]
+    assert QUESTIONS.merge(parsed, repaired) == [{'question': "Why?", 'answer_guidance': "Look"},
+                                                 {'question': "How?", 'answer_guidance': "Compare"}]
+    assert ANSWER.missing(ANSWER.parse('{"justification": "Page 1"}')) == ['answer']
+
+
+def make_assistant(respond):
+    client = ModelClient(StubBackend(respond), requests_per_minute=1e6, tokens_per_minute=1e9)
+    processed = DocumentProcessor().preprocess_text("The quokka census was completed in March. " * 40)
+    return GeminiDocumentAssistant(processed, client=client)
+
+
+def test_unreadable_responses_are_reformatted_once():
+    prompts = []
+
+    def respond(prompt):
+        prompts.append(prompt)
+        if "could not be read" in prompt:
+            return json.dumps({'answer': "In March", 'source_snippet': "completed in March"})
+        return "The census was done in March, I think."
+
+    result = make_assistant(respond).answer_question("When was the census completed?")
+    assert result['answer'] == "In March"
+    assert result['snippet_verification']['exact']
+    assert len(prompts) == 2
+    # The re-ask carries the response, not the document
+    assert "I think" in prompts[1] and "quokka" not in prompts[1]
+
+
+def test_valid_json_is_not_reformatted():
+    prompts = []
+
+    def respond(prompt):
+        prompts.append(prompt)
+        return json.dumps({'justification': "Not stated"})
+
+    make_assistant(respond).answer_question("When was the census completed?")
+    assert len(prompts) == 1
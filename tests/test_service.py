@@ -0,0 +1,40 @@
+import json
+import re
+
+from model_client import ModelClient, StubBackend
+from service import AssistantService
+from state_store import SQLiteStateStore
+
+TEXT = ("The quokka census was completed in March. Numbats eat termites.\n\n" * 50).encode()
+
+
+def respond(prompt):
+    """Numbered questions for question-bank prompts, the stub's echo otherwise"""
+    wanted = re.search(r"generate exactly (\d+) challenging questions", prompt)
+    if not wanted:
+        return StubBackend.echo(prompt)
+    types = ('comprehension', 'analysis', 'inference')
+    return json.dumps({'questions': [
+        {'question': f"Question {n}?", 'type': types[n % 3], 'section': "1", 'answer_guidance': "Look"}
+        for n in range(int(wanted.group(1)))
+    ]})
+
+
+def make_service(state):
+    client = ModelClient(StubBackend(respond), requests_per_minute=1e6, tokens_per_minute=1e9)
+    return AssistantService(client, state=state)
+
+
+def test_questions_drawn_during_processing_are_not_served_again(tmp_path):
+    state = SQLiteStateStore(str(tmp_path / 'state.db'))
+    service = make_service(state)
+    doc_hash = service.ingest(TEXT, "census.txt")['document_hash']
+    # As while a background job is still summarizing
+    service._save_entry(doc_hash, dict(service._entry(doc_hash), stage='summarizing'))
+
+    first = service.challenge(doc_hash, session_id='s')
+    assert state.get(service._pool_key(doc_hash))
+
+    # Another worker (or a restart) sees the same bank, so the session gets new questions
+    second = make_service(state).challenge(doc_hash, session_id='s')
+    assert not {q['question'] for q in first} & {q['question'] for q in second}
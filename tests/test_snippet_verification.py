@@ -0,0 +1,84 @@
+import pytest
+
+from assistant import DocumentProcessor
+from retrieval import DocumentRetriever
+from snippet_verification import SnippetIndex
+from text_spill import SpillStore
+
+PAGES = [
+    "The quokka census was completed in March by volunteers on Rottnest Island. "
+    "Counts were taken at dawn and dusk along fixed transects.",
+    "Numbats eat termites almost exclusively, up to twenty thousand a day. "
+    "They forage by day because the termites are near the surface when the soil is warm.",
+    "He said the survey would be repeated. The said survey found more quokkas than expected.",
+]
+TEXT = "\n\n".join(PAGES)
+OFFSETS = [0, len(PAGES[0]) + 2, len(PAGES[0]) + len(PAGES[1]) + 4]
+
+
+@pytest.fixture
+def index():
+    return SnippetIndex(TEXT, OFFSETS)
+
+
+def test_verbatim_quotes_ignore_case_and_punctuation(index):
+    result = index.verify("NUMBATS EAT TERMITES -- almost exclusively")
+    assert result['found'] and result['exact'] and not result['hallucinated']
+    assert result['page'] == result['end_page'] == 2
+    assert TEXT[result['start']:result['end']] == "Numbats eat termites almost exclusively"
+    assert result['text'] == TEXT[result['start']:result['end']]
+
+
+def test_only_whole_words_match_verbatim(index):
+    result = index.verify("he said")
+    assert TEXT[result['start']:result['end']] == "He said"
+    assert index.verify("said survey")['start'] == TEXT.index("said survey found")
+
+
+def test_elided_quotes_span_their_fragments(index):
+    result = index.verify("The quokka census was completed ... along fixed transects")
+    assert result['found'] and not result['exact']
+    assert result['confidence'] == 1.0
+    assert TEXT[result['start']:result['end']] == PAGES[0][:-1]
+
+
+def test_elided_fragments_out_of_order_do_not_count(index):
+    result = index.verify("along fixed transects ... The quokka census was completed")
+    assert result['confidence'] < 1.0
+
+
+def test_copied_page_labels_are_ignored(index):
+    result = index.verify("[Page 2] They forage by day because the termites are near the surface")
+    assert result['found'] and result['exact']
+    assert result['page'] == 2
+    assert index.verify("[Passage 1, page 1] Counts were taken at dawn and dusk")['exact']
+
+
+def test_reworded_quotes_are_found_with_lower_confidence(index):
+    result = index.verify("The quokka census was finished in March by volunteers on Rottnest Island")
+    assert result['found'] and not result['exact']
+    assert 0.5 <= result['confidence'] < 1.0
+    assert result['page'] == 1
+
+
+def test_fabricated_snippets_are_flagged(index):
+    result = index.verify("Wombats dig burrows that are shared by several families of echidnas")
+    assert result == {'found': False, 'hallucinated': True, 'exact': False, 'confidence': 0.0}
+    assert index.verify("") is None
+    assert index.verify("... [Page 3]") is None
+
+
+def test_mapped_texts_are_indexed_and_checked_in_place(tmp_path):
+    mapped = SpillStore(str(tmp_path)).put('doc', TEXT + " Café naïve")
+    index = SnippetIndex(mapped, OFFSETS)
+    assert index.text is mapped
+    result = index.verify("café NAÏVE")
+    assert result['exact'] and result['text'] == "Café naïve"
+    assert index.verify("Numbats eat termites almost exclusively")['page'] == 2
+
+
+def test_retrievers_build_the_index_on_first_use():
+    retriever = DocumentRetriever(DocumentProcessor().preprocess_text(TEXT, OFFSETS))
+    assert getattr(retriever, '_snippet_index', None) is None
+    assert retriever.snippet_index().verify("Numbats eat termites")['found']
+    assert retriever.snippet_index() is retriever.snippet_index()
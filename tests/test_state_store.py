@@ -0,0 +1,69 @@
+import pickle
+import time
+
+import pytest
+
+from conversation_memory import ConversationMemory
+from model_client import ModelClient, StubBackend
+from service import AssistantService
+from state_store import MemoryStateStore, SQLiteStateStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStateStore()
+    return SQLiteStateStore(str(tmp_path / 'state.db'))
+
+
+def test_values_round_trip_and_expire(store):
+    store.put('session', {'turns': [{'question': "Why?"}], 'count': 2})
+    assert store.get('session') == {'turns': [{'question': "Why?"}], 'count': 2}
+    store.put('short', [1, 2], ttl=0.001)
+    time.sleep(0.01)
+    assert store.get('short') is None
+    store.delete('session')
+    assert store.get('session') is None
+
+
+def test_counters_are_integers(store):
+    assert store.add('tokens', 5, ttl=60) == 5
+    assert store.add('tokens', 7) == 12
+    assert isinstance(store.add('tokens', 0), int)
+
+
+def test_sqlite_store_keeps_json_only(tmp_path):
+    store = SQLiteStateStore(str(tmp_path / 'state.db'))
+    with pytest.raises(TypeError):
+        store.put('memory', ConversationMemory())
+    # Rows pickled by an older version are not unpickled
+    store._conn.execute("INSERT INTO state (key, value) VALUES ('old', ?)", (pickle.dumps({'a': 1}),))
+    store._conn.commit()
+    assert store.get('old') is None
+
+
+def test_conversation_memory_survives_a_round_trip():
+    memory = ConversationMemory(max_turns=2, token_budget=400)
+    for n in range(5):
+        memory.add(f"Question {n}?", {'answer': f"Answer {n}. More detail.", 'justification': "Because"})
+    restored = ConversationMemory.from_dict(memory.to_dict(), max_turns=2, token_budget=400)
+    assert restored.prompt_block() == memory.prompt_block()
+    assert restored.history() == memory.history()
+    assert restored.turn_count == 5
+
+
+def test_a_second_worker_rebuilds_documents_and_sessions(tmp_path):
+    path = str(tmp_path / 'state.db')
+    client = ModelClient(StubBackend(), requests_per_minute=1e6, tokens_per_minute=1e9)
+    text = ("The quokka census was completed in March. Numbats eat termites.\n\n" * 50).encode()
+
+    first = AssistantService(client, state=SQLiteStateStore(path))
+    doc_hash = first.ingest(text, "census.txt")['document_hash']
+    first.ask(doc_hash, "When was the census completed?", session_id='s')
+
+    second = AssistantService(client, state=SQLiteStateStore(path))
+    assert second.document(doc_hash) == first.document(doc_hash)
+    second.ask(doc_hash, "What do numbats eat?", session_id='s')
+    session = second.session(doc_hash, 's')
+    assert [turn['question'] for turn in session['history']] == ["When was the census completed?",
+                                                                "What do numbats eat?"]
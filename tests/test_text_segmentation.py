@@ -0,0 +1,66 @@
+import pickle
+import random
+import re
+
+from text_segmentation import segment_text
+
+
+def reference_clean(text):
+    """The straightforward two-pass normalization segment_text must agree with"""
+    return re.sub(r"\s+", lambda m: "\n\n" if m.group().count("\n") >= 2 else " ", text).strip()
+
+
+def test_whitespace_and_paragraph_breaks_are_normalized():
+    raw = '  First sentence.  Second one?\tYes!\n\n\nNew "paragraph." Here  \n'
+    result = segment_text(raw)
+    assert result['full_text'] == 'First sentence. Second one? Yes!\n\nNew "paragraph." Here'
+    assert list(result['sentences']) == ['First sentence.', 'Second one?', 'Yes!', 'New "paragraph."', 'Here']
+    assert list(result['paragraphs']) == ['First sentence. Second one? Yes!', 'New "paragraph." Here']
+    assert result['word_count'] == 8
+    assert result['char_count'] == len(result['full_text'])
+
+
+def test_single_newlines_join_lines_of_one_paragraph():
+    result = segment_text("a line broken\nin the middle.\r\nAnd another.")
+    assert result['full_text'] == "a line broken in the middle. And another."
+    assert len(result['paragraphs']) == 1
+    assert list(result['sentences']) == ["a line broken in the middle.", "And another."]
+
+
+def test_matches_the_reference_normalization_on_random_text():
+    rng = random.Random(7)
+    pieces = ["word", "end.", "ask?", '"quote."', "(aside)", " ", "  ", "\n", "\n\n", "\t", " \n \n "]
+    for _ in range(200):
+        raw = "".join(rng.choice(pieces) + rng.choice(["", " "]) for _ in range(rng.randint(0, 40)))
+        result = segment_text(raw)
+        assert result['full_text'] == reference_clean(raw), repr(raw)
+        for sentence in result['sentences']:
+            assert sentence and sentence == sentence.strip()
+
+
+def test_page_offsets_follow_the_cleaned_text():
+    pages = ["Page one ends here.\n", "   Page two\t\tstarts  late.\n\n", "\n\nPage three."]
+    raw = "".join(pages)
+    raw_offsets = [0, len(pages[0]), len(pages[0]) + len(pages[1])]
+    result = segment_text(raw, raw_offsets)
+    cleaned = result['full_text']
+    starts = [cleaned[offset:].split()[0] for offset in result['page_offsets']]
+    assert starts == ["Page", "Page", "Page"]
+    assert [cleaned[offset:].split()[1] for offset in result['page_offsets']] == ["one", "two", "three."]
+    assert result['page_offsets'] == sorted(result['page_offsets'])
+
+
+def test_empty_text():
+    result = segment_text("", [0])
+    assert result['full_text'] == ""
+    assert result['word_count'] == 0
+    assert len(result['sentences']) == 0 and len(result['paragraphs']) == 0
+    assert result['page_offsets'] == [0]
+
+
+def test_span_lists_slice_and_pickle_like_lists():
+    sentences = segment_text("One. Two. Three.")['sentences']
+    assert sentences[1:] == ["Two.", "Three."]
+    assert sentences[-1] == "Three."
+    assert sentences.span(1) == (5, 9)
+    assert list(pickle.loads(pickle.dumps(sentences))) == ["One.", "Two.", "Three."]
@@ -0,0 +1,100 @@
+import codecs
+import io
+import os
+import sys
+import time
+
+import pytest
+
+import text_spill
+from text_spill import MappedText, SpillStore, detect_encoding, iter_text_blocks
+
+FRENCH = "Café crème brûlée, naïve façade. "
+
+
+def test_byte_order_marks_win():
+    assert detect_encoding(codecs.BOM_UTF8 + b"plain") == 'utf-8-sig'
+    assert detect_encoding("quokka".encode('utf-16')) == 'utf-16'
+    assert detect_encoding(codecs.BOM_UTF32_LE + "q".encode('utf-32-le')) == 'utf-32'
+
+
+def test_utf8_is_kept_even_when_the_sample_cuts_a_character():
+    data = FRENCH.encode('utf-8')
+    assert detect_encoding(data) == 'utf-8'
+    assert detect_encoding(data[:4]) == 'utf-8'
+
+
+def test_western_text_falls_back_to_windows_1252(monkeypatch):
+    data = (FRENCH * 20).encode('cp1252')
+    assert detect_encoding(data) == 'cp1252'
+    # Without charset-normalizer every non-UTF-8 text is read as Windows-1252
+    monkeypatch.setitem(sys.modules, 'charset_normalizer', None)
+    assert detect_encoding(data) == text_spill.FALLBACK_ENCODING
+
+
+@pytest.mark.parametrize('encoding', ['utf-8', 'utf-8-sig', 'utf-16', 'cp1252'])
+def test_blocks_decode_characters_split_between_them(encoding, monkeypatch):
+    # The first read is at least the encoding sample
+    monkeypatch.setattr(text_spill, 'SAMPLE_SIZE', 16)
+    text = FRENCH * 50
+    blocks = list(iter_text_blocks(io.BytesIO(text.encode(encoding)), block_size=7))
+    assert "".join(blocks) == text
+    assert len(blocks) > 1
+
+
+def test_undecodable_bytes_are_replaced():
+    data = FRENCH.encode('utf-8') + b"\xff\xfe" + b"end"
+    assert "".join(iter_text_blocks(io.BytesIO(data), encoding='utf-8')) == FRENCH + "��end"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SpillStore(str(tmp_path))
+
+
+@pytest.mark.parametrize('text', [
+    "quokka " * 2000,
+    # Multi-byte characters straddling checkpoints, including one outside the BMP
+    (FRENCH + "\U0001f998 ") * 400,
+])
+def test_mapped_text_behaves_like_the_string(store, text):
+    mapped = store.put('doc', text)
+    assert len(mapped) == len(text)
+    assert str(mapped) == text
+    step = MappedText.CHECKPOINT_CHARS
+    for start, stop in [(0, 10), (step - 3, step + 3), (5, 3 * step + 1), (len(text) - 5, len(text) + 10),
+                        (-20, -5), (7, 7)]:
+        assert mapped[start:stop] == text[start:stop]
+    assert mapped[1:200:7] == text[1:200:7]
+    assert mapped[-1] == text[-1] and mapped[step] == text[step]
+    with pytest.raises(IndexError):
+        mapped[len(text)]
+    assert mapped.encode() == text.encode('utf-8')
+
+
+def test_open_rebuilds_the_view_from_the_file(store):
+    text = (FRENCH + "\U0001f998 ") * 400
+    written = store.put('doc', text)
+    opened = SpillStore(store.directory).open('doc')
+    assert (opened.length, opened.size) == (written.length, written.size)
+    assert list(opened.checkpoints) == list(written.checkpoints)
+    assert opened[5000:5100] == text[5000:5100]
+    store.put('ascii', "quokka " * 10)
+    # ASCII texts need no checkpoints, as when written
+    assert store.open('ascii').checkpoints is None
+    assert store.open('missing') is None
+
+
+def test_eviction_removes_the_oldest_files_and_their_mappings(tmp_path):
+    store = SpillStore(str(tmp_path), max_disk_bytes=15000)
+    old = store.put('old', "a" * 10000)
+    assert old[:3] == "aaa"
+    assert old.path in text_spill._maps
+    past = time.time() - 60
+    os.utime(old.path, (past, past))
+
+    new = store.put('new', "b" * 10000)
+    assert not old.available()
+    assert old.path not in text_spill._maps
+    assert new.available() and new[:3] == "bbb"
+    assert store.open('old') is None
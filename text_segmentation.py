@@ -0,0 +1,122 @@
+import re
+from array import array
+from collections.abc import Sequence
+from typing import Dict, List, Optional, Tuple
+
+
+# Every match starts with one whitespace or sentence-ending character, so the
+# scanner skips ahead on that single character class; the common single space
+# between words never matches and never reaches Python.
+SEGMENT_EVENTS = re.compile(
+    r'[\s.!?](?:'
+    r'(?<=[.!?])["\')\]]?\s+'          # sentence end, optionally after a closing quote
+    r'|(?<=\s)\s+'                     # run of two or more whitespace characters
+    r'|(?<=[^\S ])\s*'                 # tab, newline or other non-space whitespace
+    r'|(?<=\A\s)|(?<=\s)\Z'            # single space at either end
+    r')'
+)
+SENTENCE_PUNCTUATION = '.!?'
+CLOSING_PUNCTUATION = '"\')]'
+
+
+class SpanList(Sequence):
+    """Read-only list of substrings of one text, stored as offset arrays.
+
+    Behaves like the list of strings it replaces (``len``, indexing,
+    iteration) but keeps only two integer arrays next to the shared text.
+    """
+
+    __slots__ = ('text', 'starts', 'ends')
+
+    def __init__(self, text: str, starts: array, ends: array):
+        self.text = text
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.text[self.starts[i]:self.ends[i]] for i in range(*index.indices(len(self)))]
+        return self.text[self.starts[index]:self.ends[index]]
+
+    def span(self, index: int) -> Tuple[int, int]:
+        return self.starts[index], self.ends[index]
+
+    def __getstate__(self):
+        return self.text, self.starts, self.ends
+
+    def __setstate__(self, state):
+        self.text, self.starts, self.ends = state
+
+
+def segment_text(text: str, page_offsets: Optional[List[int]] = None) -> Dict:
+    """Normalize whitespace and segment text in a single pass.
+
+    Runs of whitespace become one space, or a blank line when they contain a
+    paragraph break (two or more newlines). The same scan records sentence
+    and paragraph spans and maps the raw ``page_offsets`` onto the cleaned
+    text; only runs that change the text or close a span cost a Python call.
+    Sentences end after ``.``, ``!`` or ``?`` (optionally followed by a
+    closing quote or bracket) and at paragraph ends.
+    """
+    length = len(text)
+    sentence_starts, sentence_ends = array('q'), array('q')
+    paragraph_starts, paragraph_ends = array('q'), array('q')
+    raw_pages = page_offsets or []
+    pages = []
+    state = {'removed': 0, 'sentence': 0, 'paragraph': 0}
+
+    def close_span(starts: array, ends: array, key: str, end: int, next_start: int) -> None:
+        if end > state[key]:
+            starts.append(state[key])
+            ends.append(end)
+        state[key] = next_start
+
+    def replace(match) -> str:
+        raw_start, raw_end = match.span()
+        run = match.group()
+        punctuation = ''
+        if run[0] in SENTENCE_PUNCTUATION:
+            keep = 2 if run[1] in CLOSING_PUNCTUATION else 1
+            punctuation, run = run[:keep], run[keep:]
+            raw_start += keep
+        out_start = raw_start - state['removed']
+
+        if raw_start == 0 or raw_end == length:
+            replacement = ''
+        elif run.count('\n') >= 2:
+            replacement = '\n\n'
+        else:
+            replacement = ' '
+        next_start = out_start + len(replacement)
+
+        # Pages starting before this run map directly; pages starting inside it begin at the next word
+        while len(pages) < len(raw_pages) and raw_pages[len(pages)] < raw_end:
+            raw_page = raw_pages[len(pages)]
+            pages.append(raw_page - state['removed'] if raw_page < raw_start else next_start)
+
+        if replacement == '\n\n':
+            close_span(sentence_starts, sentence_ends, 'sentence', out_start, next_start)
+            close_span(paragraph_starts, paragraph_ends, 'paragraph', out_start, next_start)
+        elif replacement and punctuation:
+            close_span(sentence_starts, sentence_ends, 'sentence', out_start, next_start)
+
+        state['removed'] += len(run) - len(replacement)
+        return punctuation + replacement
+
+    cleaned = SEGMENT_EVENTS.sub(replace, text)
+    close_span(sentence_starts, sentence_ends, 'sentence', len(cleaned), len(cleaned))
+    close_span(paragraph_starts, paragraph_ends, 'paragraph', len(cleaned), len(cleaned))
+    pages.extend(raw_page - state['removed'] for raw_page in raw_pages[len(pages):])
+
+    return {
+        'full_text': cleaned,
+        'sentences': SpanList(cleaned, sentence_starts, sentence_ends),
+        'paragraphs': SpanList(cleaned, paragraph_starts, paragraph_ends),
+        # Words are separated by exactly one space or one blank line after cleaning
+        'word_count': cleaned.count(' ') + cleaned.count('\n\n') + 1 if cleaned else 0,
+        'char_count': len(cleaned),
+        'page_offsets': pages
+    }
@@ -0,0 +1,285 @@
+import codecs
+import mmap
+import os
+import tempfile
+import threading
+from array import array
+from typing import Dict, Iterator, Optional, Tuple
+
+
+# Bytes read per block when decoding an upload, and sampled to guess its encoding
+BLOCK_SIZE = 1024 * 1024
+SAMPLE_SIZE = 64 * 1024
+
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+# Used when the text is not UTF-8 and charset-normalizer isn't installed; every byte decodes
+FALLBACK_ENCODING = 'cp1252'
+
+
+def detect_encoding(sample: bytes) -> str:
+    """Best guess at the encoding of a text file from its first bytes.
+
+    A byte order mark wins; otherwise UTF-8 is kept if the sample decodes
+    (a multi-byte character cut off at the end of the sample is fine), then
+    charset-normalizer is asked when installed, then Windows-1252.
+    """
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    try:
+        from charset_normalizer import from_bytes
+    except ImportError:
+        return FALLBACK_ENCODING
+    matches = list(from_bytes(sample))
+    if not matches:
+        return FALLBACK_ENCODING
+    # Western code pages are hard to tell apart on a sample; Windows-1252 wins a tie
+    best = min(match.chaos for match in matches)
+    if any(match.encoding == FALLBACK_ENCODING and match.chaos <= best for match in matches):
+        return FALLBACK_ENCODING
+    return matches[0].encoding
+
+
+def iter_text_blocks(file, block_size: int = BLOCK_SIZE, encoding: Optional[str] = None) -> Iterator[str]:
+    """Decode a binary file in blocks of ``block_size`` bytes.
+
+    The encoding is detected from the first block unless given. Characters
+    split across blocks are carried over by an incremental decoder, and
+    undecodable bytes become U+FFFD rather than failing the whole file.
+    """
+    first = file.read(max(block_size, SAMPLE_SIZE))
+    decoder = codecs.getincrementaldecoder(encoding or detect_encoding(first[:SAMPLE_SIZE]))(errors='replace')
+    block = first
+    while block:
+        text = decoder.decode(block)
+        if text:
+            yield text
+        block = file.read(block_size)
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+class MappedText:
+    """Read-only, str-like view of a document text stored in a memory-mapped file.
+
+    The text is kept as UTF-8 on disk and mapped on first use, so its pages
+    live in the OS page cache, shared by every session and worker process
+    on the host, rather than in each process's heap. ``len`` and slicing
+    behave as on the original ``str``: character offsets are found through
+    a checkpoint every ``CHECKPOINT_CHARS`` characters, so a slice decodes
+    at most one extra checkpoint span on each side. Pickling keeps only the
+    path and the checkpoints, never the text.
+    """
+
+    CHECKPOINT_CHARS = 4096
+
+    def __init__(self, path: str, length: int, size: int, checkpoints: Optional[array] = None):
+        self.path = path
+        self.length = length
+        self.size = size
+        # Byte offset of every CHECKPOINT_CHARS-th character; None for ASCII, where offsets coincide
+        self.checkpoints = checkpoints
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                return self[start:stop][::step] if start < stop else ""
+            return self._slice(start, stop)
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("text index out of range")
+        return self._slice(index, index + 1)
+
+    def __str__(self) -> str:
+        return self._slice(0, self.length)
+
+    def __repr__(self) -> str:
+        return f"MappedText({self.path!r}, length={self.length})"
+
+    def encode(self, encoding: str = 'utf-8', errors: str = 'strict') -> bytes:
+        data = bytes(self._map()[:self.size])
+        if encoding.lower().replace('-', '') == 'utf8':
+            return data
+        return data.decode('utf-8', 'surrogatepass').encode(encoding, errors)
+
+    def available(self) -> bool:
+        """Whether the backing file still exists; if it was evicted, this process's mapping of it is dropped"""
+        if os.path.exists(self.path):
+            return True
+        _release(self.path)
+        return False
+
+    def _slice(self, start: int, stop: int) -> str:
+        if start >= stop:
+            return ""
+        data = self._map()
+        if self.checkpoints is None:
+            return data[start:stop].decode('ascii')
+        step = self.CHECKPOINT_CHARS
+        first = start // step
+        last = -(-stop // step)
+        byte_start = self.checkpoints[first]
+        byte_stop = self.checkpoints[last] if last < len(self.checkpoints) else self.size
+        skip = start - first * step
+        return data[byte_start:byte_stop].decode('utf-8', 'surrogatepass')[skip:skip + stop - start]
+
+    def _map(self) -> mmap.mmap:
+        mapped = _maps.get(self.path)
+        if mapped is None:
+            with _maps_lock:
+                mapped = _maps.get(self.path)
+                if mapped is None:
+                    if self.size == 0:
+                        return b""
+                    with open(self.path, 'rb') as f:
+                        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    _maps[self.path] = mapped
+                    try:
+                        # Mark it recently used for SpillStore eviction
+                        os.utime(self.path, None)
+                    except OSError:
+                        pass
+        return mapped
+
+
+# One mapping per file per process, however many sessions or entries refer to it
+_maps: Dict[str, mmap.mmap] = {}
+_maps_lock = threading.Lock()
+
+
+def _release(path: str) -> None:
+    """Forget the mapping of a replaced or deleted file.
+
+    Views look their mapping up on every read, so this drops the last
+    long-lived reference; the file is unmapped, and a deleted file's disk
+    space freed, as soon as reads already in progress finish.
+    """
+    with _maps_lock:
+        _maps.pop(path, None)
+
+
+class SpillStore:
+    """Directory of document texts that ``MappedText`` views are backed by.
+
+    Texts are written once per document key and read through memory maps,
+    so sessions asking about the same document share one copy. Files are
+    trimmed to ``max_disk_bytes``, least recently used first. Evicting a file
+    drops its mapping in this process, and other processes drop theirs when
+    they next find it gone (``MappedText.available``), so its disk space is
+    actually freed rather than held until every process exits. Other
+    workers find a text again by its key (``open``). With several hosts
+    behind a shared state store the directory must be on a shared
+    filesystem, or an evicted or remote text is treated as a missing document.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_disk_bytes: int = 4 * 1024 ** 3):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "research_assistant_texts")
+        self.max_disk_bytes = max_disk_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def put(self, key: str, text: str) -> MappedText:
+        """Write ``text`` for ``key`` and return a mapped view of it"""
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            size, checkpoints = self._write(f, text)
+        # Readers that mapped an older copy keep it; the content is the same
+        os.replace(tmp_path, path)
+        _release(path)
+        self._evict()
+        return MappedText(path, len(text), size, checkpoints)
+
+    def open(self, key: str) -> Optional[MappedText]:
+        """Mapped view of the text written for ``key`` (by any process), or None if it is gone"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                size, length, checkpoints = self._scan(f)
+        except FileNotFoundError:
+            return None
+        return MappedText(path, length, size, checkpoints)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.txt")
+
+    @staticmethod
+    def _scan(f) -> Tuple[int, int, Optional[array]]:
+        """Size, length and checkpoints of a written text, read a block at a time"""
+        step = MappedText.CHECKPOINT_CHARS
+        decoder = codecs.getincrementaldecoder('utf-8')('surrogatepass')
+        checkpoints = array('q')
+        size = length = 0
+        while True:
+            block = f.read(BLOCK_SIZE)
+            text = decoder.decode(block, final=not block)
+            done = 0
+            for start in range(-length % step, len(text), step):
+                size += len(text[done:start].encode('utf-8', 'surrogatepass'))
+                checkpoints.append(size)
+                done = start
+            size += len(text[done:].encode('utf-8', 'surrogatepass'))
+            length += len(text)
+            if not block:
+                break
+        # put writes ASCII texts without checkpoints
+        return size, length, None if size == length else checkpoints
+
+    @staticmethod
+    def _write(f, text: str) -> Tuple[int, Optional[array]]:
+        if text.isascii():
+            # Encoded a block at a time so writing never holds a second full copy
+            for start in range(0, len(text), BLOCK_SIZE):
+                f.write(text[start:start + BLOCK_SIZE].encode('ascii'))
+            return len(text), None
+        step = MappedText.CHECKPOINT_CHARS
+        checkpoints = array('q')
+        size = 0
+        for start in range(0, len(text), step):
+            data = text[start:start + step].encode('utf-8', errors='surrogatepass')
+            checkpoints.append(size)
+            f.write(data)
+            size += len(data)
+        return size, checkpoints
+
+    def _evict(self) -> None:
+        files = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.txt'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        files.sort()
+        # The newest file is the one just written
+        for _, size, path in files[:-1]:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+            _release(path)